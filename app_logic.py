@@ -1,32 +1,82 @@
-from kivy import Logger
+import os
+import threading
+from collections.abc import Callable
+
+from kivy.logger import Logger
 
 from databank import JSONDataBank
 from file_utils import scan_images_input
-from image_nodes import EvaluatedPic, ImageNodesHolder, NodePics
+from image_metadata import ImageMetadata, refresh_metadata
+from image_nodes import (EvaluatedPic, ImageNodesHolder, ImageStoragePath,
+                         NodePics)
+from integrity import DatabankVerifier, RepairPlan
+from move_plan import MovePlan
+from session import (SIMILARITY_ORDER, UNEVALUATED_ORDER, WALK_ORDER,
+                     SessionIndex, SessionState)
+
+WINDOW_RADIUS = 5
+"""Amount of images materialized on each side of the cursor."""
+
+type MetadataUpdate = tuple[
+    EvaluatedPic, ImageStoragePath, ImageMetadata | None, ImageMetadata | None
+]
+"""Image with the path and the metadata it had when its headers were read
+in the background, and the read metadata."""
+
+
+def window_indices(index: int, limit: int, radius: int = WINDOW_RADIUS) -> set[int]:
+    """Indices of images within the radius around the index, wrapping around
+    the ends of the session like the cursor does."""
+    if limit <= 2 * radius + 1:
+        return set(range(limit))
+    return {(index + shift) % limit for shift in range(-radius, radius + 1)}
 
 
 class OnScreenImageHandler:
     """Manager class that keeps information on the current image (where the cursor
-    is at) and also moves the cursor."""
+    is at) and also moves the cursor.
+
+    Only image paths are kept for the whole session. EvaluatedPic objects are
+    materialized for a sliding window around the cursor and released when they
+    leave it, unless they're already posted to the nodes holder which keeps
+    them anyway.
+    """
 
-    def __init__(self, input_path: str, nodes_holder: ImageNodesHolder | None = None):
-        """Validate images in holder and physically stored images."""
-        physical_images: list[str] = scan_images_input(input_path)
-        self.cursor = ListCursor(len(physical_images))
+    def __init__(
+        self,
+        input_path: str,
+        nodes_holder: ImageNodesHolder | None = None,
+        deferred: bool = False,
+    ):
+        """Take images from the holder or scan the input path if there's no holder.
+        In deferred mode images are moved only when planned moves are committed.
+        """
         self.preserve_tags = False
+        self.input_path = input_path
+        self.order = WALK_ORDER
+        self.__materialized: dict[int, EvaluatedPic] = {}
+        self.__window: set[int] = set()
 
         if nodes_holder is not None:
             self._nodes_holder = nodes_holder
-            self.__images: list[EvaluatedPic] = []
-            self.scan_images(physical_images)
+            self._nodes_holder.deferred = deferred
+            self.__paths: list[ImageStoragePath] = []
+            self.__load_nodes_images()
             self.scan_mode_append = False
         else:
-            self._nodes_holder = ImageNodesHolder()
-            self.__images: list[EvaluatedPic] = [
-                EvaluatedPic(path) for path in physical_images
-            ]
+            self._nodes_holder = ImageNodesHolder(deferred=deferred)
+            self.__paths: list[ImageStoragePath] = scan_images_input(input_path)
             self.scan_mode_append = True
 
+        self.__session_index = SessionIndex()
+        for idx, path in enumerate(self.__paths):
+            pic = self.__materialized.get(idx)
+            if pic is not None:
+                self.__session_index.add(path, pic.evals, pic.tags)
+            else:
+                self.__session_index.add(path, {}, "")
+
+        self.cursor = ListCursor(len(self.__paths))
         self.__assign_current()
 
     def next(self) -> None:
@@ -38,39 +88,255 @@ class OnScreenImageHandler:
         self.__assign_current()
 
     def save_current(self, tags) -> None:
+        """Fit the current image to its node, unless it's already in a fitting
+        one, so browsing through evaluated images moves nothing. Images whose
+        files are missing are left as they are for the databank repair."""
+        old_path = self.current.storage_path
+        if self.current_missing:
+            Logger.warning(f"Not saving {old_path}, its file is missing")
+            return
         self.current.tags = tags
-        self._nodes_holder.post_pic(self.current)
+        try:
+            if not self._nodes_holder.is_fitted(self.current):
+                self._nodes_holder.post_pic(self.current)
+        except OSError as err:
+            Logger.error(f"Can't store {old_path}: {err}")
+            return
+        self.__session_index.update(old_path, self.current)
+
+    def save_pics(self, pics: NodePics) -> None:
+        """Fit several evaluated images to their nodes at once."""
+        for pic in pics:
+            self._nodes_holder.post_pic(pic)
+
+    def plan_moves(self) -> MovePlan:
+        """Plan physical moves for images evaluated in deferred mode."""
+        return MovePlan(self._nodes_holder)
 
     def save_eval_data(self) -> None:
+        """Save the databank and the session order with the cursor."""
         JSONDataBank.save(self._nodes_holder, append=self.scan_mode_append)
+        if not self.empty:
+            SessionState(self.input_path, self.order, self.paths, int(self.cursor)).save()
+
+    def order_by(self, order: str) -> None:
+        """Reorder the session images by a precomputed order of the session index."""
+        self.order = order
+        self.apply_order(self.__session_index.order(order))
+
+    def open_session(self, order: str) -> None:
+        """Resume the saved session of the input path if it had the same order,
+        otherwise order the images. Then move to the next image to evaluate,
+        unless the order puts evaluated images first."""
+        if not self.__resume(order):
+            self.order_by(order)
+        if order in (WALK_ORDER, UNEVALUATED_ORDER):
+            self.jump_to_unevaluated()
+
+    def open_similarity_session(self, ordered_paths: list[ImageStoragePath]) -> None:
+        """Order the images by their similarity order and move to the next image
+        to evaluate. The session is saved under its own order, so reopening the
+        input path in another order doesn't resume it."""
+        self.order = SIMILARITY_ORDER
+        self.apply_order(ordered_paths)
+        self.jump_to_unevaluated()
+
+    def __resume(self, order: str) -> bool:
+        """Restore the order and the cursor the session with the same input path
+        and order was left with. Returns false if there's no such session."""
+        state = SessionState.load(self.input_path)
+        if state is None or state.order != order or self.empty:
+            return False
+        self.order = order
+        self.apply_order(state.paths)
+        self.jump_to(min(state.cursor, len(self.__paths) - 1))
+        return True
+
+    def jump_to(self, index: int) -> None:
+        """Move the cursor without saving the images in between."""
+        self.cursor.counter = index % len(self.__paths)
+        self.__assign_current()
+
+    def jump_to_unevaluated(self) -> None:
+        """Move the cursor to the first unevaluated image from the current one on,
+        wrapping around to the earlier ones, stay if there is none."""
+        self.__sync_paths()
+        start = int(self.cursor)
+        count = len(self.__paths)
+        for shift in range(count):
+            index = (start + shift) % count
+            if not self.__session_index.evaluated(self.__paths[index]):
+                self.jump_to(index)
+                return
 
     @property
     def empty(self) -> bool:
-        return len(self.__images) == 0
-
-    def scan_images(self, physical_images):
-        nodes_images: NodePics = self._nodes_holder.list_images()
-        for node_pic in nodes_images:
-            if node_pic.storage_path not in physical_images:
-                Logger.warning(f"{node_pic.storage_path} from databank does not exist, deleting")
-                node_pic.node_ref.pop_image(node_pic)
-            else:
-                Logger.debug(f"Added {node_pic.storage_path} to onscreen images handler")
-                self.__images.append(node_pic)
-
-        node_img_paths = [img.storage_path for img in nodes_images]
-        for pth in physical_images:
-            if pth not in node_img_paths:
-                Logger.warning("found physical image, not present in databank")
-                pic = EvaluatedPic(pth)
-                Logger.debug(f"Added {pic} to onscreen images handler")
-                self.__images.append(pic)
-                self._nodes_holder.post_pic(pic)
+        return len(self.__paths) == 0
+
+    @property
+    def current_missing(self) -> bool:
+        """True if the file of the current image doesn't exist, such an image
+        can't be evaluated until the databank is repaired."""
+        return not os.path.isfile(self.current.storage_path)
+
+    @property
+    def images(self) -> NodePics:
+        """Images of this session in cursor order. Materializes every image,
+        so it's meant for bounded sets of images."""
+        return [
+            self.__materialized.get(index) or EvaluatedPic(path)
+            for index, path in enumerate(self.__paths)
+        ]
+
+    @property
+    def paths(self) -> list[ImageStoragePath]:
+        """Current storage paths of the session images in cursor order."""
+        self.__sync_paths()
+        return self.__paths.copy()
+
+    def apply_order(self, ordered_paths: list[ImageStoragePath]) -> None:
+        """Reorder the session images and move the cursor to the first one.
+        Images missing from the ordered paths keep their relative order at the end.
+        """
+        self.__sync_paths()
+        positions = {path: idx for idx, path in enumerate(ordered_paths)}
+        self.__rearrange(
+            sorted(
+                range(len(self.__paths)),
+                key=lambda idx: positions.get(self.__paths[idx], len(positions) + idx),
+            )
+        )
+        self.cursor = ListCursor(len(self.__paths))
+        self.__assign_current()
+
+    def __rearrange(self, old_order: list[int]) -> None:
+        """Put images with the given old indices in that order, dropping the rest."""
+        self.__paths = [self.__paths[idx] for idx in old_order]
+        new_indices = {old_idx: new_idx for new_idx, old_idx in enumerate(old_order)}
+        self.__materialized = {
+            new_indices[idx]: pic
+            for idx, pic in self.__materialized.items()
+            if idx in new_indices
+        }
+        self.__window = {new_indices[idx] for idx in self.__window if idx in new_indices}
+
+    def apply_repair(self, repair_plan: RepairPlan) -> None:
+        """Repair databank integrity issues and update the session images,
+        keeping the cursor at the current image if it's still present."""
+        excluded = None if self.empty else self.current
+        removed, added = repair_plan.apply(self._nodes_holder, excluded)
+        self.__sync_paths()
+        removed_paths = {pic.storage_path for pic in removed}
+        current_path = self.current.storage_path if not self.empty else None
+        self.__rearrange(
+            [idx for idx, path in enumerate(self.__paths) if path not in removed_paths]
+        )
+        for pic in added:
+            self.__add_pic(pic)
+
+        self.cursor = ListCursor(len(self.__paths))
+        if current_path in self.__paths and current_path not in removed_paths:
+            self.cursor.counter = self.__paths.index(current_path)
+        self.__assign_current()
+
+    def start_verification(
+        self, output_folder: str, on_done: Callable[[RepairPlan], None]
+    ) -> None:
+        """Check the databank of this session against files in the background."""
+        excluded = None if self.empty else self.current
+        DatabankVerifier(self._nodes_holder, output_folder, excluded=excluded).start(
+            on_done
+        )
+
+    def __load_nodes_images(self) -> None:
+        """Take images from the databank as they are. Checking them against
+        the files on disk is left to the databank verifier, images with missing
+        files can't be evaluated meanwhile."""
+        for pic in self._nodes_holder.list_images():
+            self.__add_pic(pic)
+
+    def start_metadata_refresh(
+        self, on_done: Callable[[list[MetadataUpdate]], None]
+    ) -> threading.Thread:
+        """Read headers of databank images that have no metadata or whose files
+        changed since it was read, in a background thread. The callback gets
+        the updates from that thread, they're meant for apply_metadata."""
+        known = [
+            (pic, pic.storage_path, pic.metadata)
+            for pic in self._nodes_holder.list_images()
+        ]
+
+        def run() -> None:
+            refreshed = refresh_metadata({path: metadata for _, path, metadata in known})
+            on_done(
+                [
+                    (pic, path, metadata, refreshed[path])
+                    for pic, path, metadata in known
+                    if path in refreshed
+                ]
+            )
+
+        thread = threading.Thread(target=run, name="metadata-refresh", daemon=True)
+        thread.start()
+        return thread
+
+    def apply_metadata(self, updates: list[MetadataUpdate]) -> None:
+        """Set metadata read in the background, skipping images that were moved
+        or got new metadata meanwhile."""
+        for pic, path, old_metadata, metadata in updates:
+            if pic.storage_path == path and pic.metadata is old_metadata:
+                pic.metadata = metadata
+
+    def __fill_metadata(self, pics: NodePics) -> None:
+        """Read headers of images entering the window that have no metadata yet.
+        A cursor move brings in one image, so they're read without a pool."""
+        for pic in pics:
+            if pic.metadata is not None:
+                continue
+            try:
+                pic.metadata = ImageMetadata.read(pic.storage_path)
+            except OSError as err:
+                Logger.debug(f"Can't read metadata of {pic.storage_path}: {err}")
+
+    def __add_pic(self, pic: EvaluatedPic) -> None:
+        """Add an image that is already kept by the nodes holder."""
+        self.__materialized[len(self.__paths)] = pic
+        self.__paths.append(pic.storage_path)
+
+    def __get_pic(self, index: int) -> EvaluatedPic:
+        """Get materialized image by index or create one from its path."""
+        pic = self.__materialized.get(index)
+        if pic is None:
+            pic = EvaluatedPic(self.__paths[index])
+            self.__materialized[index] = pic
+        return pic
+
+    def __sync_paths(self) -> None:
+        """Update paths of materialized images which could've been moved."""
+        for idx, pic in self.__materialized.items():
+            self.__paths[idx] = pic.storage_path
+
+    def __slide_window(self, index: int) -> None:
+        """Release images outside of the window around the index."""
+        window = window_indices(index, len(self.__paths))
+        for idx in self.__window - window:
+            pic = self.__materialized[idx]
+            self.__paths[idx] = pic.storage_path
+            if pic.node_ref is None:
+                del self.__materialized[idx]
+
+        self.__fill_metadata(
+            [self.__get_pic(idx) for idx in window - self.__window]
+        )
+        self.__window = window
 
     def __assign_current(self) -> None:
         if self.empty:
             return
-        self.current = self.__images[int(self.cursor)]
+        index = int(self.cursor)
+        self.__slide_window(index)
+        self.current = self.__materialized[index]
+        self._nodes_holder.track(self.current)
 
 
 class ListCursor:
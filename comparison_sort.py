@@ -0,0 +1,98 @@
+from eval_schema import EvalCategory, EvalRange, Mark, PrioritizedCategories
+from image_nodes import EvaluatedPic, NodePics
+
+type Ranking = list[EvaluatedPic]
+"""Evaluated images ordered from the most preferred to the least preferred."""
+
+type ComparedPair = tuple[EvaluatedPic, EvaluatedPic]
+"""The image being ranked and an already ranked image it is compared against."""
+
+
+class ComparisonSort:
+    """Ranks images by asking for pairwise judgements only.
+
+    Each next image is inserted into the already ranked images with a binary
+    search, which takes at most ceil(log2(k + 1)) judgements for k ranked images.
+    The whole session asks for O(n log n) judgements instead of all pairs.
+    """
+
+    def __init__(self, pics: NodePics) -> None:
+        """Start ranking from the first image, the rest are pending insertion."""
+        self.__pics: NodePics = list(pics)
+        self.__ranking: Ranking = self.__pics[:1]
+        self.__next_pending = 1
+        self.judgements = 0
+        self.__start_insertion()
+
+    @property
+    def finished(self) -> bool:
+        """True when every image is placed in the ranking."""
+        return self.__next_pending >= len(self.__pics)
+
+    @property
+    def current_pair(self) -> ComparedPair | None:
+        """Pair that needs a judgement or None if the ranking is complete."""
+        if self.finished:
+            return None
+        return self.__pics[self.__next_pending], self.__ranking[self.__middle]
+
+    @property
+    def ranking(self) -> Ranking:
+        """Copy of the ranking built so far."""
+        return self.__ranking.copy()
+
+    @property
+    def progress(self) -> tuple[int, int]:
+        """Number of ranked images and total number of images."""
+        return len(self.__ranking), len(self.__pics)
+
+    def judge(self, candidate_preferred: bool) -> None:
+        """Record a judgement for the current pair and narrow the insertion range."""
+        if self.finished:
+            raise ValueError("Ranking is already complete")
+
+        self.judgements += 1
+        if candidate_preferred:
+            self.__high = self.__middle
+        else:
+            self.__low = self.__middle + 1
+
+        if self.__low >= self.__high:
+            self.__ranking.insert(self.__low, self.__pics[self.__next_pending])
+            self.__next_pending += 1
+            self.__start_insertion()
+
+    def apply_marks(
+        self,
+        category: EvalCategory,
+        eval_range: EvalRange,
+        category_priority: PrioritizedCategories,
+    ) -> Ranking:
+        """Bin the ranking into marks of the category and evaluate the images.
+
+        The most preferred images get the highest mark. Images are given
+        the category if it's one of the schema categories.
+        """
+        if not self.finished:
+            raise ValueError("Ranking is not complete yet")
+
+        marks = bin_marks(len(self.__ranking), eval_range)
+        for pic, mark in zip(self.__ranking, marks):
+            if category in category_priority:
+                pic.add_category(category, category_priority)
+            pic.evaluate(category, mark)
+        return self.ranking
+
+    def __start_insertion(self) -> None:
+        """Reset binary search range for the next pending image."""
+        self.__low = 0
+        self.__high = len(self.__ranking)
+
+    @property
+    def __middle(self) -> int:
+        return (self.__low + self.__high) // 2
+
+
+def bin_marks(count: int, eval_range: EvalRange) -> list[Mark]:
+    """Split ranked positions into equally sized groups of marks, highest first."""
+    return [eval_range - (position * eval_range) // count for position in range(count)]
@@ -0,0 +1,94 @@
+import hashlib
+import os
+
+from kivy.logger import Logger
+
+from file_utils import DEFAULT_OUTPUT, DEFAULT_STORE_DIR, TEMP_SUFFIX, move_file
+
+HASH_CHUNK_SIZE = 2**20
+
+type ContentHash = str
+"""Hex sha256 digest of an image file contents."""
+
+
+def content_hash(path: str) -> ContentHash:
+    """Hash of the file contents, read in chunks."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as fstream:
+        while chunk := fstream.read(HASH_CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ContentStore:
+    """Keeps every image file once, under the hash of its contents.
+
+    The category folders of the outputs tree hold links to the stored files:
+    hard links when possible, absolute symbolic links otherwise (e.g. when
+    hard links are not supported by the file system). Renaming a link moves
+    the image to another node without touching its bytes.
+    """
+
+    def __init__(self, root: str = os.path.join(DEFAULT_OUTPUT, DEFAULT_STORE_DIR)):
+        self.root = root
+
+    def blob_path(self, file_hash: ContentHash, file_format: str) -> str:
+        """Path of the stored file, spread over folders by hash prefix."""
+        return os.path.join(self.root, file_hash[:2], f"{file_hash}.{file_format}")
+
+    def adopt(self, path: str) -> ContentHash:
+        """Move the file into the store and put a link to it in its place.
+        A file with already stored contents is replaced with a link, which is
+        made aside first, so neither the file nor the stored one is lost if
+        linking fails."""
+        file_hash = content_hash(path)
+        file_format = os.path.splitext(path)[1].lstrip(".")
+        blob = self.blob_path(file_hash, file_format)
+        if os.path.isfile(blob):
+            temp_path = f"{path}.{TEMP_SUFFIX}"
+            self.__link_blob(blob, temp_path)
+            try:
+                os.replace(temp_path, path)
+            except OSError:
+                os.remove(temp_path)
+                raise
+            return file_hash
+
+        os.makedirs(os.path.dirname(blob), exist_ok=True)
+        move_file(path, blob)
+        try:
+            self.__link_blob(blob, path)
+        except OSError:
+            move_file(blob, path)
+            raise
+        return file_hash
+
+    def link(self, file_hash: ContentHash, path: str) -> None:
+        """Create a link to the stored file at the path."""
+        file_format = os.path.splitext(path)[1].lstrip(".")
+        self.__link_blob(self.blob_path(file_hash, file_format), path)
+
+    @staticmethod
+    def __link_blob(blob: str, path: str) -> None:
+        try:
+            os.link(blob, path)
+        except OSError:
+            os.symlink(os.path.abspath(blob), path)
+
+    def contains(self, file_hash: ContentHash, file_format: str) -> bool:
+        return os.path.isfile(self.blob_path(file_hash, file_format))
+
+    def collect_garbage(self, referenced: set[ContentHash]) -> int:
+        """Remove stored files that no image references. Returns freed bytes."""
+        freed = 0
+        removed = 0
+        for folder, _, files in os.walk(self.root):
+            for file in files:
+                if os.path.splitext(file)[0] in referenced:
+                    continue
+                path = os.path.join(folder, file)
+                freed += os.path.getsize(path)
+                os.remove(path)
+                removed += 1
+        Logger.info(f"Removed {removed} unreferenced stored images")
+        return freed
@@ -1,8 +1,10 @@
 import json
 import os
+from collections.abc import Iterator
 
 from databank_schema import DataBankSchema
 from file_utils import DEFAULT_DB_PATH, filter_files
+from image_metadata import ImageMetadata
 from image_nodes import (EvaluatedPic, ImageNodesHolder, ImageStorageNode,
                          NodePics, NodesCatsMap, SiblingNodes)
 
@@ -16,47 +18,83 @@ class JSONDataBank:
     """Responsible for saving evaluated image info to a physical storage in JSON."""
 
     @classmethod
-    def read(cls, path: str = DEFAULT_DB_PATH) -> ImageNodesHolder:
+    def read(
+        cls, path: str = DEFAULT_DB_PATH, root_path: str = DEFAULT_DB_PATH
+    ) -> ImageNodesHolder:
         """Read the databank folder.
 
         The root must contain folder structure fitting categories and json files
-        with lists of evaluated images data.
+        with lists of evaluated images data. The path may be a subfolder of the root
+        to read only a part of the databank.
         """
         image_nodes: NodesCatsMap = {}
+        for node_key, node_path in cls.iter_node_files(path, root_path):
+            nodes: SiblingNodes = image_nodes.setdefault(node_key, [])
+            nodes.append(cls.read_node(node_path))
+        return ImageNodesHolder(image_nodes)
+
+    @staticmethod
+    def iter_node_files(
+        path: str = DEFAULT_DB_PATH, root_path: str = DEFAULT_DB_PATH
+    ) -> Iterator[tuple[tuple[str, ...], str]]:
+        """Yield node keys with paths to json files of the nodes, so the databank
+        can be processed node by node without reading it whole."""
         for folder, _, files in os.walk(path):
             if len(files) == 0:
                 continue
-            rel_path = os.path.relpath(folder, start=DEFAULT_DB_PATH)
-
+            rel_path = os.path.relpath(folder, start=root_path)
             node_key = tuple(rel_path.split(os.path.sep))
-            files = filter_files(files, STORAGE_FORMAT)
-
-            nodes: SiblingNodes = []
-            for file in files:
-                full_path = os.path.join(folder, file)
-                with open(full_path, "r", encoding=DEFAULT_ENCODING) as fstream:
-                    eval_pics_json_data = json.load(fstream)
-                node_name = os.path.basename(full_path).split(".")[0]
-
-                images: NodePics = [
-                    EvaluatedPic(
-                        storage_path=pic.get(DataBankSchema.storage_path),
-                        categories=pic.get(DataBankSchema.categories),
-                        evals=pic.get(DataBankSchema.evals),
-                        resize=pic.get(DataBankSchema.resize),
-                        tags=pic.get(DataBankSchema.tags),
-                    )
-                    for pic in eval_pics_json_data
-                ]
-
-                nodes.append(
-                    ImageStorageNode(
-                        name=node_name,
-                        evaluated_pics=images,
-                    )
-                )
-            image_nodes[node_key] = nodes
-        return ImageNodesHolder(image_nodes)
+            for file in filter_files(files, STORAGE_FORMAT):
+                yield node_key, os.path.join(folder, file)
+
+    @classmethod
+    def read_node(cls, node_path: str) -> ImageStorageNode:
+        """Read a single node json file."""
+        with open(node_path, "r", encoding=DEFAULT_ENCODING) as fstream:
+            eval_pics_json_data = json.load(fstream)
+        node_name = os.path.basename(node_path).split(".")[0]
+
+        images: NodePics = [
+            EvaluatedPic(
+                storage_path=pic.get(DataBankSchema.storage_path),
+                categories=pic.get(DataBankSchema.categories),
+                evals=pic.get(DataBankSchema.evals),
+                resize=pic.get(DataBankSchema.resize),
+                tags=pic.get(DataBankSchema.tags),
+                metadata=cls.read_metadata(pic),
+                content_hash=pic.get(DataBankSchema.content_hash),
+            )
+            for pic in eval_pics_json_data
+        ]
+        return ImageStorageNode(name=node_name, evaluated_pics=images)
+
+    @staticmethod
+    def read_metadata(pic_json: dict) -> ImageMetadata | None:
+        """Read image metadata fields of an evaluated image if they were saved."""
+        if DataBankSchema.width not in pic_json:
+            return None
+        return ImageMetadata(
+            width=pic_json[DataBankSchema.width],
+            height=pic_json[DataBankSchema.height],
+            file_format=pic_json[DataBankSchema.file_format],
+            color_mode=pic_json[DataBankSchema.color_mode],
+            orientation=pic_json[DataBankSchema.orientation],
+            file_size=pic_json[DataBankSchema.file_size],
+            modified=pic_json[DataBankSchema.modified],
+        )
+
+    @staticmethod
+    def metadata_json(metadata: ImageMetadata) -> dict:
+        """Image metadata fields for an evaluated image json."""
+        return {
+            DataBankSchema.width: metadata.width,
+            DataBankSchema.height: metadata.height,
+            DataBankSchema.file_format: metadata.file_format,
+            DataBankSchema.color_mode: metadata.color_mode,
+            DataBankSchema.orientation: metadata.orientation,
+            DataBankSchema.file_size: metadata.file_size,
+            DataBankSchema.modified: metadata.modified,
+        }
 
     @staticmethod
     def save(
@@ -84,6 +122,10 @@ class JSONDataBank:
                         DataBankSchema.resize: img.resize,
                         DataBankSchema.tags: img.tags,
                     }
+                    if img.metadata is not None:
+                        evaluated_img_json.update(JSONDataBank.metadata_json(img.metadata))
+                    if img.content_hash is not None:
+                        evaluated_img_json[DataBankSchema.content_hash] = img.content_hash
                     evaluated_images.append(evaluated_img_json)
                 output_name = f"{node.name}.{STORAGE_FORMAT}"
                 output_path = os.path.join(root_path, *path)
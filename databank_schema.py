@@ -6,3 +6,11 @@ class DataBankSchema:
     evals = "Evals"
     resize = "Resize"
     tags = "Tags"
+    width = "Width"
+    height = "Height"
+    file_format = "Format"
+    color_mode = "Mode"
+    orientation = "Orientation"
+    file_size = "Bytes"
+    modified = "Modified"
+    content_hash = "Hash"
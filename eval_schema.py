@@ -4,8 +4,18 @@ from kivy.properties import ObjectProperty
 from kivy.uix.checkbox import CheckBox
 
 from databank_schema import DataBankSchema
+from file_utils import DEFAULT_STORAGE_PROFILE
+from storage_profile import DEFAULT_PROFILE_KEY, StorageProfile, StorageProfiles
 
 DEFAULT_SCHEMA_PATH = "schema.json"
+STORAGE_SCHEMA_KEY = "Storage"
+"""Optional schema key with storage profiles by category name."""
+CONTENT_STORE_SCHEMA_KEY = "ContentStore"
+"""Optional schema flag to keep images in the content store and link them."""
+CATEGORY_HOTKEYS = "abcdefghijklmnopqrstuvwxyz"
+"""Keys selecting evaluation categories in schema order, digits then set the mark."""
+CLEAR_MARK = 0
+"""Mark typed to remove the evaluation of the selected category."""
 
 
 class LabeledCheckBox(CheckBox):
@@ -44,6 +54,9 @@ type MarkedCheckBox = dict[Mark, LabeledCheckBox]
 type CategorizedMarkedCheckBox = dict[EvalCategory, MarkedCheckBox]
 """Mapping of a Evaluation category name with its marks and checkboxes."""
 
+type DisplayedMarks = dict[EvalCategory, Mark | None]
+"""Marks whose checkboxes are currently active, by evaluation category."""
+
 type PrioritizedCategories = tuple[EvalCategory, ...]
 """Sorted categories names from schema, where lowest index indicates higher folder 
 (closer to root) in the databank structure."""
@@ -57,14 +70,16 @@ class EvaluationSchema:
     def __init__(self, path: str = DEFAULT_SCHEMA_PATH):
         """Initialize the object based on schema json file."""
         with open(path, "r", encoding="utf-8") as fstream:
-            json_schema: dict[str, dict[str, int]] = json.load(fstream)
+            json_schema: dict[str, dict] = json.load(fstream)
 
         self.__pr_categories: PrioritizedCategories = tuple(
             json_schema[DataBankSchema.categories]
         )
 
         self.eval_range_for_categories: CategoryEvalRange = {
-            cat: rang for cats in json_schema.values() for cat, rang in cats.items()
+            cat: rang
+            for key in (DataBankSchema.categories, DataBankSchema.evals)
+            for cat, rang in json_schema.get(key, {}).items()
         }
         self.total_evals: list[EvalCategory] = [
             cat for cat in self.eval_range_for_categories
@@ -74,6 +89,23 @@ class EvaluationSchema:
         self._eval_category_check_boxes: CategorizedMarkedCheckBox = {
             eval_category: {} for eval_category in self.total_evals
         }
+        self.__displayed_marks: DisplayedMarks = {
+            eval_category: None for eval_category in self.total_evals
+        }
+        self.category_hotkeys: dict[str, EvalCategory] = dict(
+            zip(CATEGORY_HOTKEYS, self.total_evals)
+        )
+
+        storage_json = json_schema.get(STORAGE_SCHEMA_KEY, {})
+        default_profile = StorageProfile.from_json(
+            storage_json.get(DEFAULT_PROFILE_KEY, {}), DEFAULT_STORAGE_PROFILE
+        )
+        self.storage_profiles: StorageProfiles = {
+            cat: StorageProfile.from_json(profile_json, default_profile)
+            for cat, profile_json in storage_json.items()
+        }
+        self.storage_profiles[DEFAULT_PROFILE_KEY] = default_profile
+        self.content_store: bool = json_schema.get(CONTENT_STORE_SCHEMA_KEY, False)
 
     @property
     def prioritized_categories(self) -> PrioritizedCategories:
@@ -91,20 +123,44 @@ class EvaluationSchema:
         their corresponding checkbox item."""
         self._eval_category_check_boxes[eval_category][mark] = check_box
 
+    def show_mark(self, eval_category: EvalCategory, mark: Mark | None) -> None:
+        """Make the checkbox of the mark the only active one in the category.
+        Only checkboxes whose state changes are touched."""
+        displayed_mark = self.__displayed_marks[eval_category]
+        if displayed_mark == mark:
+            return
+        eval_checkboxes = self.get_checks(eval_category)
+        if displayed_mark is not None:
+            eval_checkboxes[displayed_mark].active = False
+        if mark is not None:
+            eval_checkboxes[mark].active = True
+        self.__displayed_marks[eval_category] = mark
+
+    def restore_checks(self, eval_category: EvalCategory) -> None:
+        """Make the checkboxes of the category show the displayed mark again,
+        after a click changed them without the mark being set."""
+        displayed_mark = self.__displayed_marks[eval_category]
+        for mark, check_box in self.get_checks(eval_category).items():
+            check_box.active = mark == displayed_mark
+
+    def hotkey_mark(self, eval_category: EvalCategory, digit: int) -> Mark | None:
+        """Mark a digit key sets in the category, None for the key clearing it.
+        Raises ValueError for digits above the range of the category."""
+        if digit > self.eval_range_for_categories[eval_category]:
+            raise ValueError(f"No mark {digit} in {eval_category}")
+        return None if digit == CLEAR_MARK else digit
+
+    def next_category(self, eval_category: EvalCategory) -> EvalCategory:
+        """Category evaluated after the given one, the first one after the last."""
+        next_idx = (self.total_evals.index(eval_category) + 1) % len(self.total_evals)
+        return self.total_evals[next_idx]
+
     def reload_evaluations(self, current_evals: Evaluations) -> None:
         """Given evaluations from the image, reload corresponding UI checkboxes."""
         for eval_category in self.total_evals:
-            eval_checkboxes = self.get_checks(eval_category)
-            for checkbox in eval_checkboxes.values():
-                checkbox.active = False
-
-            current_mark = current_evals.get(eval_category)
-            if current_mark is not None:
-                eval_checkboxes[current_mark].active = True
+            self.show_mark(eval_category, current_evals.get(eval_category))
 
     def reset_current_evals(self) -> None:
         """Reset all UI checkboxes to the false state."""
         for eval_category in self.total_evals:
-            eval_checkboxes = self.get_checks(eval_category)
-            for checkbox in eval_checkboxes.values():
-                checkbox.active = False
+            self.show_mark(eval_category, None)
@@ -0,0 +1,333 @@
+import argparse
+import csv
+import io
+import json
+import operator
+import os
+import re
+import shutil
+import tarfile
+import tempfile
+import time
+import zipfile
+from collections import deque
+from collections.abc import Callable, Iterator
+from concurrent.futures import Future, ProcessPoolExecutor
+
+from kivy.logger import Logger
+from PIL import Image
+
+from databank import JSONDataBank
+from databank_schema import DataBankSchema
+from eval_schema import EvalCategory, Mark
+from file_utils import DEFAULT_FILE_FORMAT, DEFAULT_OUTPUT
+from image_nodes import EvaluatedPic, ImageNodesHolder, ImageStoragePath
+from storage_profile import FORMAT_ALIASES, STORAGE_FORMATS, normalize_format
+
+EXPORT_FILE_FIELD = "File"
+METADATA_FORMATS = ["jsonl", "csv"]
+METADATA_FILE_NAME = "metadata"
+TAR_EXTENSIONS = (".tar", ".tar.gz", ".tgz")
+ZIP_EXTENSION = ".zip"
+PENDING_PER_WORKER = 2
+"""Encoded images waiting to be written per worker. Bounds the memory used."""
+DECODE_ERRORS = (
+    OSError,
+    ValueError,
+    SyntaxError,
+    TypeError,
+    Image.DecompressionBombError,
+)
+"""Errors Pillow raises for damaged or oversized image files."""
+
+COMPARISONS: dict[str, Callable[[int, int], bool]] = {
+    ">=": operator.ge,
+    "<=": operator.le,
+    "==": operator.eq,
+    "!=": operator.ne,
+    ">": operator.gt,
+    "<": operator.lt,
+    "=": operator.eq,
+}
+METADATA_FIELDS = {
+    DataBankSchema.width: "width",
+    DataBankSchema.height: "height",
+    DataBankSchema.file_size: "file_size",
+}
+"""Numeric metadata fields that can be used in a selection like evals."""
+CONDITION_PATTERN = re.compile(r"^\s*(.+?)\s*(>=|<=|==|!=|>|<|=)\s*(\d+)\s*$")
+
+type EvalCondition = tuple[EvalCategory, str, Mark]
+"""Eval category (or metadata field) name, comparison operator and a mark
+to compare with."""
+
+type Selection = list[EvalCondition]
+"""Conditions an image has to satisfy all at once to be selected."""
+
+
+def parse_selection(query: str) -> Selection:
+    """Parse comma separated conditions like "Anatomy>=4,Color<3"."""
+    selection: Selection = []
+    for condition in query.split(","):
+        if not condition.strip():
+            continue
+        match = CONDITION_PATTERN.match(condition)
+        if match is None:
+            raise ValueError(f"Can't parse selection condition '{condition}'")
+        category, comparison, mark = match.groups()
+        selection.append((category, comparison, int(mark)))
+    return selection
+
+
+def field_value(pic: EvaluatedPic, field: str) -> int | None:
+    """Mark of an eval category or a numeric metadata field of the image."""
+    mark = pic.evals.get(field)
+    if mark is not None or pic.metadata is None:
+        return mark
+    metadata_attribute = METADATA_FIELDS.get(field)
+    if metadata_attribute is None:
+        return None
+    return getattr(pic.metadata, metadata_attribute)
+
+
+def matches(pic: EvaluatedPic, selection: Selection) -> bool:
+    """Check if the image is evaluated (or its metadata) satisfies every condition."""
+    for field, comparison, mark in selection:
+        value = field_value(pic, field)
+        if value is None or not COMPARISONS[comparison](value, mark):
+            return False
+    return True
+
+
+def select_pics(
+    nodes_holder: ImageNodesHolder, selection: Selection
+) -> Iterator[EvaluatedPic]:
+    """Iterate over images of the holder satisfying the selection."""
+    for sibling_nodes in nodes_holder.image_nodes.values():
+        for node in sibling_nodes:
+            for pic in node.images:
+                if matches(pic, selection):
+                    yield pic
+
+
+def encode_for_export(path: ImageStoragePath, max_size: int, file_format: str) -> bytes:
+    """Read the image, downscale it to fit max size and encode it to bytes.
+    Runs in worker processes.
+    """
+    with Image.open(path) as img:
+        img.draft("RGB", (max_size, max_size))
+        img = img.convert("RGB")
+        img.thumbnail((max_size, max_size))
+        buffer = io.BytesIO()
+        img.save(buffer, file_format)
+    return buffer.getvalue()
+
+
+class ExportSink:
+    """Destination of exported files: a directory, a tar or a zip archive."""
+
+    def __init__(self, output_path: str) -> None:
+        self.output_path = output_path
+        if output_path.endswith(TAR_EXTENSIONS):
+            mode = "w:gz" if output_path.endswith((".gz", ".tgz")) else "w"
+            self.__tar: tarfile.TarFile | None = tarfile.open(output_path, mode)
+            self.__zip: zipfile.ZipFile | None = None
+        elif output_path.endswith(ZIP_EXTENSION):
+            self.__tar = None
+            self.__zip = zipfile.ZipFile(output_path, "w", zipfile.ZIP_STORED)
+        else:
+            self.__tar = None
+            self.__zip = None
+            os.makedirs(output_path, exist_ok=True)
+
+    def add(self, name: str, data: bytes) -> None:
+        """Write a file with the data to the destination."""
+        if self.__tar is not None:
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            info.mtime = int(time.time())
+            self.__tar.addfile(info, io.BytesIO(data))
+        elif self.__zip is not None:
+            self.__zip.writestr(name, data)
+        else:
+            full_path = os.path.join(self.output_path, name)
+            os.makedirs(os.path.dirname(full_path), exist_ok=True)
+            with open(full_path, "wb") as fstream:
+                fstream.write(data)
+
+    def add_file(self, name: str, path: str) -> None:
+        """Copy a file from disk to the destination without reading it at once."""
+        if self.__tar is not None:
+            self.__tar.add(path, arcname=name)
+        elif self.__zip is not None:
+            self.__zip.write(path, arcname=name)
+        else:
+            shutil.copyfile(path, os.path.join(self.output_path, name))
+
+    def close(self) -> None:
+        if self.__tar is not None:
+            self.__tar.close()
+        if self.__zip is not None:
+            self.__zip.close()
+
+
+class MetadataSidecar:
+    """Streams metadata of exported images to a temporary JSONL or CSV file."""
+
+    fields = [
+        EXPORT_FILE_FIELD,
+        DataBankSchema.storage_path,
+        DataBankSchema.categories,
+        DataBankSchema.evals,
+        DataBankSchema.tags,
+    ]
+
+    def __init__(self, metadata_format: str) -> None:
+        if metadata_format not in METADATA_FORMATS:
+            raise ValueError(f"Metadata format must be one of {METADATA_FORMATS}")
+        self.name = f"{METADATA_FILE_NAME}.{metadata_format}"
+        self.__fstream = tempfile.NamedTemporaryFile(
+            "w", encoding="utf-8", newline="", suffix=self.name, delete=False
+        )
+        self.path = self.__fstream.name
+        self.__csv_writer = None
+        if metadata_format == "csv":
+            self.__csv_writer = csv.DictWriter(self.__fstream, fieldnames=self.fields)
+            self.__csv_writer.writeheader()
+
+    def write(self, file_name: str, pic: EvaluatedPic) -> None:
+        record = {
+            EXPORT_FILE_FIELD: file_name,
+            DataBankSchema.storage_path: pic.storage_path,
+            DataBankSchema.categories: pic.categories,
+            DataBankSchema.evals: pic.evals,
+            DataBankSchema.tags: pic.tags,
+        }
+        if self.__csv_writer is not None:
+            record[DataBankSchema.categories] = ",".join(pic.categories)
+            record[DataBankSchema.evals] = json.dumps(pic.evals)
+            self.__csv_writer.writerow(record)
+        else:
+            self.__fstream.write(json.dumps(record) + "\n")
+
+    def close(self) -> None:
+        self.__fstream.close()
+
+
+class DatasetExporter:
+    """Exports selected images resized and re-encoded in a process pool.
+
+    Only a limited number of encoded images waits to be written at any time,
+    so memory use doesn't depend on the size of the export.
+    """
+
+    def __init__(
+        self,
+        max_size: int,
+        file_format: str = DEFAULT_FILE_FORMAT,
+        metadata_format: str = "jsonl",
+        workers: int | None = None,
+    ) -> None:
+        self.max_size = max_size
+        self.file_format = normalize_format(file_format)
+        self.metadata_format = metadata_format
+        self.workers = workers or os.cpu_count() or 1
+
+    def export(self, pics: Iterator[EvaluatedPic], output_path: str) -> int:
+        """Export images with a metadata file to the output path.
+        Returns amount of exported images.
+        """
+        sink = ExportSink(output_path)
+        sidecar = MetadataSidecar(self.metadata_format)
+        pending: deque[tuple[EvaluatedPic, Future[bytes]]] = deque()
+        max_pending = self.workers * PENDING_PER_WORKER
+        used_names: set[str] = set()
+        exported = 0
+
+        try:
+            with ProcessPoolExecutor(max_workers=self.workers) as executor:
+                for pic in pics:
+                    future = executor.submit(
+                        encode_for_export,
+                        pic.storage_path,
+                        self.max_size,
+                        self.file_format,
+                    )
+                    pending.append((pic, future))
+                    if len(pending) >= max_pending:
+                        exported += self.__write(
+                            sink, sidecar, used_names, *pending.popleft()
+                        )
+
+                while pending:
+                    exported += self.__write(
+                        sink, sidecar, used_names, *pending.popleft()
+                    )
+        finally:
+            sidecar.close()
+            sink.add_file(sidecar.name, sidecar.path)
+            if os.path.exists(sidecar.path):
+                os.remove(sidecar.path)
+            sink.close()
+
+        Logger.info(f"Exported {exported} images to {output_path}")
+        return exported
+
+    def __write(
+        self,
+        sink: ExportSink,
+        sidecar: MetadataSidecar,
+        used_names: set[str],
+        pic: EvaluatedPic,
+        future: Future[bytes],
+    ) -> int:
+        """Write an encoded image and its metadata. Returns 1 if it was written."""
+        try:
+            data = future.result()
+        except DECODE_ERRORS as err:
+            Logger.warning(f"Skipped {pic.storage_path} in export: {err!r}")
+            return 0
+
+        file_name = self.__export_name(pic.storage_path, used_names)
+        sink.add(file_name, data)
+        sidecar.write(file_name, pic)
+        return 1
+
+    def __export_name(self, path: ImageStoragePath, used_names: set[str]) -> str:
+        """Name of the file in the export: storage path relative to the outputs,
+        or the file name for images outside of it. A name that is already used
+        in the export (e.g. same file names in other folders) gets a numeric
+        suffix, so exported files never overwrite each other."""
+        relative_path = os.path.relpath(path, start=DEFAULT_OUTPUT)
+        if relative_path.startswith(os.pardir):
+            relative_path = os.path.basename(path)
+        name = os.path.splitext(relative_path)[0].replace(os.path.sep, "/")
+        file_name = f"{name}.{self.file_format}"
+        suffix = 0
+        while file_name in used_names:
+            suffix += 1
+            file_name = f"{name}_{suffix}.{self.file_format}"
+        used_names.add(file_name)
+        return file_name
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Export images selected by their evals from the databank."
+    )
+    parser.add_argument("selection", help='comma separated conditions, e.g. "Anatomy>=4"')
+    parser.add_argument("output", help="directory, .tar, .tar.gz or .zip path")
+    parser.add_argument("--max-size", type=int, default=1024)
+    parser.add_argument(
+        "--format",
+        choices=STORAGE_FORMATS + list(FORMAT_ALIASES),
+        default=DEFAULT_FILE_FORMAT,
+    )
+    parser.add_argument("--metadata", choices=METADATA_FORMATS, default="jsonl")
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    exporter = DatasetExporter(args.max_size, args.format, args.metadata, args.workers)
+    exporter.export(
+        select_pics(JSONDataBank.read(), parse_selection(args.selection)), args.output
+    )
@@ -1,15 +1,30 @@
+import errno
 import os
+import shutil
 
 from kivy.logger import Logger
 from PIL import Image
 
+from image_metadata import ImageMetadata
+from storage_profile import StorageProfile
+
 IMAGE_FILE_FORMATS = ["jpg", "jpeg", "png", "webp"]
 DEFAULT_FILE_FORMAT = "jpeg"
 DEFAULT_OUTPUT = "outputs"
 DEFAULT_DATABANK_DIR = "databank"
+DEFAULT_STORE_DIR = "store"
+"""Folder of the content-addressed image store under outputs."""
 DEFAULT_DB_PATH = os.path.join(DEFAULT_OUTPUT, DEFAULT_DATABANK_DIR)
+OUTPUT_SERVICE_DIRS = (DEFAULT_DATABANK_DIR, DEFAULT_STORE_DIR)
+"""Folders under outputs that are not a part of the category tree."""
 MAX_SIZE = 1600
+DEFAULT_QUALITY = 75
+"""Pillow's own default JPEG quality."""
+DEFAULT_STORAGE_PROFILE = StorageProfile(DEFAULT_FILE_FORMAT, DEFAULT_QUALITY, MAX_SIZE)
 SCAN_DEFAULT_PATH = "inputs"
+TEMP_SUFFIX = "tmp"
+"""Suffix of files being written, which replace the target once complete, so
+files hard linked elsewhere (e.g. into snapshots) are never changed in place."""
 
 
 def filter_files(files: list[str], filters: str | list[str]) -> list[str]:
@@ -37,21 +52,87 @@ def scan_images_input(path: str = SCAN_DEFAULT_PATH) -> list[str]:
     return images
 
 
-def transfer_image(file: str, new_file_path: str, resize: bool):
+def needs_reencode(
+    metadata: ImageMetadata,
+    resize: bool,
+    profile: StorageProfile = DEFAULT_STORAGE_PROFILE,
+) -> bool:
+    """Check if the image has to be decoded to be stored: it has to be downsized,
+    or it isn't stored in the profile format with a mode the format supports."""
+    if resize and metadata.exceeds(profile.max_size):
+        return True
+    return (
+        metadata.file_format != profile.file_format
+        or metadata.color_mode not in profile.allowed_modes
+    )
+
+
+def move_file(file: str, new_file_path: str) -> None:
+    """Rename the file, copying it only if it's on another file system.
+
+    Never replaces an existing file, raises FileExistsError instead: other
+    processes (e.g. the inbox ingester) may add files the caller doesn't know of.
+    A hard link followed by removal of the old name is a rename that fails
+    if the target exists.
+    """
+    try:
+        os.link(file, new_file_path)
+    except FileExistsError:
+        raise
+    except OSError:
+        if os.path.exists(new_file_path):
+            raise FileExistsError(errno.EEXIST, "File exists", new_file_path)
+        shutil.move(file, new_file_path)
+        return
+    os.remove(file)
+
+
+def transfer_image(
+    file: str,
+    new_file_path: str,
+    resize: bool,
+    metadata: ImageMetadata | None = None,
+    profile: StorageProfile = DEFAULT_STORAGE_PROFILE,
+):
     """Transfers the physical location of an image while optionally resizing it.
-    Changes storage format to jpeg.
+    Changes storage format to the one of the storage profile.
+
+    Image headers (or already known metadata) decide if the image has to be
+    decoded at all, images that are already fine for storage are only renamed.
     """
-    with Image.open(file).convert("RGB") as img:
-        height = img.size[0]
-        width = img.size[1]
-        wpercent = MAX_SIZE / float(max(img.size))
+    if metadata is None:
+        metadata = ImageMetadata.read(file)
+
+    if not needs_reencode(metadata, resize, profile):
+        if file != new_file_path:
+            move_file(file, new_file_path)
+        Logger.debug(f"{file} was moved to {new_file_path}")
+        return new_file_path
+
+    with Image.open(file) as original:
+        image_info = original.info
+        img = (
+            original
+            if original.mode in profile.allowed_modes
+            else original.convert("RGB")
+        )
+        wpercent = profile.max_size / float(max(img.size))
 
         if wpercent < 1 and resize:
-            hsize = int((height * float(wpercent)))
-            wsize = int((width * float(wpercent)))
-            img = img.resize((hsize, wsize))
+            width = int(img.size[0] * wpercent)
+            height = int(img.size[1] * wpercent)
+            img = img.resize((width, height))
 
-        img.save(new_file_path, DEFAULT_FILE_FORMAT)
+        temp_path = f"{new_file_path}.{TEMP_SUFFIX}"
+        img.save(temp_path, profile.file_format, **profile.save_options(image_info))
+    if file == new_file_path:
+        os.replace(temp_path, new_file_path)
+    else:
+        try:
+            move_file(temp_path, new_file_path)
+        except FileExistsError:
+            os.remove(temp_path)
+            raise
 
     Logger.debug(f"{file} was moved to {new_file_path}")
     if file != new_file_path:
@@ -59,9 +140,14 @@ def transfer_image(file: str, new_file_path: str, resize: bool):
     return new_file_path
 
 
-def full_path_from_relative(file: str, new_relative_path: str, suffix: str = "") -> str:
+def full_path_from_relative(
+    file: str,
+    new_relative_path: str,
+    suffix: str = "",
+    file_format: str = DEFAULT_FILE_FORMAT,
+) -> str:
     base_name = os.path.basename(file)
-    new_file_name = "".join((os.path.splitext(base_name)[0], suffix, f".{DEFAULT_FILE_FORMAT}"))
+    new_file_name = "".join((os.path.splitext(base_name)[0], suffix, f".{file_format}"))
     new_file_path = os.path.normcase(
         os.path.join(new_relative_path, new_file_name)
     )
@@ -0,0 +1,116 @@
+import os
+from collections.abc import Iterable
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+EXIF_ORIENTATION_TAG = 0x0112
+DEFAULT_ORIENTATION = 1
+TRANSPOSED_ORIENTATIONS = (5, 6, 7, 8)
+"""EXIF orientations that swap width and height of the displayed image."""
+METADATA_WORKERS = 16
+"""Pillow reads only the first kilobytes of a file for headers, so most of the
+time is spent opening files and many reads are kept in flight."""
+
+
+class ImageMetadata:
+    """Image file information that is read from headers, without decoding pixels."""
+
+    def __init__(
+        self,
+        width: int,
+        height: int,
+        file_format: str,
+        color_mode: str,
+        orientation: int = DEFAULT_ORIENTATION,
+        file_size: int = 0,
+        modified: float = 0.0,
+    ) -> None:
+        """Initialize the object with all attributes."""
+        self.width = width
+        self.height = height
+        self.file_format = file_format
+        self.color_mode = color_mode
+        self.orientation = orientation
+        self.file_size = file_size
+        self.modified = modified
+
+    @classmethod
+    def read(cls, path: str) -> "ImageMetadata":
+        """Read image headers and file stats. Pillow opens images lazily,
+        so pixel data is not decoded here."""
+        with Image.open(path) as img:
+            width, height = img.size
+            file_format = (img.format or "").lower()
+            color_mode = img.mode
+            orientation = img.getexif().get(EXIF_ORIENTATION_TAG, DEFAULT_ORIENTATION)
+        stat = os.stat(path)
+        return cls(
+            width=width,
+            height=height,
+            file_format=file_format,
+            color_mode=color_mode,
+            orientation=orientation,
+            file_size=stat.st_size,
+            modified=stat.st_mtime,
+        )
+
+    @property
+    def size(self) -> tuple[int, int]:
+        """Stored width and height of the image."""
+        return self.width, self.height
+
+    @property
+    def display_size(self) -> tuple[int, int]:
+        """Width and height of the image after applying EXIF orientation."""
+        if self.orientation in TRANSPOSED_ORIENTATIONS:
+            return self.height, self.width
+        return self.width, self.height
+
+    def exceeds(self, max_size: int) -> bool:
+        """True if the longest side of the image is larger than max size."""
+        return max(self.size) > max_size
+
+    def matches_file(self, path: str) -> bool:
+        """Check that the file is still the one the metadata was read from:
+        it has the same size and modification time."""
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return False
+        return stat.st_size == self.file_size and stat.st_mtime == self.modified
+
+
+def read_metadata(
+    paths: Iterable[str], workers: int = METADATA_WORKERS
+) -> dict[str, ImageMetadata | None]:
+    """Read metadata of many images in parallel. Unreadable images get None."""
+
+    def safe_read(path: str) -> ImageMetadata | None:
+        try:
+            return ImageMetadata.read(path)
+        except OSError:
+            return None
+
+    paths = list(paths)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return dict(zip(paths, executor.map(safe_read, paths)))
+
+
+def refresh_metadata(
+    known: dict[str, ImageMetadata | None], workers: int = METADATA_WORKERS
+) -> dict[str, ImageMetadata | None]:
+    """Read metadata of images that have none or whose files were changed since
+    it was read, in parallel. Returns only the read metadata."""
+    paths = list(known)
+
+    def is_current(path: str) -> bool:
+        metadata = known[path]
+        return metadata is not None and metadata.matches_file(path)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        current = list(executor.map(is_current, paths))
+    return read_metadata(
+        (path for path, is_up_to_date in zip(paths, current) if not is_up_to_date),
+        workers,
+    )
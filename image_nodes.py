@@ -1,9 +1,16 @@
 import os
-from datetime import datetime
 
+from kivy.logger import Logger
+
+from content_store import ContentHash, ContentStore
 from eval_schema import (Categories, EvalCategory, Evaluations, Mark,
                          PrioritizedCategories)
-from file_utils import DEFAULT_OUTPUT, full_path_from_relative, transfer_image
+from file_utils import (DEFAULT_OUTPUT, DEFAULT_STORAGE_PROFILE,
+                        full_path_from_relative, needs_reencode,
+                        transfer_image)
+from image_metadata import ImageMetadata
+from output_registry import OutputTreeRegistry
+from storage_profile import StorageProfile, StorageProfiles, profile_for
 
 MAX_ITEMS_PER_NODE = 1000
 DEFAULT_UNCATEGORIZED_OUTPUT = "uncategorized"
@@ -42,10 +49,18 @@ or, if not, to preserve HD texture detail."""
 type PicTags = str
 """Tags, delimited by a comma for EvaluatedPic"""
 
+type PicState = tuple[
+    ImageStorageNode | None, Categories, Evaluations, PicTags, MustResize
+]
+"""Node, categories, evaluations, tags and resize flag of an image."""
+
 
 class EvaluatedPic:
     """Encapsulates evaluations for an image with info on where it is stored."""
     output_folder = DEFAULT_OUTPUT
+    storage_profiles: StorageProfiles = {}
+    content_store: ContentStore | None = None
+    """Store of image contents when the outputs tree is built from links."""
 
     def __init__(
         self,
@@ -54,6 +69,8 @@ class EvaluatedPic:
         evals: Evaluations | None = None,
         resize: MustResize = True,
         tags: PicTags | None = None,
+        metadata: ImageMetadata | None = None,
+        content_hash: ContentHash | None = None,
     ) -> None:
         """Initialize the object with all attributes."""
         self.storage_path = os.path.normcase(storage_path)
@@ -67,6 +84,8 @@ class EvaluatedPic:
             self.__evals = evals
         self.resize = resize
         self.tags = tags if tags else ""
+        self.metadata = metadata
+        self.content_hash = content_hash
 
         self.node_ref: ImageStorageNode | None = None
 
@@ -89,12 +108,13 @@ class EvaluatedPic:
                 image_cat_idx += 1
 
     def evaluate(self, category: EvalCategory, mark: Mark | None) -> None:
-        """Add or change an evaluation for the image."""
+        """Add, change or, with no mark, remove an evaluation for the image."""
         if mark is not None:
             self.__evals[category] = mark
         else:
-            self.__evals.pop(category)
-            self.categories.remove(category)
+            self.__evals.pop(category, None)
+            if category in self.categories:
+                self.categories.remove(category)
 
     @property
     def evals(self) -> Evaluations:
@@ -115,40 +135,111 @@ class EvaluatedPic:
         """Evaluation marks for the categories assigned for the image."""
         return tuple(self.__evals[mark] for mark in self.categories)
 
-    def physical_process(self, node_name: NodeName) -> None:
-        """Process physical storage of the image. If category hierarchy didn't
-        change do nothing. If other image with that name exists - rename.
-        Assumes that the system never repeats the same datetime.
-        """
+    @property
+    def nodes_key(self) -> tuple[EvalCategory, ...]:
+        """Key of the sibling nodes the image belongs to."""
+        return (
+            tuple(self.categories)
+            if len(self.categories) > 0
+            else (DEFAULT_UNCATEGORIZED_OUTPUT,)
+        )
+
+    def node_folder(self, node_name: NodeName) -> str:
+        """Folder where the image is stored physically when it's in the node."""
         relative_path = (
             os.path.join(*self.categories)
             if len(self.categories) > 0
             else DEFAULT_UNCATEGORIZED_OUTPUT
         )
-        os.makedirs(self.output_folder, exist_ok=True)
-        new_path = os.path.join(self.output_folder, relative_path, node_name)
-        os.makedirs(new_path, exist_ok=True)
-        new_file_path = full_path_from_relative(
-            file=self.storage_path, 
-            new_relative_path=new_path
-        )
+        return os.path.join(self.output_folder, relative_path, node_name)
 
-        if os.path.isfile(new_file_path):
-            suffix = datetime.now().strftime("%Y%m%dT%H%M%S")
-            new_file_path = full_path_from_relative(
-                file=self.storage_path, new_relative_path=new_path, suffix=suffix
-            )
+    def physical_process(self, node_name: NodeName) -> None:
+        """Process physical storage of the image. If category hierarchy didn't
+        change do nothing. If other image with that name exists - add a numeric
+        suffix. Collisions are checked against the outputs tree registry.
+        """
+        new_file_path = self.stored_file_path(self.node_folder(node_name))
+        if new_file_path != self.storage_path:
+            new_file_path = self.output_registry.unique_path(new_file_path)
 
         if not self.resize and new_file_path == self.storage_path:
             return
 
-        self.storage_path = transfer_image(
-            file=self.storage_path, new_file_path=new_file_path, resize=self.resize
+        self.transfer(new_file_path)
+
+    @property
+    def output_registry(self) -> OutputTreeRegistry:
+        """Registry of the outputs tree the image is stored in."""
+        return OutputTreeRegistry.for_root(self.output_folder)
+
+    @property
+    def storage_profile(self) -> StorageProfile:
+        """Storage profile of the image's highest priority category."""
+        return profile_for(
+            self.categories, self.storage_profiles, DEFAULT_STORAGE_PROFILE
+        )
+
+    def stored_file_path(self, folder: str, suffix: str = "") -> ImageStoragePath:
+        """Path of the image file in the folder, in the format of its storage profile."""
+        return full_path_from_relative(
+            file=self.storage_path,
+            new_relative_path=folder,
+            suffix=suffix,
+            file_format=self.storage_profile.file_format,
+        )
+
+    def transfer(self, new_file_path: ImageStoragePath) -> None:
+        """Move the image file, resizing it if needed, and keep its metadata current.
+        Metadata of a file changed since it was read is dropped, so the file is
+        re-encoded as unknown. With a content store the file is a link, so unless
+        the image is re-encoded moving it is a link rename. If a file the registry
+        didn't know of takes the path, the next free name is used."""
+        profile = self.storage_profile
+        if self.metadata is not None and not self.metadata.matches_file(
+            self.storage_path
+        ):
+            self.metadata = None
+        reencoded = self.metadata is None or needs_reencode(
+            self.metadata, self.resize, profile
         )
+        registry = self.output_registry
+        registry.ensure_folder(os.path.dirname(new_file_path))
+        old_path = self.storage_path
+        try:
+            self.storage_path = transfer_image(
+                file=self.storage_path,
+                new_file_path=new_file_path,
+                resize=self.resize,
+                metadata=self.metadata,
+                profile=profile,
+            )
+        except FileExistsError:
+            registry.record_move(new_file_path, new_file_path)
+            self.transfer(registry.unique_path(new_file_path))
+            return
+        registry.record_move(old_path, self.storage_path)
+        if reencoded:
+            self.metadata = ImageMetadata.read(self.storage_path)
+            self.content_hash = None
+        if not self.content_stored:
+            self.store_content()
 
         if self.resize:
             self.resize = False
 
+    @property
+    def content_stored(self) -> bool:
+        """Whether the image file is kept in the content store under its hash."""
+        if self.content_store is None or self.content_hash is None:
+            return False
+        file_format = os.path.splitext(self.storage_path)[1].lstrip(".")
+        return self.content_store.contains(self.content_hash, file_format)
+
+    def store_content(self) -> None:
+        """Move the image file into the content store, leaving a link in its place."""
+        if self.content_store is not None:
+            self.content_hash = self.content_store.adopt(self.storage_path)
+
 
 class ImageStorageNode:
     """A node to store evaluated image objects differentiated by categories."""
@@ -192,21 +283,25 @@ class ImageStorageNode:
             self.__name = "_".join(name)
         return self.__name
 
-    def add_image(self, image: EvaluatedPic) -> bool:
-        """Add image object to the node. Returns true if the image was added."""
+    def add_image(self, image: EvaluatedPic, defer: bool = False) -> bool:
+        """Add image object to the node. Returns true if the image was added.
+        Physical processing of the image is skipped if deferred. The image
+        is moved first, so if that fails it stays in its old node.
+        """
         if image.node_ref == self:
-            if image.resize:
+            if image.resize and not defer:
                 image.physical_process(node_name=self.name)
             return True
 
         if len(self.images) >= MAX_ITEMS_PER_NODE:
             return False
-        
+
+        if not defer:
+            image.physical_process(node_name=self.name)
         if image.node_ref is not None:
             image.node_ref.pop_image(image)
         self.images.append(image)
         image.node_ref = self
-        image.physical_process(node_name=self.name)
 
         return True
 
@@ -226,12 +321,72 @@ class ImageStorageNode:
 class ImageNodesHolder:
     """Parent for image nodes that maps nodes to their respective categories."""
 
-    def __init__(self, image_nodes: NodesCatsMap | None = None) -> None:
-        """Initialize node container."""
+    def __init__(
+        self, image_nodes: NodesCatsMap | None = None, deferred: bool = False
+    ) -> None:
+        """Initialize node container.
+
+        In deferred mode posted images are only fitted to nodes, their physical
+        processing waits for the session to be committed.
+        """
         if image_nodes is not None:
             self.image_nodes = image_nodes
         else:
             self.image_nodes: NodesCatsMap = {}
+        self.deferred = deferred
+        self.__pending_pics: dict[EvaluatedPic, None] = {}
+        self.__origins: dict[EvaluatedPic, PicState] = {}
+
+    @property
+    def pending_pics(self) -> NodePics:
+        """Images posted in deferred mode, which are not processed physically yet."""
+        return list(self.__pending_pics)
+
+    def clear_pending(self) -> None:
+        """Forget images posted in deferred mode."""
+        self.__pending_pics.clear()
+        self.__origins.clear()
+
+    def track(self, image: EvaluatedPic) -> None:
+        """Remember the state of a databank image before it's edited in deferred
+        mode, so reverting the session restores it. Images that are not in
+        a node yet don't need it, reverting takes them out of the databank."""
+        if (
+            not self.deferred
+            or image.node_ref is None
+            or image in self.__origins
+            or image in self.__pending_pics
+        ):
+            return
+        self.__origins[image] = (
+            image.node_ref,
+            list(image.categories),
+            image.evals,
+            image.tags,
+            image.resize,
+        )
+
+    def revert_pending(self) -> None:
+        """Undo posting of images in deferred mode: tracked images go back to
+        their nodes with their previous evaluations, others leave the databank.
+        Nothing is moved physically, as nothing was moved when posting."""
+        for image in self.__pending_pics:
+            origin = self.__origins.get(image)
+            node = origin[0] if origin is not None else None
+            if image.node_ref is not None and image.node_ref is not node:
+                image.node_ref.pop_image(image)
+                image.node_ref = None
+            if origin is None:
+                continue
+            _, image.categories, image.evals, image.tags, image.resize = origin
+            if image.node_ref is None and node is not None:
+                node.images.append(image)
+                image.node_ref = node
+
+        for sibling_nodes in self.image_nodes.values():
+            sibling_nodes[:] = [node for node in sibling_nodes if node.images]
+        Logger.info(f"Reverted {len(self.__pending_pics)} deferred evaluations")
+        self.clear_pending()
 
     def list_images(self) -> list[EvaluatedPic]:
         all_nodes: list[ImageStorageNode] = [
@@ -243,6 +398,17 @@ class ImageNodesHolder:
 
         return all_node_images
 
+    def is_fitted(self, image: EvaluatedPic) -> bool:
+        """Check if the image is in a node matching its categories and marks,
+        so posting it again would neither change nor move anything."""
+        node = image.node_ref
+        return (
+            node is not None
+            and not image.resize
+            and node.ranks == image.sorted_marks
+            and node in self.image_nodes.get(image.nodes_key, [])
+        )
+
     def post_pic(self, image: EvaluatedPic) -> None:
         """Fits the image object based on its attributes.
 
@@ -257,12 +423,10 @@ class ImageNodesHolder:
 
         Asserts categories of the EvaluatedPic are sorted as per the schema.
         """
-        nodes_key = (
-            tuple(image.categories)
-            if len(image.categories) > 0
-            else (DEFAULT_UNCATEGORIZED_OUTPUT,)
-        )
+        if self.deferred:
+            self.__pending_pics[image] = None
 
+        nodes_key = image.nodes_key
         sibling_nodes = self.image_nodes.get(nodes_key)
         if not sibling_nodes:
             sibling_nodes = []
@@ -273,7 +437,7 @@ class ImageNodesHolder:
         ]
 
         for node in fitting_mark_nodes:
-            if node.add_image(image):
+            if node.add_image(image, defer=self.deferred):
                 return
         else:
             buckets = [node.bucket for node in fitting_mark_nodes]
@@ -289,5 +453,5 @@ class ImageNodesHolder:
                 ranks=image.sorted_marks,
                 bucket=bucket,
             )
-            new_node.add_image(image)
+            new_node.add_image(image, defer=self.deferred)
             sibling_nodes.append(new_node)
@@ -0,0 +1,351 @@
+import argparse
+import os
+import time
+import uuid
+from collections.abc import Callable, Iterator
+from concurrent.futures import ThreadPoolExecutor
+
+from kivy.logger import Logger
+
+try:
+    from inotify_simple import INotify, flags
+except ImportError:
+    INotify = None
+
+from content_store import ContentHash, ContentStore, content_hash
+from databank import JSONDataBank
+from eval_schema import EvaluationSchema
+from file_utils import (DEFAULT_DB_PATH, DEFAULT_STORAGE_PROFILE,
+                        IMAGE_FILE_FORMATS, SCAN_DEFAULT_PATH, filter_files,
+                        full_path_from_relative, needs_reencode,
+                        scan_images_input, transfer_image)
+from image_metadata import ImageMetadata
+from image_nodes import (DEFAULT_UNCATEGORIZED_OUTPUT, MAX_ITEMS_PER_NODE,
+                         EvaluatedPic, ImageNodesHolder, ImageStorageNode,
+                         ImageStoragePath, NodeBucket)
+from preview import needs_preview, preview_path
+from similarity import SimilarityIndex
+from storage_profile import profile_for
+
+INGEST_WORKERS = 4
+POLL_INTERVAL = 5.0
+"""Seconds between folder scans when inotify is not available."""
+BATCH_DELAY = 2.0
+"""Seconds to wait for more arrivals before processing a batch."""
+INGEST_BUCKET_PREFIX = "in"
+
+type FileStamp = tuple[int, float]
+"""Size and modification time of a file."""
+
+type IngestItem = tuple[ImageStoragePath, ImageMetadata, ContentHash]
+"""Image file in the inbox with its header metadata and content hash."""
+
+
+def ingest_bucket() -> NodeBucket:
+    """Bucket of a new uncategorized node, unique so that nodes of different
+    batches and of the app never share a file. It ends with a letter, which the
+    app increments to name the buckets after it."""
+    return f"{INGEST_BUCKET_PREFIX}{uuid.uuid4().hex[:12]}a"
+
+
+class InboxWatcher:
+    """Yields batches of image files that finished arriving in the inbox folder.
+
+    Uses inotify when the optional inotify_simple package is installed, so files
+    are reported once they are closed after writing or moved in. Otherwise the
+    folder is scanned periodically and files are reported once their size and
+    modification time stop changing between scans.
+    """
+
+    def __init__(self, inbox_path: str, poll: bool = False) -> None:
+        self.inbox_path = inbox_path
+        self.use_inotify = INotify is not None and not poll
+
+    def batches(self) -> Iterator[list[ImageStoragePath]]:
+        yield scan_images_input(self.inbox_path)
+        if self.use_inotify:
+            yield from self.__inotify_batches()
+        else:
+            yield from self.__polling_batches()
+
+    def __inotify_batches(self) -> Iterator[list[ImageStoragePath]]:
+        inotify = INotify()
+        watch_flags = flags.CLOSE_WRITE | flags.MOVED_TO | flags.CREATE
+        folders: dict[int, str] = {}
+        for folder, _, _ in os.walk(self.inbox_path):
+            folders[inotify.add_watch(folder, watch_flags)] = folder
+
+        while True:
+            batch: list[ImageStoragePath] = []
+            for event in inotify.read(read_delay=int(BATCH_DELAY * 1000)):
+                path = os.path.join(folders[event.wd], event.name)
+                if event.mask & flags.ISDIR:
+                    if event.mask & (flags.CREATE | flags.MOVED_TO):
+                        folders[inotify.add_watch(path, watch_flags)] = path
+                        batch.extend(scan_images_input(path))
+                elif event.mask & (flags.CLOSE_WRITE | flags.MOVED_TO):
+                    if filter_files([event.name], IMAGE_FILE_FORMATS):
+                        batch.append(os.path.normcase(path))
+            if batch:
+                yield list(dict.fromkeys(batch))
+
+    def __polling_batches(self) -> Iterator[list[ImageStoragePath]]:
+        pending: dict[ImageStoragePath, FileStamp] = {}
+        while True:
+            time.sleep(POLL_INTERVAL)
+            batch: list[ImageStoragePath] = []
+            current: dict[ImageStoragePath, FileStamp] = {}
+            for path in scan_images_input(self.inbox_path):
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                stamp = (stat.st_size, stat.st_mtime)
+                if pending.get(path) == stamp:
+                    batch.append(path)
+                else:
+                    current[path] = stamp
+            pending = current
+            if batch:
+                yield batch
+
+
+class IngestPipeline:
+    """Prepares new images before anyone evaluates them.
+
+    Stages run over a batch in worker threads, one stage after another: header
+    read, content hash (to drop images already in the databank or the content
+    store), conversion to the storage format, registration in uncategorized
+    nodes of the databank and previews with similarity features. Registration
+    renames the prepared files into the outputs tree, so evaluating them later
+    only moves them.
+    """
+
+    def __init__(
+        self,
+        keep_size: bool = False,
+        workers: int = INGEST_WORKERS,
+        db_path: str = DEFAULT_DB_PATH,
+    ) -> None:
+        """Images are downsized to the storage profile max size, unless asked
+        to keep their size, then they can still be downsized when evaluated
+        by checking resize."""
+        self.keep_size = keep_size
+        self.workers = workers
+        self.db_path = db_path
+        self.__known_hashes: set[ContentHash] | None = None
+        self.__failed: dict[ImageStoragePath, FileStamp] = {}
+
+    def process(self, paths: list[ImageStoragePath]) -> list[EvaluatedPic]:
+        """Ingest a batch of images. Returns the registered images."""
+        paths = [path for path in paths if self.__is_new_attempt(path)]
+        if len(paths) == 0:
+            return []
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            headers = list(zip(paths, executor.map(self.__read_header, paths)))
+            readable = [(path, meta) for path, meta in headers if meta is not None]
+            hashes = executor.map(self.__hash, [path for path, _ in readable])
+            unique = self.__drop_known(
+                [
+                    (path, metadata, file_hash)
+                    for (path, metadata), file_hash in zip(readable, hashes)
+                    if file_hash is not None
+                ]
+            )
+            normalized = list(executor.map(self.__normalize, unique))
+
+        # Converted files are checked again, the databank knows their new hash
+        prepared = [
+            new_item
+            for item, new_item in zip(unique, normalized)
+            if new_item is not None and new_item[2] == item[2]
+        ]
+        prepared += self.__drop_known(
+            [
+                new_item
+                for item, new_item in zip(unique, normalized)
+                if new_item is not None and new_item[2] != item[2]
+            ]
+        )
+        pics = self.__register(prepared)
+        self.__warm_caches(pics)
+        Logger.info(f"Ingested {len(pics)} of {len(paths)} new images")
+        return pics
+
+    def __is_new_attempt(self, path: ImageStoragePath) -> bool:
+        """Skip files that failed before and haven't changed since."""
+        if path not in self.__failed:
+            return True
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return False
+        return self.__failed[path] != (stat.st_size, stat.st_mtime)
+
+    def __read_header(self, path: ImageStoragePath) -> ImageMetadata | None:
+        try:
+            return ImageMetadata.read(path)
+        except OSError as err:
+            Logger.warning(f"Can't ingest {path}: {err}")
+            self.__mark_failed(path)
+            return None
+
+    def __hash(self, path: ImageStoragePath) -> ContentHash | None:
+        try:
+            return content_hash(path)
+        except OSError as err:
+            Logger.warning(f"Can't hash {path}: {err}")
+            return None
+
+    @property
+    def known_hashes(self) -> set[ContentHash]:
+        """Hashes of images in the databank and the content store, read on first
+        use and extended with the images ingested since."""
+        if self.__known_hashes is None:
+            self.__known_hashes = set()
+            if os.path.isdir(self.db_path):
+                databank = JSONDataBank.read(self.db_path, self.db_path)
+                self.__known_hashes.update(
+                    pic.content_hash
+                    for pic in databank.list_images()
+                    if pic.content_hash is not None
+                )
+            store = EvaluatedPic.content_store
+            if store is not None:
+                for _, _, files in os.walk(store.root):
+                    self.__known_hashes.update(
+                        os.path.splitext(file)[0] for file in files
+                    )
+        return self.__known_hashes
+
+    def __drop_known(self, items: list[IngestItem]) -> list[IngestItem]:
+        """Leave images that are already known in the inbox, marked as failed."""
+        unique: list[IngestItem] = []
+        for item in items:
+            path, _, file_hash = item
+            if file_hash in self.known_hashes:
+                Logger.info(f"{path} was already ingested, skipping it")
+                self.__mark_failed(path)
+                continue
+            self.known_hashes.add(file_hash)
+            unique.append(item)
+        return unique
+
+    def __normalize(self, item: IngestItem) -> IngestItem | None:
+        """Convert the image in the inbox to the storage profile of uncategorized
+        images, the one registration moves it with, so it's encoded only once."""
+        path, metadata, _ = item
+        profile = profile_for(
+            [], EvaluatedPic.storage_profiles, DEFAULT_STORAGE_PROFILE
+        )
+        resize = not self.keep_size
+        if not needs_reencode(metadata, resize, profile):
+            return item
+        new_path = full_path_from_relative(
+            path, os.path.dirname(path), file_format=profile.file_format
+        )
+        try:
+            new_path = transfer_image(path, new_path, resize, metadata, profile)
+            return new_path, ImageMetadata.read(new_path), content_hash(new_path)
+        except OSError as err:
+            Logger.warning(f"Can't convert {path}: {err}")
+            self.__mark_failed(path)
+            return None
+
+    def __register(self, prepared: list[IngestItem]) -> list[EvaluatedPic]:
+        """Add images to new uncategorized nodes of their own and move them into
+        the outputs tree. Node files that exist are never rewritten, so the app
+        saving uncategorized nodes at the same time loses nothing."""
+        nodes: list[ImageStorageNode] = []
+        pics: list[EvaluatedPic] = []
+        for path, metadata, file_hash in prepared:
+            if len(nodes) == 0 or len(nodes[-1].images) >= MAX_ITEMS_PER_NODE:
+                nodes.append(ImageStorageNode(ranks=(), bucket=ingest_bucket()))
+            pic = EvaluatedPic(path, resize=False, metadata=metadata)
+            try:
+                nodes[-1].add_image(pic)
+            except OSError as err:
+                Logger.warning(f"Can't register {path}: {err}")
+                self.__mark_failed(path)
+                continue
+            if pic.content_hash is None:
+                # Without a content store the hash is only kept in the databank,
+                # moving the file re-encodes it if the default profile differs
+                pic.content_hash = (
+                    file_hash
+                    if pic.metadata is metadata
+                    else self.__hash(pic.storage_path)
+                )
+            if pic.content_hash is not None:
+                self.known_hashes.add(pic.content_hash)
+            pics.append(pic)
+
+        nodes = [node for node in nodes if len(node.images) > 0]
+        if len(nodes) > 0:
+            JSONDataBank.save(
+                ImageNodesHolder({(DEFAULT_UNCATEGORIZED_OUTPUT,): nodes}),
+                append=False,
+                root_path=self.db_path,
+            )
+        return pics
+
+    def __warm_caches(self, pics: list[EvaluatedPic]) -> None:
+        """Make previews of images larger than the preview size and compute similarity
+        features, so neither is done when the images are shown."""
+        large = [
+            pic.storage_path
+            for pic in pics
+            if pic.metadata is not None and needs_preview(pic.metadata)
+        ]
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            list(executor.map(preview_path, large))
+
+        similarity_index = SimilarityIndex()
+        similarity_index.update([pic.storage_path for pic in pics], self.workers)
+        similarity_index.save()
+
+    def __mark_failed(self, path: ImageStoragePath) -> None:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return
+        self.__failed[path] = (stat.st_size, stat.st_mtime)
+
+
+def run(
+    inbox_path: str,
+    pipeline: IngestPipeline,
+    poll: bool = False,
+    once: bool = False,
+    on_batch: Callable[[list[EvaluatedPic]], None] | None = None,
+) -> None:
+    """Ingest images already in the inbox, then new arrivals until stopped."""
+    for batch in InboxWatcher(inbox_path, poll).batches():
+        pics = pipeline.process(batch)
+        if on_batch is not None:
+            on_batch(pics)
+        if once:
+            return
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Watch the inputs folder and prepare new images for evaluation."
+    )
+    parser.add_argument("inbox", nargs="?", default=SCAN_DEFAULT_PATH)
+    parser.add_argument(
+        "--once", action="store_true", help="ingest present images and exit"
+    )
+    parser.add_argument("--poll", action="store_true", help="scan instead of inotify")
+    parser.add_argument(
+        "--keep-size", action="store_true", help="don't downsize images when ingesting"
+    )
+    parser.add_argument("--workers", type=int, default=INGEST_WORKERS)
+    args = parser.parse_args()
+
+    evaluation_schema = EvaluationSchema()
+    EvaluatedPic.storage_profiles = evaluation_schema.storage_profiles
+    if evaluation_schema.content_store:
+        EvaluatedPic.content_store = ContentStore()
+    run(args.inbox, IngestPipeline(args.keep_size, args.workers), args.poll, args.once)
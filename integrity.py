@@ -0,0 +1,267 @@
+import argparse
+import os
+import threading
+from collections.abc import Callable, Iterator
+from concurrent.futures import ThreadPoolExecutor
+
+from kivy.logger import Logger
+
+from databank import JSONDataBank
+from file_utils import (DEFAULT_DB_PATH, DEFAULT_OUTPUT, IMAGE_FILE_FORMATS,
+                        OUTPUT_SERVICE_DIRS, filter_files)
+from image_nodes import (EvaluatedPic, ImageNodesHolder, ImageStorageNode,
+                         ImageStoragePath, NodePics)
+
+STAT_WORKERS = 16
+"""Image files whose existence is checked at once."""
+
+MISSING_FILE = "missing file"
+"""Image in the databank whose file does not exist."""
+ORPHANED_IMAGE = "orphaned image"
+"""Image file under outputs which is not in the databank."""
+RANKS_MISMATCH = "ranks mismatch"
+"""Image whose categories or marks disagree with the node it's in."""
+STALE_NODE_REF = "stale node reference"
+"""Image that references some other node than the one it's in."""
+MISPLACED_FILE = "misplaced file"
+"""Image file that is not in the folder of its node."""
+
+
+class IntegrityIssue:
+    """A single disagreement between the databank and the files on disk."""
+
+    def __init__(
+        self,
+        kind: str,
+        path: ImageStoragePath,
+        pic: EvaluatedPic | None = None,
+        node: ImageStorageNode | None = None,
+    ) -> None:
+        self.kind = kind
+        self.path = path
+        self.pic = pic
+        self.node = node
+
+    def __str__(self) -> str:
+        node_name = f" in node {self.node.name}" if self.node is not None else ""
+        return f"{self.kind}: {self.path}{node_name}"
+
+
+class PicRecord:
+    """State of a databank image recorded on the thread that modifies the holder,
+    so the verifier doesn't read images while they're being evaluated."""
+
+    def __init__(
+        self,
+        pic: EvaluatedPic,
+        node: ImageStorageNode,
+        sibling_nodes: list[ImageStorageNode],
+    ) -> None:
+        """Record the image in the node, sibling nodes are those of its categories."""
+        self.pic = pic
+        self.node = node
+        self.path = pic.storage_path
+        self.stale_ref = pic.node_ref is not node
+        self.fits_node = fits_node(pic, node, sibling_nodes)
+        self.node_folder = os.path.normcase(pic.node_folder(node.name))
+
+
+def fits_node(
+    pic: EvaluatedPic, node: ImageStorageNode, sibling_nodes: list[ImageStorageNode]
+) -> bool:
+    """Check if categories and marks of the image are those of the node, which
+    is one of the sibling nodes of its categories. An image without a mark for
+    one of its categories fits no node."""
+    try:
+        marks = pic.sorted_marks
+    except KeyError:
+        return False
+    return marks == node.ranks and node in sibling_nodes
+
+
+class RepairPlan:
+    """Issues found by the verifier with the way each of them is repaired:
+
+    - missing files are removed from their nodes;
+    - orphaned images are added to the databank as uncategorized;
+    - images with mismatching ranks are posted again to fitting nodes;
+    - stale node references are pointed at the node holding the image;
+    - misplaced files are moved to the folder of their node.
+    """
+
+    def __init__(self, issues: list[IntegrityIssue] | None = None) -> None:
+        self.issues: list[IntegrityIssue] = issues if issues is not None else []
+
+    def __len__(self) -> int:
+        return len(self.issues)
+
+    def preview(self) -> list[str]:
+        return [str(issue) for issue in self.issues]
+
+    def apply(
+        self, nodes_holder: ImageNodesHolder, excluded: EvaluatedPic | None = None
+    ) -> tuple[NodePics, NodePics]:
+        """Repair the issues that are still present, leaving the excluded image
+        (the one being evaluated) as it is. Meant to run on the thread that
+        modifies the holder. Returns removed and added images.
+        """
+        removed: NodePics = []
+        added: NodePics = []
+        known_paths = {pic.storage_path for pic in nodes_holder.list_images()}
+        for issue in self.issues:
+            pic, node = issue.pic, issue.node
+            if pic is not None and pic is excluded:
+                continue
+            if issue.kind == MISSING_FILE and pic is not None and node is not None:
+                if pic in node.images and not os.path.isfile(pic.storage_path):
+                    node.pop_image(pic)
+                    removed.append(pic)
+            elif issue.kind == ORPHANED_IMAGE:
+                if os.path.isfile(issue.path) and issue.path not in known_paths:
+                    orphan = EvaluatedPic(issue.path, resize=False)
+                    nodes_holder.post_pic(orphan)
+                    known_paths.add(orphan.storage_path)
+                    added.append(orphan)
+            elif issue.kind == RANKS_MISMATCH and pic is not None and node is not None:
+                sibling_nodes = nodes_holder.image_nodes.get(pic.nodes_key, [])
+                if pic not in node.images or fits_node(pic, node, sibling_nodes):
+                    continue
+                node.pop_image(pic)
+                pic.node_ref = None
+                nodes_holder.post_pic(pic)
+            elif issue.kind == STALE_NODE_REF and pic is not None and node is not None:
+                if pic in node.images:
+                    pic.node_ref = node
+            elif issue.kind == MISPLACED_FILE and pic is not None and node is not None:
+                if pic.node_ref is node and os.path.isfile(pic.storage_path):
+                    pic.physical_process(node.name)
+
+        Logger.info(f"Repaired {len(self.issues)} databank integrity issues")
+        self.issues = []
+        return removed, added
+
+
+class DatabankVerifier:
+    """Checks the databank against the files in the outputs tree.
+
+    Images are recorded on the thread that modifies the holder, which only
+    reads the images in memory. Files are then checked node by node against
+    the records with a thread pool, so it can run in the background.
+    """
+
+    def __init__(
+        self,
+        nodes_holder: ImageNodesHolder,
+        output_folder: str = DEFAULT_OUTPUT,
+        workers: int = STAT_WORKERS,
+        excluded: EvaluatedPic | None = None,
+    ) -> None:
+        """Excluded image (the one being evaluated) is neither checked nor reported
+        as orphaned."""
+        self.nodes_holder = nodes_holder
+        self.output_folder = output_folder
+        self.workers = workers
+        self.excluded = excluded
+
+    def record(self) -> tuple[list[PicRecord], set[ImageStoragePath]]:
+        """Record databank images to check and paths of all known images,
+        including images posted in deferred mode and the excluded one."""
+        skipped = set(self.nodes_holder.pending_pics)
+        if self.excluded is not None:
+            skipped.add(self.excluded)
+        records: list[PicRecord] = []
+        for sibling_nodes in self.nodes_holder.image_nodes.values():
+            for node in sibling_nodes:
+                for pic in node.images:
+                    if pic not in skipped:
+                        records.append(
+                            PicRecord(
+                                pic,
+                                node,
+                                self.nodes_holder.image_nodes.get(pic.nodes_key, []),
+                            )
+                        )
+        known_paths = {record.path for record in records}
+        known_paths.update(pic.storage_path for pic in skipped)
+        return records, known_paths
+
+    def iter_issues(
+        self,
+        recorded: tuple[list[PicRecord], set[ImageStoragePath]] | None = None,
+    ) -> Iterator[IntegrityIssue]:
+        """Yield issues of the recorded images, orphaned images come last.
+        Without records the holder is recorded on the calling thread."""
+        records, known_paths = recorded if recorded is not None else self.record()
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            existing = executor.map(
+                os.path.isfile, [record.path for record in records]
+            )
+            for record, exists in zip(records, existing):
+                yield from self.__check_pic(record, exists)
+
+        for path in self.__scan_outputs():
+            if path not in known_paths:
+                yield IntegrityIssue(ORPHANED_IMAGE, path)
+
+    def verify(
+        self,
+        recorded: tuple[list[PicRecord], set[ImageStoragePath]] | None = None,
+    ) -> RepairPlan:
+        plan = RepairPlan(list(self.iter_issues(recorded)))
+        Logger.info(f"Databank verification found {len(plan)} issues")
+        return plan
+
+    def start(self, on_done: Callable[[RepairPlan], None]) -> threading.Thread:
+        """Record the images on the calling thread, verify them in a background
+        thread and pass the plan to the callback, which is called from that thread."""
+        recorded = self.record()
+
+        def run() -> None:
+            try:
+                plan = self.verify(recorded)
+            except Exception as err:
+                Logger.error(f"Databank verification failed: {err}")
+                return
+            on_done(plan)
+
+        thread = threading.Thread(target=run, name="databank-verifier", daemon=True)
+        thread.start()
+        return thread
+
+    @staticmethod
+    def __check_pic(record: PicRecord, exists: bool) -> Iterator[IntegrityIssue]:
+        pic, node = record.pic, record.node
+        if not exists:
+            yield IntegrityIssue(MISSING_FILE, record.path, pic, node)
+            return
+        if record.stale_ref:
+            yield IntegrityIssue(STALE_NODE_REF, record.path, pic, node)
+
+        if not record.fits_node:
+            yield IntegrityIssue(RANKS_MISMATCH, record.path, pic, node)
+        elif os.path.dirname(record.path) != record.node_folder:
+            yield IntegrityIssue(MISPLACED_FILE, record.path, pic, node)
+
+    def __scan_outputs(self) -> Iterator[ImageStoragePath]:
+        """Image files under the outputs folder, skipping the databank and the store."""
+        for root, dirs, files in os.walk(self.output_folder):
+            if root == self.output_folder:
+                dirs[:] = [dir for dir in dirs if dir not in OUTPUT_SERVICE_DIRS]
+            for file in filter_files(files, IMAGE_FILE_FORMATS):
+                yield os.path.normcase(os.path.join(root, file))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Check the databank against the image files in outputs."
+    )
+    parser.add_argument("--repair", action="store_true", help="repair found issues")
+    args = parser.parse_args()
+
+    holder = JSONDataBank.read(DEFAULT_DB_PATH)
+    repair_plan = DatabankVerifier(holder).verify()
+    print("\n".join(repair_plan.preview()))
+    if args.repair and len(repair_plan) > 0:
+        repair_plan.apply(holder)
+        JSONDataBank.save(holder, append=False)
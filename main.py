@@ -1,22 +1,38 @@
 import os
+import threading
+from collections.abc import Callable
 
 from kivy.app import App
+from kivy.clock import Clock
 from kivy.core.window import Window
+from kivy.graphics.texture import Texture
 from kivy.logger import Logger
 from kivy.uix.boxlayout import BoxLayout
+from kivy.uix.button import Button
 from kivy.uix.label import Label
 from kivy.uix.popup import Popup
 from kivy.uix.screenmanager import Screen
 
 from app_logic import OnScreenImageHandler
+from comparison_sort import ComparisonSort
+from content_store import ContentStore
 from databank import JSONDataBank
-from eval_schema import EvaluationSchema, LabeledCheckBox
+from eval_schema import EvalCategory, EvaluationSchema, LabeledCheckBox, Mark
 from file_utils import DEFAULT_DATABANK_DIR, DEFAULT_OUTPUT
+from image_metadata import ImageMetadata
+from image_nodes import EvaluatedPic
+from integrity import RepairPlan
+from move_plan import MovePlan
+from preview import (FullResolutionLoader, PreviewLoader, cached_preview,
+                     needs_preview, prune_previews)
+from session import UNEVALUATED_ORDER, session_orders
+from similarity import start_similarity_order
 
 Logger.setLevel("DEBUG")
 ZOOM_IN_SCALE = 1.75
 ZOOM_OUT_SCALE = 0.4
 DEFAULT_IMAGE = "Kivy-logo.jpg"
+PREVIEW_LINES_LIMIT = 30
 
 
 class MainScreen(Screen):
@@ -31,10 +47,21 @@ class MainScreen(Screen):
 
         running_app: MainApp = App.get_running_app()  # type: ignore
         self.eval_schema: EvaluationSchema = running_app.evaluation_schema
+        self.full_resolution_loader = FullResolutionLoader()
+        self.preview_loader = PreviewLoader()
+        self.showing_preview = False
+        self.__category_labels: dict[EvalCategory, Label] = {}
+        self.__selected_category: EvalCategory | None = None
 
         self.__set_up_evaluation_checkboxes()
+        if self.eval_schema.total_evals:
+            self.__select_category(self.eval_schema.total_evals[0])
 
     def _on_keyboard(self, *args):
+        if self.manager is None or self.manager.current != self.name:
+            return
+        if self.ids.tags_text.focus:
+            return
         LEFT_KEY = 276
         RIGHT_KEY = 275
         UP_KEY = 273
@@ -49,6 +76,45 @@ class MainScreen(Screen):
         if args[1] == DOWN_KEY:
             self.scale_image(ZOOM_OUT_SCALE)
 
+        codepoint, modifiers = args[3], args[4]
+        if codepoint is None or {"ctrl", "alt", "meta"} & set(modifiers):
+            return
+        if codepoint in self.eval_schema.category_hotkeys:
+            self.__select_category(self.eval_schema.category_hotkeys[codepoint])
+        elif codepoint.isdigit():
+            self.__mark_selected_category(int(codepoint))
+
+    def __select_category(self, category: EvalCategory) -> None:
+        """Highlight the category that digit keys evaluate."""
+        if self.__selected_category is not None:
+            self.__category_labels[self.__selected_category].bold = False
+        self.__category_labels[category].bold = True
+        self.__selected_category = category
+
+    def __mark_selected_category(self, digit: int) -> None:
+        """Set the mark (or clear it with 0) in the selected category and select
+        the next one, so the image is evaluated by typing marks in a row."""
+        category = self.__selected_category
+        if category is None:
+            return
+        try:
+            mark = self.eval_schema.hotkey_mark(category, digit)
+        except ValueError:
+            return
+        self.__set_mark(category, mark)
+        self.__select_category(self.eval_schema.next_category(category))
+
+    def __set_mark(self, category: EvalCategory, mark: Mark | None) -> None:
+        """Update image evaluations and, if needed, give it a new category."""
+        pic = self.image_handler.current
+        if self.image_handler.current_missing:
+            self.eval_schema.restore_checks(category)
+            return
+        if mark is not None and category in self.eval_schema.prioritized_categories:
+            pic.add_category(category, self.eval_schema.prioritized_categories)
+        pic.evaluate(category, mark)
+        self.eval_schema.show_mark(category, mark)
+
     def on_enter(self, *args) -> None:
         """When entering this screen render an image."""
         Logger.info("Entering main screen")
@@ -56,10 +122,84 @@ class MainScreen(Screen):
 
     def on_leave(self, *args) -> None:
         """When leaving this screen save the evaluations."""
+        self.finish_session(preview=True)
+
+    def finish_session(self, preview: bool) -> None:
+        """Save the evaluations and move images planned in deferred mode.
+        With preview the planned moves are shown to be committed or cancelled.
+        """
         self.image_handler.save_current(tags=self.ids.tags_text.text)
-        self.image_handler.save_eval_data()
+        self.full_resolution_loader.release()
+        self.preview_loader.release()
         self.ids.image.source = DEFAULT_IMAGE
 
+        move_plan = self.image_handler.plan_moves()
+        if preview and len(move_plan) > 0:
+            self.__preview_moves(move_plan)
+            return
+        move_plan.commit()
+        self.image_handler.save_eval_data()
+
+    def __preview_moves(self, move_plan: MovePlan) -> None:
+        """Show planned moves in a popup that commits or cancels them."""
+
+        def close_session(commit: bool) -> None:
+            if commit:
+                move_plan.commit()
+            else:
+                move_plan.cancel()
+            self.image_handler.save_eval_data()
+
+        show_confirmation(
+            f"{len(move_plan)} planned image moves",
+            move_plan.preview(),
+            ("Commit moves", "Discard evaluations"),
+            close_session,
+        )
+
+    def verify_databank(self, output_folder: str) -> None:
+        """Check the databank against files on disk in the background and offer
+        a repair when it's done."""
+        image_handler = self.image_handler
+        image_handler.start_verification(
+            output_folder,
+            lambda plan: Clock.schedule_once(
+                lambda _: self.__offer_repair(image_handler, plan)
+            ),
+        )
+
+    def refresh_metadata(self) -> None:
+        """Read image headers the databank lacks (or has outdated) in the background
+        and set them on the UI thread."""
+        image_handler = self.image_handler
+        image_handler.start_metadata_refresh(
+            lambda updates: Clock.schedule_once(
+                lambda _: image_handler.apply_metadata(updates)
+            )
+        )
+
+    def __offer_repair(
+        self, image_handler: OnScreenImageHandler, repair_plan: RepairPlan
+    ) -> None:
+        if len(repair_plan) == 0 or image_handler is not self.image_handler:
+            return
+        if self.manager is None or self.manager.current != self.name:
+            return
+
+        def repair(confirmed: bool) -> None:
+            if not confirmed or image_handler is not self.image_handler:
+                return
+            image_handler.apply_repair(repair_plan)
+            if not image_handler.empty:
+                self.__load_new_image()
+
+        show_confirmation(
+            f"{len(repair_plan)} databank integrity issues",
+            repair_plan.preview(),
+            ("Repair", "Ignore"),
+            repair,
+        )
+
     def _on_zoom_in(self):
         self.scale_image(ZOOM_IN_SCALE)
 
@@ -78,6 +218,40 @@ class MainScreen(Screen):
         img.center_y = img.parent.parent.center_y
         self.ids.scatter_img_holder.pos = self.ids.stencil1.pos
 
+        if self.showing_preview and max(img.size) > max(img.texture_size):
+            self.full_resolution_loader.load(
+                self.image_handler.current.storage_path, self.__on_full_resolution
+            )
+
+    def __on_full_resolution(self, texture: Texture) -> None:
+        """Replace the preview with the full resolution image."""
+        self.preview_loader.release()
+        self.ids.image.texture = texture
+        self.showing_preview = False
+
+    def __display_source(self, pic: EvaluatedPic) -> str:
+        """Path to show the image from: a reduced copy for images much larger
+        than the screen, the image itself otherwise. A copy that isn't cached
+        yet is made in the background, the placeholder is shown meanwhile."""
+        self.showing_preview = False
+        try:
+            metadata = pic.metadata or ImageMetadata.read(pic.storage_path)
+            if not needs_preview(metadata):
+                return pic.storage_path
+            source = cached_preview(pic.storage_path)
+        except OSError as err:
+            Logger.warning(f"Can't make a preview of {pic.storage_path}: {err}")
+            return pic.storage_path
+        self.showing_preview = True
+        if source is not None:
+            return source
+        self.preview_loader.load(pic.storage_path, self.__on_preview)
+        return DEFAULT_IMAGE
+
+    def __on_preview(self, source: str) -> None:
+        """Show the preview made in the background."""
+        self.ids.image.source = source
+
     def set_image_handler(self, handler: OnScreenImageHandler) -> None:
         """Set the image handler for this screen."""
         self.image_handler = handler
@@ -110,8 +284,12 @@ class MainScreen(Screen):
 
         self.eval_schema.reload_evaluations(self.image_handler.current.evals)
         self.ids.img_name.text = self.image_handler.current.storage_path
+        if self.image_handler.current_missing:
+            self.ids.img_name.text += " (missing, repair the databank)"
 
-        img.source = self.image_handler.current.storage_path
+        self.full_resolution_loader.release()
+        self.preview_loader.release()
+        img.source = self.__display_source(self.image_handler.current)
         img.center_x = img.parent.parent.center_x
         img.center_y = img.parent.parent.center_y
         self.ids.resize_check_box.active = self.image_handler.current.resize
@@ -124,10 +302,13 @@ class MainScreen(Screen):
         When creating checkboxes in a category should check up on databank.
         """
         eval_box: BoxLayout = self.ids.eval_box
+        hotkeys = {cat: key for key, cat in self.eval_schema.category_hotkeys.items()}
         for cat in self.eval_schema.total_evals:
             category_vbox = BoxLayout(orientation="vertical")
 
-            category_label = Label(text=cat)
+            hotkey = hotkeys.get(cat)
+            category_label = Label(text=cat if hotkey is None else f"{cat} [{hotkey}]")
+            self.__category_labels[cat] = category_label
             category_vbox.add_widget(category_label)
 
             category_checks_hbox = BoxLayout(orientation="horizontal")
@@ -147,30 +328,113 @@ class MainScreen(Screen):
 
     def _on_checkbox_active(self, checkbox: LabeledCheckBox) -> None:
         """Update image evaluations and, if needed, give it a new category."""
-        if checkbox.group in self.eval_schema.prioritized_categories:
-            self.image_handler.current.add_category(
-                checkbox.group, self.eval_schema.prioritized_categories
-            )
         mark = checkbox.label if checkbox.active else None
-        self.image_handler.current.evaluate(checkbox.group, mark)
+        self.__set_mark(checkbox.group, mark)
 
     def _on_reset_evals(self) -> None:
         """Resets UI checkboxes and evaluation in the image."""
+        if self.image_handler.current_missing:
+            return
         self.eval_schema.reset_current_evals()
         self.image_handler.current.evals = {}
         self.image_handler.current.categories.clear()
-        self.image_handler.save_current()
+        self.image_handler.save_current(tags=self.ids.tags_text.text)
 
     def _on_persist_check_box(self, active: bool) -> None:
         """Checks whether the tags shuld be preserved for the next image."""
         self.image_handler.preserve_tags = active
 
 
+class ComparisonScreen(Screen):
+    """Screen that ranks images of one eval category by side-by-side comparison."""
+
+    screen_name = "comparison_screen"
+
+    def __init__(self, **kwargs) -> None:
+        super(ComparisonScreen, self).__init__(name=ComparisonScreen.screen_name)
+        Window.bind(on_keyboard=self._on_keyboard)
+
+        running_app: MainApp = App.get_running_app()  # type: ignore
+        self.eval_schema: EvaluationSchema = running_app.evaluation_schema
+
+    def _on_keyboard(self, *args):
+        if self.manager is None or self.manager.current != self.name:
+            return
+        LEFT_KEY = 276
+        RIGHT_KEY = 275
+
+        if args[1] == LEFT_KEY:
+            self._on_left_preferred()
+        if args[1] == RIGHT_KEY:
+            self._on_right_preferred()
+
+    def set_comparison(
+        self, handler: OnScreenImageHandler, category: str
+    ) -> None:
+        """Set the images and the eval category to rank them by."""
+        self.image_handler = handler
+        self.category = category
+        self.sorter = ComparisonSort(handler.images)
+
+    def on_enter(self, *args) -> None:
+        Logger.info(f"Entering comparison screen for {self.category}")
+        self.__load_pair()
+
+    def on_leave(self, *args) -> None:
+        """When leaving this screen apply marks if the ranking is complete."""
+        if self.sorter.finished:
+            self.sorter.apply_marks(
+                self.category,
+                self.eval_schema.eval_range_for_categories[self.category],
+                self.eval_schema.prioritized_categories,
+            )
+            self.image_handler.save_pics(self.sorter.ranking)
+            self.image_handler.plan_moves().commit()
+            self.image_handler.save_eval_data()
+            Logger.info(
+                f"Ranked {len(self.sorter.ranking)} images "
+                f"in {self.sorter.judgements} judgements"
+            )
+        self.ids.left_image.source = DEFAULT_IMAGE
+        self.ids.right_image.source = DEFAULT_IMAGE
+
+    def _on_left_preferred(self) -> None:
+        self.sorter.judge(candidate_preferred=True)
+        self.__load_pair()
+
+    def _on_right_preferred(self) -> None:
+        self.sorter.judge(candidate_preferred=False)
+        self.__load_pair()
+
+    def __load_pair(self) -> None:
+        """Show the next pair or go back to the menu if ranking is done."""
+        pair = self.sorter.current_pair
+        if pair is None:
+            self.manager.current = MenuScreen.screen_name
+            return
+
+        candidate, ranked = pair
+        self.ids.left_image.source = candidate.storage_path
+        self.ids.right_image.source = ranked.storage_path
+        ranked_count, total = self.sorter.progress
+        self.ids.comparison_progress.text = (
+            f"{self.category}: ranked {ranked_count}/{total}, "
+            f"judgements {self.sorter.judgements}"
+        )
+
+
 class MenuScreen(Screen):
     """Screen that allows to scan folder or databank for images to evaluate."""
 
+    screen_name = "menu_screen"
+
     def on_enter(self, *args):
         Logger.info("Entering menu screen")
+        eval_schema: EvaluationSchema = App.get_running_app().evaluation_schema  # type: ignore
+        order_spinner = self.ids.order_spinner
+        order_spinner.values = session_orders(eval_schema.total_evals)
+        if order_spinner.text not in order_spinner.values:
+            order_spinner.text = UNEVALUATED_ORDER
 
     def _load_databank(self) -> None:
         """Load eval image info from databank and go through its images."""
@@ -183,7 +447,42 @@ class MenuScreen(Screen):
         )
         self.__process_scan_inputs(user_input_path)
 
+    def _compare_inputs(self) -> None:
+        """Rank images in a user-specified directory by comparing them in pairs."""
+        category: str = self.ids.compare_text.text
+        eval_schema: EvaluationSchema = App.get_running_app().evaluation_schema  # type: ignore
+        if category not in eval_schema.total_evals:
+            self.__show_warning(
+                "Comparison warning", f"'{category}' is not an eval from the schema"
+            )
+            return
+
+        user_input_path: str = (
+            self.ids.inputs_text.text or self.ids.inputs_text.hint_text
+        )
+        def show_comparison(image_handler: OnScreenImageHandler) -> None:
+            comparison_screen = self.parent.get_screen(ComparisonScreen.screen_name)
+            comparison_screen.set_comparison(image_handler, category)
+            self.parent.current = ComparisonScreen.screen_name
+
+        self.__create_image_handler(user_input_path, show_comparison)
+
     def __process_scan_inputs(self, input_path: str) -> None:
+        def show_images(image_handler: OnScreenImageHandler) -> None:
+            main_screen = self.parent.get_screen(MainScreen.screen_name)
+            main_screen.set_image_handler(image_handler)
+            self.parent.current = MainScreen.screen_name
+            if not image_handler.scan_mode_append:
+                main_screen.verify_databank(input_path)
+                main_screen.refresh_metadata()
+
+        self.__create_image_handler(input_path, show_images)
+
+    def __create_image_handler(
+        self, input_path: str, on_ready: Callable[[OnScreenImageHandler], None]
+    ) -> None:
+        """Scan the input path, reading the databank if the path is in outputs,
+        and pass the handler to the callback once its images are ordered."""
         nodes_holder = None
         input_path = os.path.normcase(input_path)
         Logger.debug(f"Scanning databank for input path {input_path}")
@@ -193,19 +492,78 @@ class MenuScreen(Screen):
             path = os.path.join(*dirs)
             nodes_holder = JSONDataBank.read(path)
 
-        image_handler = OnScreenImageHandler(input_path, nodes_holder)
+        image_handler = OnScreenImageHandler(
+            input_path, nodes_holder, deferred=self.ids.defer_check_box.active
+        )
         if image_handler.empty:
-            popup = Popup(
-                title="Folder scan warning",
-                content=Label(text="The input path does not contain images"),
-                auto_dismiss=True,
-                size_hint=(0.4, 0.4),
+            self.__show_warning(
+                "Folder scan warning", "The input path does not contain images"
             )
-            popup.open()
             return
 
-        self.parent.get_screen(MainScreen.screen_name).set_image_handler(image_handler)
-        self.parent.current = MainScreen.screen_name
+        if not self.ids.similarity_check_box.active:
+            image_handler.open_session(self.ids.order_spinner.text)
+            on_ready(image_handler)
+            return
+
+        popup = Popup(
+            title="Similarity order",
+            content=Label(text="Computing features of new images..."),
+            auto_dismiss=False,
+            size_hint=(0.4, 0.4),
+        )
+        popup.open()
+
+        def apply_order(order: list[str]) -> None:
+            popup.dismiss()
+            image_handler.open_similarity_session(order)
+            on_ready(image_handler)
+
+        start_similarity_order(
+            image_handler.paths,
+            lambda order: Clock.schedule_once(lambda _: apply_order(order)),
+        )
+
+    def __show_warning(self, title: str, text: str) -> None:
+        popup = Popup(
+            title=title,
+            content=Label(text=text),
+            auto_dismiss=True,
+            size_hint=(0.4, 0.4),
+        )
+        popup.open()
+
+
+def show_confirmation(
+    title: str,
+    lines: list[str],
+    button_texts: tuple[str, str],
+    on_close: Callable[[bool], None],
+) -> None:
+    """Show lines in a popup with confirm and reject buttons.
+    The callback gets True if the first button was pressed."""
+    content = BoxLayout(orientation="vertical")
+    preview_text = "\n".join(lines[:PREVIEW_LINES_LIMIT])
+    if len(lines) > PREVIEW_LINES_LIMIT:
+        preview_text += f"\n... and {len(lines) - PREVIEW_LINES_LIMIT} more"
+    content.add_widget(Label(text=preview_text, size_hint_y=8, font_size=12))
+
+    buttons_box = BoxLayout(orientation="horizontal")
+    confirm_btn = Button(text=button_texts[0])
+    reject_btn = Button(text=button_texts[1])
+    buttons_box.add_widget(confirm_btn)
+    buttons_box.add_widget(reject_btn)
+    content.add_widget(buttons_box)
+
+    popup = Popup(title=title, content=content, auto_dismiss=False, size_hint=(0.8, 0.8))
+
+    def close(confirmed: bool) -> None:
+        popup.dismiss()
+        on_close(confirmed)
+
+    confirm_btn.bind(on_release=lambda *_: close(True))  # type: ignore
+    reject_btn.bind(on_release=lambda *_: close(False))  # type: ignore
+    popup.open()
 
 
 class MainApp(App):
@@ -215,9 +573,22 @@ class MainApp(App):
         """Initiate the kivy app object and read eval schema."""
         super().__init__(*args, **kwargs)
         self.evaluation_schema = EvaluationSchema()
+        EvaluatedPic.storage_profiles = self.evaluation_schema.storage_profiles
+        if self.evaluation_schema.content_store:
+            EvaluatedPic.content_store = ContentStore()
+
+    def on_start(self) -> None:
+        """Prune the previews folder in the background."""
+        threading.Thread(
+            target=prune_previews, name="prune-previews", daemon=True
+        ).start()
 
     def on_stop(self) -> None:
-        self.root.current_screen.on_leave()  # type: ignore
+        screen = self.root.current_screen  # type: ignore
+        if isinstance(screen, MainScreen):
+            screen.finish_session(preview=False)
+        else:
+            screen.on_leave()
 
 
 if __name__ == "__main__":
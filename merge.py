@@ -0,0 +1,264 @@
+import argparse
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+
+from kivy.logger import Logger
+
+from content_store import ContentHash, ContentStore, content_hash
+from databank import JSONDataBank
+from eval_schema import EvaluationSchema
+from file_utils import (DEFAULT_DATABANK_DIR, DEFAULT_DB_PATH, DEFAULT_OUTPUT,
+                        TEMP_SUFFIX)
+from image_nodes import (EvaluatedPic, ImageNodesHolder, ImageStorageNode,
+                         NodePics, NodesCatsMap)
+
+HASH_WORKERS = 8
+"""Image files of both outputs trees hashed at once."""
+
+NEWEST_POLICY = "newest"
+"""Keep the evaluation from the node that was saved last."""
+MARKS_POLICY = "marks"
+"""Keep the evaluation with more evals, then with the higher sum of marks."""
+MANUAL_POLICY = "manual"
+"""Keep the target evaluation and list the conflict to be resolved by hand."""
+MERGE_POLICIES = [NEWEST_POLICY, MARKS_POLICY, MANUAL_POLICY]
+
+type IndexedPic = tuple[EvaluatedPic, float]
+"""Target image with the modification time of its node file."""
+
+
+class MergeConflict:
+    """The same image evaluated differently in both databanks."""
+
+    def __init__(self, source_pic: EvaluatedPic, target_pic: EvaluatedPic) -> None:
+        self.source_pic = source_pic
+        self.target_pic = target_pic
+
+    def __str__(self) -> str:
+        return (
+            f"{self.source_pic.storage_path} {self.source_pic.evals} vs "
+            f"{self.target_pic.storage_path} {self.target_pic.evals}"
+        )
+
+
+class MergeReport:
+    """Counts of what the merge did and conflicts left for manual resolution."""
+
+    def __init__(self) -> None:
+        self.added = 0
+        self.updated = 0
+        self.duplicates = 0
+        self.missing = 0
+        self.conflicts: list[MergeConflict] = []
+
+    def __str__(self) -> str:
+        return (
+            f"added {self.added}, updated {self.updated}, "
+            f"duplicates {self.duplicates}, missing {self.missing}, "
+            f"conflicts {len(self.conflicts)}"
+        )
+
+
+class DatabankMerger:
+    """Merges another outputs tree with its databank into the target one.
+
+    The whole target databank is kept in memory and indexed by content hash
+    once, reading every target image that has no hash saved in the databank.
+    The source databank is streamed node by node, so only one source node is
+    in memory at a time. Images new to the target are moved into the target tree (renamed
+    when on the same file system) and fitted to nodes with free buckets as usual.
+    The same image evaluated differently is resolved by the policy. After each
+    source node the target nodes it changed are saved, so an interrupted merge
+    leaves both databanks consistent and can be started again.
+    """
+
+    def __init__(
+        self,
+        target: ImageNodesHolder,
+        source_output: str,
+        policy: str = NEWEST_POLICY,
+        target_db_path: str = DEFAULT_DB_PATH,
+        workers: int = HASH_WORKERS,
+    ) -> None:
+        if policy not in MERGE_POLICIES:
+            raise ValueError(f"Unknown merge policy {policy}")
+        self.target = target
+        self.source_output = source_output
+        self.policy = policy
+        self.target_db_path = target_db_path
+        self.workers = workers
+        self.__index: dict[ContentHash, IndexedPic] = {}
+        self.__touched: NodesCatsMap = {}
+
+    def merge(self) -> MergeReport:
+        report = MergeReport()
+        self.__index_target()
+        source_db_path = os.path.join(self.source_output, DEFAULT_DATABANK_DIR)
+        for _, node_path in JSONDataBank.iter_node_files(source_db_path, source_db_path):
+            node = JSONDataBank.read_node(node_path)
+            node_mtime = os.path.getmtime(node_path)
+            for pic in self.__locate(node.images, report):
+                self.__merge_pic(pic, node_mtime, report)
+            self.__save_touched()
+        Logger.info(f"Merged {self.source_output}: {report}")
+        return report
+
+    def __index_target(self) -> None:
+        """Index target images by content hash. Files that have no hash in the
+        databank (all of them without a content store) are read and hashed,
+        which takes a pass over the target tree before anything is merged."""
+        pics: list[IndexedPic] = []
+        for nodes_key, sibling_nodes in self.target.image_nodes.items():
+            for node in sibling_nodes:
+                node_path = os.path.join(
+                    self.target_db_path, *nodes_key, f"{node.name}.json"
+                )
+                node_mtime = (
+                    os.path.getmtime(node_path) if os.path.isfile(node_path) else 0.0
+                )
+                pics.extend((pic, node_mtime) for pic in node.images)
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            hashes = executor.map(self.__hash, [pic for pic, _ in pics])
+            for indexed_pic, file_hash in zip(pics, hashes):
+                if file_hash is not None:
+                    self.__index[file_hash] = indexed_pic
+        Logger.info(f"Indexed {len(self.__index)} target images")
+
+    def __locate(self, pics: NodePics, report: MergeReport) -> NodePics:
+        """Point source images at their files in the source tree and hash them.
+        Images whose files are gone were merged by an earlier run. Symbolic
+        links to the source content store are kept as they are, the stored file
+        may be shared by other links."""
+        located: NodePics = []
+        for pic in pics:
+            relative_path = os.path.relpath(pic.storage_path, DEFAULT_OUTPUT)
+            source_path = os.path.join(self.source_output, relative_path)
+            if not os.path.isfile(source_path):
+                report.missing += 1
+                continue
+            pic.storage_path = os.path.normcase(source_path)
+            located.append(pic)
+
+        hashed: NodePics = []
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for pic, file_hash in zip(located, executor.map(self.__hash, located)):
+                if file_hash is None:
+                    report.missing += 1
+                    continue
+                pic.content_hash = file_hash
+                hashed.append(pic)
+        return hashed
+
+    def __merge_pic(
+        self, pic: EvaluatedPic, node_mtime: float, report: MergeReport
+    ) -> None:
+        file_hash = pic.content_hash or ""
+        indexed = self.__index.get(file_hash)
+        if indexed is None:
+            if os.path.islink(pic.storage_path):
+                self.__replace_link(pic.storage_path)
+            new_pic = EvaluatedPic(
+                storage_path=pic.storage_path,
+                categories=pic.categories,
+                evals=pic.evals,
+                resize=False,
+                tags=pic.tags,
+                metadata=pic.metadata,
+            )
+            self.__post(new_pic)
+            self.__index[file_hash] = (new_pic, node_mtime)
+            report.added += 1
+            return
+
+        target_pic, target_mtime = indexed
+        if target_pic.evals == pic.evals and target_pic.categories == pic.categories:
+            report.duplicates += 1
+            return
+        if self.policy == MANUAL_POLICY:
+            report.conflicts.append(MergeConflict(pic, target_pic))
+            return
+        if self.__source_wins(pic, node_mtime, target_pic, target_mtime):
+            old_key, old_node = target_pic.nodes_key, target_pic.node_ref
+            target_pic.categories = list(pic.categories)
+            target_pic.evals = pic.evals
+            target_pic.tags = pic.tags or target_pic.tags
+            if old_node is not None:
+                self.__touch(old_key, old_node)
+            self.__post(target_pic)
+            report.updated += 1
+        else:
+            report.duplicates += 1
+
+    def __source_wins(
+        self,
+        source_pic: EvaluatedPic,
+        source_mtime: float,
+        target_pic: EvaluatedPic,
+        target_mtime: float,
+    ) -> bool:
+        if self.policy == NEWEST_POLICY:
+            return source_mtime > target_mtime
+        source_marks = (len(source_pic.evals), sum(source_pic.evals.values()))
+        target_marks = (len(target_pic.evals), sum(target_pic.evals.values()))
+        return source_marks > target_marks
+
+    def __post(self, pic: EvaluatedPic) -> None:
+        self.target.post_pic(pic)
+        if pic.node_ref is not None:
+            self.__touch(pic.nodes_key, pic.node_ref)
+
+    def __touch(self, nodes_key: tuple[str, ...], node: ImageStorageNode) -> None:
+        sibling_nodes = self.__touched.setdefault(nodes_key, [])
+        if node not in sibling_nodes:
+            sibling_nodes.append(node)
+
+    def __save_touched(self) -> None:
+        """Save target nodes changed by the current source node."""
+        if len(self.__touched) == 0:
+            return
+        JSONDataBank.save(
+            ImageNodesHolder(self.__touched), append=False, root_path=self.target_db_path
+        )
+        self.__touched = {}
+
+    @staticmethod
+    def __replace_link(path: str) -> None:
+        """Replace a symbolic link with a copy of its target, so moving the image
+        leaves the file in the source content store to the other links."""
+        temp_path = f"{path}.{TEMP_SUFFIX}"
+        shutil.copy2(path, temp_path)
+        os.replace(temp_path, path)
+
+    @staticmethod
+    def __hash(pic: EvaluatedPic) -> ContentHash | None:
+        if pic.content_hash is not None:
+            return pic.content_hash
+        try:
+            return content_hash(pic.storage_path)
+        except OSError as err:
+            Logger.warning(f"Can't hash {pic.storage_path}: {err}")
+            return None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Merge another outputs folder with its databank into outputs."
+    )
+    parser.add_argument("source", help="outputs folder of the other instance")
+    parser.add_argument("--policy", choices=MERGE_POLICIES, default=NEWEST_POLICY)
+    parser.add_argument("--workers", type=int, default=HASH_WORKERS)
+    args = parser.parse_args()
+
+    evaluation_schema = EvaluationSchema()
+    EvaluatedPic.storage_profiles = evaluation_schema.storage_profiles
+    if evaluation_schema.content_store:
+        EvaluatedPic.content_store = ContentStore()
+    holder = JSONDataBank.read(DEFAULT_DB_PATH)
+    merge_report = DatabankMerger(
+        holder, args.source, args.policy, workers=args.workers
+    ).merge()
+    print(merge_report)
+    for conflict in merge_report.conflicts:
+        print(conflict)
@@ -0,0 +1,75 @@
+from kivy.logger import Logger
+
+from image_nodes import EvaluatedPic, ImageNodesHolder, ImageStoragePath
+
+type PlannedMove = tuple[EvaluatedPic, ImageStoragePath, ImageStoragePath]
+"""An image with its current path and the path it's moved to on commit."""
+
+
+class MovePlan:
+    """Final physical destinations of images posted in deferred mode.
+
+    However many times an image was posted during the session, only the node
+    it ended up in matters, so each image is moved (and re-encoded) at most once.
+    """
+
+    def __init__(self, nodes_holder: ImageNodesHolder) -> None:
+        """Plan moves for the pending images of the holder."""
+        self.__nodes_holder = nodes_holder
+        self.moves: list[PlannedMove] = []
+        reserved_paths: set[ImageStoragePath] = set()
+
+        for pic in nodes_holder.pending_pics:
+            if pic.node_ref is None:
+                continue
+            new_path = pic.node_folder(pic.node_ref.name)
+            new_file_path = pic.stored_file_path(new_path)
+            if new_file_path == pic.storage_path and not pic.resize:
+                continue
+
+            if new_file_path != pic.storage_path or new_file_path in reserved_paths:
+                new_file_path = pic.output_registry.unique_path(
+                    new_file_path, reserved_paths
+                )
+            reserved_paths.add(new_file_path)
+            self.moves.append((pic, pic.storage_path, new_file_path))
+
+    def __len__(self) -> int:
+        return len(self.moves)
+
+    def preview(self) -> list[str]:
+        """Human readable list of the planned moves."""
+        return [f"{old_path} -> {new_path}" for _, old_path, new_path in self.moves]
+
+    def commit(self) -> int:
+        """Move every planned image once and stop tracking pending images.
+
+        Moves that fail (e.g. the file was removed meanwhile) stay in the plan.
+        Their images keep the nodes they were fitted to, so the databank verifier
+        reports them as misplaced or missing. Returns the amount of failed moves.
+        """
+        failed: list[PlannedMove] = []
+        for move in self.moves:
+            pic, _, new_path = move
+            try:
+                pic.transfer(new_path)
+            except OSError as err:
+                Logger.warning(f"Can't move {pic.storage_path}: {err}")
+                failed.append(move)
+        Logger.info(
+            f"Committed {len(self.moves) - len(failed)} of {len(self.moves)} "
+            "planned image moves"
+        )
+        self.moves = failed
+        self.__nodes_holder.clear_pending()
+        return len(failed)
+
+    def cancel(self) -> None:
+        """Drop the plan together with the evaluations it was made for.
+
+        Images stay where they are and the databank keeps them as they were
+        before the session, so nothing is left for the verifier to move later.
+        """
+        Logger.info(f"Cancelled {len(self.moves)} planned image moves")
+        self.moves = []
+        self.__nodes_holder.revert_pending()
@@ -0,0 +1,103 @@
+import os
+
+from file_utils import DEFAULT_OUTPUT, OUTPUT_SERVICE_DIRS
+
+UNIQUE_SUFFIX_SEPARATOR = "_"
+
+
+class OutputTreeRegistry:
+    """In-memory registry of folders and file names of an outputs tree.
+
+    The tree is walked once, on first use, and then kept current by the code
+    that moves images, so existence and name collision checks don't need stat
+    calls. Registries are shared per outputs root.
+    """
+
+    __registries: dict[str, "OutputTreeRegistry"] = {}
+
+    def __init__(self, root: str = DEFAULT_OUTPUT) -> None:
+        self.root = os.path.normcase(os.path.normpath(root))
+        self.__folders: dict[str, set[str]] | None = None
+
+    @classmethod
+    def for_root(cls, root: str = DEFAULT_OUTPUT) -> "OutputTreeRegistry":
+        """Shared registry of the outputs root."""
+        key = os.path.normcase(os.path.abspath(root))
+        registry = cls.__registries.get(key)
+        if registry is None:
+            registry = cls(root)
+            cls.__registries[key] = registry
+        return registry
+
+    @classmethod
+    def forget(cls, root: str = DEFAULT_OUTPUT) -> None:
+        """Drop the shared registry of the root, for trees changed outside of the app."""
+        cls.__registries.pop(os.path.normcase(os.path.abspath(root)), None)
+
+    def invalidate(self) -> None:
+        """Walk the tree again on next use."""
+        self.__folders = None
+
+    def is_file(self, path: str) -> bool:
+        folder, name = self.__split(path)
+        if not self.__is_inside(folder):
+            return os.path.isfile(path)
+        return name in self.__registered_folders().get(folder, ())
+
+    def ensure_folder(self, folder: str) -> None:
+        """Create the folder with its parents unless it's known to exist."""
+        folder = self.__key(folder)
+        folders = self.__registered_folders()
+        if folder in folders:
+            return
+        os.makedirs(folder, exist_ok=True)
+        while self.__is_inside(folder) and folder not in folders:
+            folders[folder] = set()
+            folder = os.path.dirname(folder)
+
+    def unique_path(self, path: str, reserved: set[str] | None = None) -> str:
+        """The path itself if it's free, otherwise the path with the first free
+        numeric suffix. Reserved paths are treated as taken."""
+        reserved = reserved if reserved is not None else set()
+        stem, extension = os.path.splitext(path)
+        candidate = path
+        suffix_idx = 0
+        while self.is_file(candidate) or candidate in reserved:
+            suffix_idx += 1
+            candidate = f"{stem}{UNIQUE_SUFFIX_SEPARATOR}{suffix_idx}{extension}"
+        return candidate
+
+    def record_move(self, old_path: str, new_path: str) -> None:
+        """Register that a file was moved (or created when old path is outside)."""
+        if old_path != new_path:
+            self.record_removal(old_path)
+        folder, name = self.__split(new_path)
+        if self.__is_inside(folder):
+            self.__registered_folders().setdefault(folder, set()).add(name)
+
+    def record_removal(self, path: str) -> None:
+        folder, name = self.__split(path)
+        if self.__is_inside(folder):
+            self.__registered_folders().get(folder, set()).discard(name)
+
+    def __registered_folders(self) -> dict[str, set[str]]:
+        if self.__folders is None:
+            self.__folders = {}
+            for folder, dirs, files in os.walk(self.root):
+                if folder == self.root:
+                    dirs[:] = [dir for dir in dirs if dir not in OUTPUT_SERVICE_DIRS]
+                self.__folders[self.__key(folder)] = {
+                    os.path.normcase(file) for file in files
+                }
+        return self.__folders
+
+    def __is_inside(self, folder: str) -> bool:
+        return folder == self.root or folder.startswith(self.root + os.path.sep)
+
+    def __split(self, path: str) -> tuple[str, str]:
+        key = self.__key(path)
+        return os.path.dirname(key), os.path.basename(key)
+
+    @staticmethod
+    def __key(path: str) -> str:
+        return os.path.normcase(os.path.normpath(path))
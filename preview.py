@@ -0,0 +1,210 @@
+import hashlib
+import os
+import threading
+import time
+from collections.abc import Callable
+
+from kivy.clock import Clock
+from kivy.graphics.texture import Texture
+from kivy.logger import Logger
+from PIL import Image
+
+from image_metadata import ImageMetadata
+from image_nodes import ImageStoragePath
+
+DEFAULT_PREVIEW_DIR = "previews"
+PREVIEW_FORMAT = "jpeg"
+PREVIEW_QUALITY = 90
+PREVIEW_SIDE = 2560
+"""Longest side of previews. Previews have one size for any window, so those
+made ahead by the inbox ingester are the ones the app shows."""
+PROGRESSIVE_FACTOR = 1.5
+"""Images larger than the preview by this factor are shown through a preview first."""
+PREVIEW_CACHE_BYTES = 2 * 2**30
+"""Size the previews folder is pruned to, least recently shown previews go first."""
+PREVIEW_MAX_AGE = 90 * 24 * 3600
+"""Seconds since a preview was last shown after which it's pruned."""
+
+
+def needs_preview(metadata: ImageMetadata, max_side: int = PREVIEW_SIDE) -> bool:
+    """Check if decoding the whole image for the screen would be wasteful."""
+    return max(metadata.size) > max_side * PROGRESSIVE_FACTOR
+
+
+def cached_preview_path(
+    path: ImageStoragePath,
+    max_side: int = PREVIEW_SIDE,
+    preview_dir: str = DEFAULT_PREVIEW_DIR,
+) -> str:
+    """Path the reduced copy of the image is cached at, keyed by image path,
+    modification time, size and the max side, so a changed image gets a new one."""
+    stat = os.stat(path)
+    key = f"{path}|{stat.st_mtime_ns}|{stat.st_size}|{max_side}"
+    file_name = f"{hashlib.sha1(key.encode()).hexdigest()}.{PREVIEW_FORMAT}"
+    return os.path.join(preview_dir, file_name)
+
+
+def cached_preview(
+    path: ImageStoragePath,
+    max_side: int = PREVIEW_SIDE,
+    preview_dir: str = DEFAULT_PREVIEW_DIR,
+) -> str | None:
+    """Path to the cached reduced copy of the image if there is one. A hit
+    renews the modification time of the copy, which pruning goes by."""
+    cached_path = cached_preview_path(path, max_side, preview_dir)
+    try:
+        os.utime(cached_path)
+    except OSError:
+        return None
+    return cached_path
+
+
+def preview_path(
+    path: ImageStoragePath,
+    max_side: int = PREVIEW_SIDE,
+    preview_dir: str = DEFAULT_PREVIEW_DIR,
+) -> str:
+    """Path to a reduced copy of the image fitting max side, creating it if needed.
+
+    JPEG draft mode decodes the image already scaled down, which is much faster
+    than a full decode. The copy is written aside and renamed, so a concurrent
+    reader never sees a partial file.
+    """
+    cached_path = cached_preview(path, max_side, preview_dir)
+    if cached_path is not None:
+        return cached_path
+
+    cached_path = cached_preview_path(path, max_side, preview_dir)
+    os.makedirs(preview_dir, exist_ok=True)
+    temp_path = f"{cached_path}.{threading.get_ident()}.tmp"
+    with Image.open(path) as img:
+        img.draft("RGB", (max_side, max_side))
+        img = img.convert("RGB")
+        img.thumbnail((max_side, max_side))
+        img.save(temp_path, PREVIEW_FORMAT, quality=PREVIEW_QUALITY)
+    os.replace(temp_path, cached_path)
+    Logger.debug(f"Created preview {cached_path} for {path}")
+    return cached_path
+
+
+def prune_previews(
+    preview_dir: str = DEFAULT_PREVIEW_DIR,
+    max_bytes: int = PREVIEW_CACHE_BYTES,
+    max_age: float = PREVIEW_MAX_AGE,
+) -> int:
+    """Remove previews not shown for max age seconds, then the least recently
+    shown ones until the folder fits max bytes. Returns the amount of removed
+    previews."""
+    if not os.path.isdir(preview_dir):
+        return 0
+    previews: list[tuple[float, int, str]] = []
+    for entry in os.scandir(preview_dir):
+        if entry.is_file():
+            stat = entry.stat()
+            previews.append((stat.st_mtime, stat.st_size, entry.path))
+    previews.sort()
+
+    expired_before = time.time() - max_age
+    total_bytes = sum(size for _, size, _ in previews)
+    removed = 0
+    for modified, size, path in previews:
+        if modified >= expired_before and total_bytes <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total_bytes -= size
+        removed += 1
+    if removed:
+        Logger.info(f"Pruned {removed} previews from {preview_dir}")
+    return removed
+
+
+class BackgroundLoader:
+    """Loads images in worker threads and hands the results over on the UI
+    thread. Results of loads that were released meanwhile are dropped."""
+
+    thread_name = "image-loader"
+
+    def __init__(self) -> None:
+        self.__generation = 0
+        self.loading_path: ImageStoragePath | None = None
+
+    def load(self, path: ImageStoragePath, on_loaded: Callable) -> None:
+        """Start loading the image, on_loaded receives the result."""
+        if self.loading_path == path:
+            return
+        self.__generation += 1
+        self.loading_path = path
+        generation = self.__generation
+
+        def run() -> None:
+            try:
+                result = self._read(path)
+            except OSError as err:
+                Logger.warning(f"Can't load {path}: {err}")
+                return
+            Clock.schedule_once(
+                lambda _: self.__deliver(generation, result, on_loaded)
+            )
+
+        threading.Thread(target=run, name=self.thread_name, daemon=True).start()
+
+    def release(self) -> None:
+        """Forget the image that is loading or loaded."""
+        self.__generation += 1
+        self.loading_path = None
+
+    def _read(self, path: ImageStoragePath):
+        """Load the image, runs in the worker thread."""
+        raise NotImplementedError
+
+    def _finish(self, result):
+        """Make the result usable for widgets, runs on the UI thread."""
+        return result
+
+    def __deliver(self, generation: int, result, on_loaded: Callable) -> None:
+        if generation != self.__generation:
+            return
+        on_loaded(self._finish(result))
+
+
+class FullResolutionLoader(BackgroundLoader):
+    """Decodes full resolution images in a worker thread, on_loaded receives
+    them as textures."""
+
+    thread_name = "full-resolution"
+
+    def _read(self, path: ImageStoragePath) -> tuple[tuple[int, int], bytes]:
+        with Image.open(path) as img:
+            img = img.convert("RGB")
+            return img.size, img.tobytes()
+
+    def _finish(self, result: tuple[tuple[int, int], bytes]) -> Texture:
+        size, pixels = result
+        texture = Texture.create(size=size, colorfmt="rgb")
+        texture.blit_buffer(pixels, colorfmt="rgb", bufferfmt="ubyte")
+        texture.flip_vertical()
+        return texture
+
+
+class PreviewLoader(BackgroundLoader):
+    """Makes reduced copies of images in a worker thread, on_loaded receives
+    the path to show: the copy, or the image itself if it can't be reduced."""
+
+    thread_name = "preview"
+
+    def __init__(
+        self, max_side: int = PREVIEW_SIDE, preview_dir: str = DEFAULT_PREVIEW_DIR
+    ) -> None:
+        super().__init__()
+        self.max_side = max_side
+        self.preview_dir = preview_dir
+
+    def _read(self, path: ImageStoragePath) -> str:
+        try:
+            return preview_path(path, self.max_side, self.preview_dir)
+        except OSError as err:
+            Logger.warning(f"Can't make a preview of {path}: {err}")
+            return path
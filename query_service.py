@@ -0,0 +1,259 @@
+import argparse
+import json
+import os
+import socket
+import socketserver
+import threading
+from collections.abc import Callable
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from kivy.logger import Logger
+
+from databank import DEFAULT_ENCODING, JSONDataBank
+from databank_schema import DataBankSchema
+from eval_schema import EvalCategory
+from export import Selection, field_value, matches, parse_selection
+from file_utils import DEFAULT_DB_PATH
+from image_nodes import ImageStorageNode
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+REFRESH_INTERVAL = 2.0
+"""Seconds between checks of node files for changes."""
+MAX_CACHED_QUERIES = 256
+"""Queries whose per node answers are kept, the oldest are dropped first."""
+
+IMAGES_ENDPOINT = "/images"
+COUNT_ENDPOINT = "/count"
+MARKS_ENDPOINT = "/marks"
+SELECT_PARAM = "select"
+FIELD_PARAM = "field"
+
+type NodeKey = tuple[str, ...]
+type NodeFile = str
+"""Path of a node json file, which identifies the node in the mirror."""
+
+type NodeStamp = tuple[int, int]
+"""Modification time and size of a node file."""
+
+type NodeAnswer = list[dict] | dict[int, int]
+"""Part of a response computed from one node: matched images or mark counts."""
+
+
+class DatabankMirror:
+    """Keeps the databank in memory and current by re-reading only the node
+    files that changed since the last refresh.
+
+    Answers are computed per node and cached per query, so a change in a node
+    invalidates only that node's part of cached answers.
+    """
+
+    def __init__(self, db_path: str = DEFAULT_DB_PATH) -> None:
+        self.db_path = db_path
+        self.__lock = threading.Lock()
+        self.__nodes: dict[NodeFile, tuple[NodeKey, NodeStamp, ImageStorageNode]] = {}
+        self.__answers: dict[str, dict[NodeFile, NodeAnswer]] = {}
+
+    def __len__(self) -> int:
+        return len(self.__nodes)
+
+    def refresh(self) -> int:
+        """Re-read changed and new node files, drop removed ones.
+        Returns the amount of nodes that changed."""
+        stamps: dict[NodeFile, tuple[NodeKey, NodeStamp]] = {}
+        for node_key, node_path in JSONDataBank.iter_node_files(
+            self.db_path, self.db_path
+        ):
+            try:
+                stat = os.stat(node_path)
+            except OSError:
+                continue
+            stamps[node_path] = (node_key, (stat.st_mtime_ns, stat.st_size))
+
+        changed: dict[NodeFile, tuple[NodeKey, NodeStamp, ImageStorageNode]] = {}
+        for node_path, (node_key, stamp) in stamps.items():
+            known = self.__nodes.get(node_path)
+            if known is not None and known[1] == stamp:
+                continue
+            try:
+                changed[node_path] = (node_key, stamp, JSONDataBank.read_node(node_path))
+            except (OSError, ValueError) as err:
+                # The app may be writing the file, it is read on the next refresh
+                Logger.warning(f"Can't read node {node_path}: {err}")
+        removed = [node_path for node_path in self.__nodes if node_path not in stamps]
+
+        if changed or removed:
+            with self.__lock:
+                for node_path in removed:
+                    del self.__nodes[node_path]
+                self.__nodes.update(changed)
+                for node_answers in self.__answers.values():
+                    for node_path in [*changed, *removed]:
+                        node_answers.pop(node_path, None)
+        return len(changed) + len(removed)
+
+    def images(self, selection_query: str) -> list[dict]:
+        """Paths, evals and tags of images satisfying the selection."""
+        selection = parse_selection(selection_query)
+        answers = self.__answer(
+            f"{IMAGES_ENDPOINT}?{selection_query}",
+            lambda node: self.__node_images(node, selection),
+        )
+        return [image for node_images in answers for image in node_images]
+
+    def count(self, selection_query: str) -> int:
+        return len(self.images(selection_query))
+
+    def marks(self, field: EvalCategory, selection_query: str = "") -> dict[int, int]:
+        """Amounts of selected images per mark of the eval (or metadata field)."""
+        selection = parse_selection(selection_query)
+        answers = self.__answer(
+            f"{MARKS_ENDPOINT}?{field}?{selection_query}",
+            lambda node: self.__node_marks(node, field, selection),
+        )
+        totals: dict[int, int] = {}
+        for node_marks in answers:
+            for mark, amount in node_marks.items():
+                totals[mark] = totals.get(mark, 0) + amount
+        return dict(sorted(totals.items()))
+
+    def __answer(
+        self, query_key: str, compute: Callable[[ImageStorageNode], NodeAnswer]
+    ) -> list:
+        """Per node parts of the answer, computing only those not cached."""
+        with self.__lock:
+            node_answers = self.__answers.pop(query_key, {})
+            if len(self.__answers) >= MAX_CACHED_QUERIES:
+                del self.__answers[next(iter(self.__answers))]
+            self.__answers[query_key] = node_answers
+            for node_path, (_, _, node) in self.__nodes.items():
+                if node_path not in node_answers:
+                    node_answers[node_path] = compute(node)
+            return [node_answers[node_path] for node_path in sorted(node_answers)]
+
+    @staticmethod
+    def __node_images(node: ImageStorageNode, selection: Selection) -> list[dict]:
+        return [
+            {
+                DataBankSchema.storage_path: pic.storage_path,
+                DataBankSchema.evals: pic.evals,
+                DataBankSchema.tags: pic.tags,
+            }
+            for pic in node.images
+            if matches(pic, selection)
+        ]
+
+    @staticmethod
+    def __node_marks(
+        node: ImageStorageNode, field: EvalCategory, selection: Selection
+    ) -> dict[int, int]:
+        node_marks: dict[int, int] = {}
+        for pic in node.images:
+            mark = field_value(pic, field)
+            if mark is not None and matches(pic, selection):
+                node_marks[mark] = node_marks.get(mark, 0) + 1
+        return node_marks
+
+
+class QueryHandler(BaseHTTPRequestHandler):
+    """Answers GET requests from the databank mirror of the server with json."""
+
+    server: "QueryServer"
+
+    def do_GET(self) -> None:
+        url = urlsplit(self.path)
+        params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        selection_query = params.get(SELECT_PARAM, "")
+        mirror = self.server.mirror
+        try:
+            if url.path == IMAGES_ENDPOINT:
+                body: object = mirror.images(selection_query)
+            elif url.path == COUNT_ENDPOINT:
+                body = {"count": mirror.count(selection_query)}
+            elif url.path == MARKS_ENDPOINT and FIELD_PARAM in params:
+                body = mirror.marks(params[FIELD_PARAM], selection_query)
+            else:
+                self.__reply(404, {"error": f"Unknown query {url.path}"})
+                return
+        except ValueError as err:
+            self.__reply(400, {"error": str(err)})
+            return
+        self.__reply(200, body)
+
+    def log_message(self, format: str, *args) -> None:
+        Logger.debug(f"Query: {format % args}")
+
+    def __reply(self, status: int, body: object) -> None:
+        data = json.dumps(body).encode(DEFAULT_ENCODING)
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class QueryServer(ThreadingHTTPServer):
+    """HTTP server of databank queries, refreshing the mirror in the background."""
+
+    daemon_threads = True
+
+    def __init__(self, address, mirror: DatabankMirror) -> None:
+        self.mirror = mirror
+        self.__stop_refresh = threading.Event()
+        super().__init__(address, QueryHandler)
+
+    def serve_forever(self, poll_interval: float = 0.5) -> None:
+        self.mirror.refresh()
+        Logger.info(f"Serving {len(self.mirror)} nodes of {self.mirror.db_path}")
+        refresher = threading.Thread(target=self.__refresh_loop, daemon=True)
+        refresher.start()
+        try:
+            super().serve_forever(poll_interval)
+        finally:
+            self.__stop_refresh.set()
+
+    def __refresh_loop(self) -> None:
+        while not self.__stop_refresh.wait(REFRESH_INTERVAL):
+            changed = self.mirror.refresh()
+            if changed:
+                Logger.info(f"Reloaded {changed} changed nodes")
+
+
+class UnixQueryServer(QueryServer):
+    """Query server listening on a Unix socket instead of a TCP port."""
+
+    address_family = socket.AF_UNIX
+
+    def server_bind(self) -> None:
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
+        socketserver.TCPServer.server_bind(self)
+        self.server_name = "localhost"
+        self.server_port = 0
+
+    def get_request(self):
+        request, _ = super().get_request()
+        return request, ("local", 0)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Serve read-only queries of the databank over local HTTP."
+    )
+    parser.add_argument("databank", nargs="?", default=DEFAULT_DB_PATH)
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--socket", help="listen on the Unix socket path instead")
+    args = parser.parse_args()
+
+    databank_mirror = DatabankMirror(args.databank)
+    if args.socket is not None:
+        server: QueryServer = UnixQueryServer(args.socket, databank_mirror)
+    else:
+        server = QueryServer((args.host, args.port), databank_mirror)
+    with server:
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
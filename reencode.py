@@ -0,0 +1,146 @@
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from kivy.logger import Logger
+from PIL import Image
+
+from content_store import ContentStore
+from databank import JSONDataBank
+from eval_schema import EvaluationSchema
+from file_utils import DEFAULT_DB_PATH, DEFAULT_STORAGE_PROFILE, TEMP_SUFFIX
+from image_metadata import ImageMetadata
+from image_nodes import EvaluatedPic, ImageNodesHolder, ImageStoragePath, NodePics
+from storage_profile import DEFAULT_PROFILE_KEY, StorageProfile, profile_for
+
+REENCODE_CHUNKSIZE = 16
+
+type ReencodeTask = tuple[ImageStoragePath, ImageStoragePath, StorageProfile, bool]
+"""Image path, path to store it at, profile to encode it with and if it should be
+downsized to fit the profile max size."""
+
+
+def reencode_file(task: ReencodeTask) -> tuple[int, int] | None:
+    """Encode the image with the profile, replacing the original file.
+    Runs in worker processes. Returns sizes in bytes before and after
+    or None if the image can't be read.
+    """
+    path, new_path, profile, downsize = task
+    if new_path != path and os.path.exists(new_path):
+        Logger.warning(f"Can't re-encode {path}: {new_path} already exists")
+        return None
+    try:
+        old_size = os.path.getsize(path)
+        temp_path = f"{new_path}.{TEMP_SUFFIX}"
+        with Image.open(path) as original:
+            image_info = original.info
+            img = (
+                original
+                if original.mode in profile.allowed_modes
+                else original.convert("RGB")
+            )
+            if downsize and max(img.size) > profile.max_size:
+                img.thumbnail((profile.max_size, profile.max_size))
+            img.save(temp_path, profile.file_format, **profile.save_options(image_info))
+    except OSError as err:
+        Logger.warning(f"Can't re-encode {path}: {err}")
+        return None
+
+    os.replace(temp_path, new_path)
+    if new_path != path:
+        os.remove(path)
+    return old_size, os.path.getsize(new_path)
+
+
+class ReencodeJob:
+    """Applies a storage profile to images already stored in the outputs tree,
+    in parallel processes, and reports the bytes saved."""
+
+    def __init__(
+        self,
+        profile: StorageProfile,
+        downsize: bool = False,
+        workers: int | None = None,
+    ) -> None:
+        """Images that are larger than the profile max size were either kept
+        in high resolution on purpose or stored before the profile, so they're
+        downsized only if asked to."""
+        self.profile = profile
+        self.downsize = downsize
+        self.workers = workers
+
+    def run(self, pics: NodePics) -> int:
+        """Re-encode images, update their paths and metadata. The hash of the old
+        file is dropped, with a content store the new file is stored instead.
+        Returns the amount of bytes saved."""
+        tasks: list[ReencodeTask] = [
+            (
+                pic.storage_path,
+                os.path.normcase(
+                    os.path.splitext(pic.storage_path)[0] + f".{self.profile.file_format}"
+                ),
+                self.profile,
+                self.downsize,
+            )
+            for pic in pics
+        ]
+        saved_bytes = 0
+        reencoded = 0
+        with ProcessPoolExecutor(max_workers=self.workers) as executor:
+            results = executor.map(reencode_file, tasks, chunksize=REENCODE_CHUNKSIZE)
+            for pic, task, sizes in zip(pics, tasks, results):
+                if sizes is None:
+                    continue
+                pic.storage_path = task[1]
+                pic.metadata = ImageMetadata.read(pic.storage_path)
+                pic.content_hash = None
+                pic.store_content()
+                saved_bytes += sizes[0] - sizes[1]
+                reencoded += 1
+
+        Logger.info(f"Re-encoded {reencoded} images, saved {saved_bytes} bytes")
+        return saved_bytes
+
+
+def category_pics(
+    nodes_holder: ImageNodesHolder, category: str, schema: EvaluationSchema
+) -> NodePics:
+    """Images whose storage profile is the one of the category. The default
+    profile is the one of uncategorized images and categories without a profile."""
+    profile = schema.storage_profiles.get(category)
+    return [
+        pic
+        for pic in nodes_holder.list_images()
+        if (category == DEFAULT_PROFILE_KEY or category in pic.categories)
+        and profile_for(pic.categories, schema.storage_profiles, DEFAULT_STORAGE_PROFILE)
+        is profile
+    ]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Re-encode stored images of a category with its storage profile."
+    )
+    parser.add_argument(
+        "category", help=f"category from the schema or {DEFAULT_PROFILE_KEY}"
+    )
+    parser.add_argument(
+        "--downsize", action="store_true", help="downsize images to the profile max size"
+    )
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    evaluation_schema = EvaluationSchema()
+    EvaluatedPic.storage_profiles = evaluation_schema.storage_profiles
+    if evaluation_schema.content_store:
+        EvaluatedPic.content_store = ContentStore()
+    if args.category not in evaluation_schema.storage_profiles:
+        parser.error(f"No storage profile for {args.category} in the schema")
+
+    holder = JSONDataBank.read(DEFAULT_DB_PATH)
+    job = ReencodeJob(
+        evaluation_schema.storage_profiles[args.category], args.downsize, args.workers
+    )
+    saved = job.run(category_pics(holder, args.category, evaluation_schema))
+    JSONDataBank.save(holder, append=False)
+    print(f"Saved {saved / 2**20:.1f} MiB")
@@ -0,0 +1,147 @@
+import hashlib
+import json
+import os
+
+from kivy.logger import Logger
+
+from databank import DEFAULT_ENCODING
+from eval_schema import EvalCategory, Evaluations
+from image_nodes import EvaluatedPic, ImageStoragePath, PicTags
+
+DEFAULT_SESSIONS_DIR = "sessions"
+
+WALK_ORDER = "walk"
+"""Images in the order they were found."""
+UNEVALUATED_ORDER = "unevaluated first"
+TAGS_ORDER = "by tags"
+EVAL_ORDER_PREFIX = "by "
+"""Prefix of orders by an eval, e.g. "by cat1", highest marks first."""
+SIMILARITY_ORDER = "similarity"
+"""Images ordered so that neighbours look alike, computed by the similarity
+module rather than the session index."""
+
+type SessionRecord = tuple[Evaluations, PicTags]
+"""What orderings need to know about a session image."""
+
+
+def session_orders(evals: list[EvalCategory]) -> list[str]:
+    """Names of the orders a session can be opened in."""
+    return [UNEVALUATED_ORDER, WALK_ORDER, TAGS_ORDER] + [
+        f"{EVAL_ORDER_PREFIX}{category}" for category in evals
+    ]
+
+
+class SessionIndex:
+    """Compact records of session images that orderings are computed from.
+
+    Each ordering is computed once, as a sort of plain keys, and cached until
+    an image changes.
+    """
+
+    def __init__(self) -> None:
+        self.__records: dict[ImageStoragePath, SessionRecord] = {}
+        self.__orders: dict[str, list[ImageStoragePath]] = {}
+
+    def __len__(self) -> int:
+        return len(self.__records)
+
+    def add(self, path: ImageStoragePath, evals: Evaluations, tags: PicTags) -> None:
+        self.__records[path] = (evals, tags)
+        self.__orders.clear()
+
+    def update(self, old_path: ImageStoragePath, pic: EvaluatedPic) -> None:
+        """Update the record of an image that could've been re-evaluated or moved."""
+        record = (pic.evals, pic.tags)
+        if self.__records.get(pic.storage_path) == record:
+            return
+        self.__records.pop(old_path, None)
+        self.add(pic.storage_path, *record)
+
+    def evaluated(self, path: ImageStoragePath) -> bool:
+        record = self.__records.get(path)
+        return record is not None and len(record[0]) > 0
+
+    def order(self, name: str) -> list[ImageStoragePath]:
+        """Image paths in the named order."""
+        if name not in self.__orders:
+            self.__orders[name] = self.__compute_order(name)
+        return self.__orders[name]
+
+    def __compute_order(self, name: str) -> list[ImageStoragePath]:
+        records = self.__records
+        if name == UNEVALUATED_ORDER:
+            return sorted(records, key=lambda path: len(records[path][0]) > 0)
+        if name == TAGS_ORDER:
+            return sorted(
+                records,
+                key=lambda path: (records[path][1] == "", records[path][1].lower()),
+            )
+        if name.startswith(EVAL_ORDER_PREFIX):
+            category = name[len(EVAL_ORDER_PREFIX):]
+            return sorted(
+                records,
+                key=lambda path: -records[path][0].get(category, 0),
+            )
+        return list(records)
+
+
+class SessionState:
+    """Image order and cursor of a session, kept per input path outside
+    of the databank."""
+
+    order_key = "Order"
+    paths_key = "Paths"
+    cursor_key = "Cursor"
+    input_key = "Input"
+
+    def __init__(
+        self,
+        input_path: str,
+        order: str = WALK_ORDER,
+        paths: list[ImageStoragePath] | None = None,
+        cursor: int = 0,
+    ) -> None:
+        self.input_path = os.path.normcase(input_path)
+        self.order = order
+        self.paths = paths if paths is not None else []
+        self.cursor = cursor
+
+    @staticmethod
+    def state_path(input_path: str, sessions_dir: str = DEFAULT_SESSIONS_DIR) -> str:
+        key = hashlib.sha1(os.path.normcase(input_path).encode()).hexdigest()
+        return os.path.join(sessions_dir, f"{key}.json")
+
+    @classmethod
+    def load(
+        cls, input_path: str, sessions_dir: str = DEFAULT_SESSIONS_DIR
+    ) -> "SessionState | None":
+        """Saved state of the input path session, if there is one."""
+        path = cls.state_path(input_path, sessions_dir)
+        if not os.path.isfile(path):
+            return None
+        try:
+            with open(path, "r", encoding=DEFAULT_ENCODING) as fstream:
+                state_json = json.load(fstream)
+        except (OSError, ValueError) as err:
+            Logger.warning(f"Can't read session state {path}: {err}")
+            return None
+        return cls(
+            input_path,
+            state_json[cls.order_key],
+            state_json[cls.paths_key],
+            state_json[cls.cursor_key],
+        )
+
+    def save(self, sessions_dir: str = DEFAULT_SESSIONS_DIR) -> None:
+        path = self.state_path(self.input_path, sessions_dir)
+        os.makedirs(sessions_dir, exist_ok=True)
+        with open(path, "w", encoding=DEFAULT_ENCODING) as fstream:
+            json.dump(
+                {
+                    self.input_key: self.input_path,
+                    self.order_key: self.order,
+                    self.paths_key: self.paths,
+                    self.cursor_key: self.cursor,
+                },
+                fstream,
+            )
@@ -0,0 +1,277 @@
+import math
+import os
+import tempfile
+import threading
+from collections.abc import Callable
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from kivy.logger import Logger
+from PIL import Image
+
+from file_utils import DEFAULT_OUTPUT, TEMP_SUFFIX
+from image_nodes import ImageStoragePath
+
+DEFAULT_SIMILARITY_CACHE = os.path.join(DEFAULT_OUTPUT, "similarity.npz")
+HISTOGRAM_BINS = 4
+"""Bins per RGB channel of the color histogram."""
+THUMBNAIL_SIZE = 8
+"""Side of the grayscale thumbnail used as a layout embedding."""
+FEATURE_SIZE = HISTOGRAM_BINS**3 + THUMBNAIL_SIZE**2
+DECODE_SIZE = 64
+"""Images are decoded (JPEG draft mode) close to this size to compute features."""
+KMEANS_ITERATIONS = 4
+ASSIGN_CHUNK = 8192
+"""Images scored against all centroids at once, bounds temporary memory."""
+FEATURES_CHUNKSIZE = 32
+
+type Features = np.ndarray
+"""L2-normalized float32 vectors, one row per image."""
+
+type FileSignature = tuple[int, float]
+"""File size and modification time, identifies a file that was only renamed."""
+
+
+def compute_features(path: ImageStoragePath) -> Features | None:
+    """Color histogram and downsampled grayscale layout of the image, normalized.
+    Runs in worker processes. Returns None if the image can't be read.
+    """
+    try:
+        with Image.open(path) as img:
+            img.draft("RGB", (DECODE_SIZE, DECODE_SIZE))
+            img = img.convert("RGB")
+            img.thumbnail((DECODE_SIZE, DECODE_SIZE))
+            pixels = np.asarray(img, dtype=np.uint8).reshape(-1, 3)
+            layout = np.asarray(
+                img.convert("L").resize((THUMBNAIL_SIZE, THUMBNAIL_SIZE)),
+                dtype=np.float32,
+            ).ravel()
+    except OSError:
+        return None
+
+    bins = (pixels // (256 // HISTOGRAM_BINS)).astype(np.int32)
+    bin_index = (bins[:, 0] * HISTOGRAM_BINS + bins[:, 1]) * HISTOGRAM_BINS + bins[:, 2]
+    histogram = np.bincount(bin_index, minlength=HISTOGRAM_BINS**3).astype(np.float32)
+    histogram = np.sqrt(histogram / max(histogram.sum(), 1))
+
+    layout -= layout.mean()
+    layout /= max(float(np.linalg.norm(layout)), 1e-6)
+
+    features = np.concatenate((histogram, layout))
+    return features / max(float(np.linalg.norm(features)), 1e-6)
+
+
+def file_signature(path: ImageStoragePath) -> FileSignature | None:
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_size, stat.st_mtime
+
+
+class SimilarityIndex:
+    """Feature vectors of images for nearest neighbor queries and similarity ordering.
+
+    Features are cached per path and modification time, renamed files are
+    recognized by size and modification time, so moving images into the
+    outputs tree doesn't invalidate them.
+    """
+
+    def __init__(self, cache_path: str = DEFAULT_SIMILARITY_CACHE) -> None:
+        """Load cached features if there are any."""
+        self.cache_path = cache_path
+        self.paths: list[ImageStoragePath] = []
+        self.signatures: list[FileSignature] = []
+        self.features: Features = np.zeros((0, FEATURE_SIZE), dtype=np.float32)
+
+        if os.path.isfile(cache_path):
+            try:
+                with np.load(cache_path) as cache:
+                    paths = cache["paths"].tolist()
+                    signatures = [
+                        (int(size), float(mtime))
+                        for size, mtime in zip(cache["sizes"], cache["mtimes"])
+                    ]
+                    features = cache["features"]
+                self.paths, self.signatures, self.features = paths, signatures, features
+            except Exception as err:
+                # A broken cache is only a loss of time, features are computed again
+                Logger.warning(f"Can't read similarity cache {cache_path}: {err}")
+        self.__positions = {path: idx for idx, path in enumerate(self.paths)}
+
+    def update(self, paths: list[ImageStoragePath], workers: int | None = None) -> None:
+        """Add the given images to the index, computing features in a process pool
+        only for new or changed files. Other cached images are kept unless their
+        files were deleted, so indexing one folder doesn't evict another."""
+        by_signature = {sig: idx for idx, sig in enumerate(self.signatures)}
+        requested = list(dict.fromkeys(paths))
+        rows: list[int | None] = []
+        signatures: list[FileSignature] = []
+        missing: list[int] = []
+
+        for path in requested:
+            signature = file_signature(path) or (-1, -1.0)
+            cached_idx = self.__positions.get(path)
+            if cached_idx is None or self.signatures[cached_idx] != signature:
+                cached_idx = by_signature.get(signature)
+            if cached_idx is None:
+                missing.append(len(rows))
+            rows.append(cached_idx)
+            signatures.append(signature)
+
+        requested_set = set(requested)
+        kept = [
+            idx
+            for idx, path in enumerate(self.paths)
+            if path not in requested_set and os.path.exists(path)
+        ]
+        features = np.zeros((len(kept) + len(requested), FEATURE_SIZE), dtype=np.float32)
+        features[: len(kept)] = self.features[kept]
+        cached = [
+            (len(kept) + idx, row) for idx, row in enumerate(rows) if row is not None
+        ]
+        if cached:
+            targets, sources = zip(*cached)
+            features[list(targets)] = self.features[list(sources)]
+
+        if missing:
+            Logger.info(f"Computing similarity features for {len(missing)} images")
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                computed = executor.map(
+                    compute_features,
+                    [requested[idx] for idx in missing],
+                    chunksize=FEATURES_CHUNKSIZE,
+                )
+                for idx, vector in zip(missing, computed):
+                    if vector is not None:
+                        features[len(kept) + idx] = vector
+
+        self.paths = [self.paths[idx] for idx in kept] + requested
+        self.signatures = [self.signatures[idx] for idx in kept] + signatures
+        self.features = features
+        self.__positions = {path: idx for idx, path in enumerate(self.paths)}
+
+    def save(self) -> None:
+        """Write the cache to a temporary file and rename it over the old one, so
+        the app and ingest saving it at the same time never leave it half written."""
+        cache_folder = os.path.dirname(self.cache_path) or "."
+        os.makedirs(cache_folder, exist_ok=True)
+        sizes, mtimes = zip(*self.signatures) if self.signatures else ((), ())
+        with tempfile.NamedTemporaryFile(
+            dir=cache_folder, suffix=f".{TEMP_SUFFIX}", delete=False
+        ) as fstream:
+            try:
+                np.savez(
+                    fstream,
+                    paths=np.array(self.paths, dtype=str),
+                    sizes=np.array(sizes, dtype=np.int64),
+                    mtimes=np.array(mtimes, dtype=np.float64),
+                    features=self.features,
+                )
+            except BaseException:
+                fstream.close()
+                os.remove(fstream.name)
+                raise
+        os.replace(fstream.name, self.cache_path)
+
+    def nearest(self, path: ImageStoragePath, count: int = 10) -> list[ImageStoragePath]:
+        """Most similar images to the indexed image, most similar first."""
+        idx = self.__positions[path]
+        similarity = self.features @ self.features[idx]
+        similarity[idx] = -np.inf
+        count = min(count, len(self.paths) - 1)
+        if count <= 0:
+            return []
+        closest = np.argpartition(-similarity, count - 1)[:count]
+        closest = closest[np.argsort(-similarity[closest])]
+        return [self.paths[i] for i in closest]
+
+    def similarity_order(
+        self, paths: list[ImageStoragePath] | None = None
+    ) -> list[ImageStoragePath]:
+        """Order the indexed images (all of them by default) so that neighbours
+        look alike.
+
+        Images are clustered with a few k-means iterations on sqrt(n) clusters,
+        clusters are chained greedily by their centroids and images are chained
+        greedily within each cluster.
+        """
+        if paths is None:
+            paths = self.paths
+        count = len(paths)
+        if count < 3:
+            return list(paths)
+
+        features = self.features[[self.__positions[path] for path in paths]]
+        centroids, labels = cluster(features, max(1, int(math.sqrt(count))))
+        members = np.argsort(labels, kind="stable")
+        bounds = np.searchsorted(labels[members], np.arange(len(centroids) + 1))
+
+        order: list[int] = []
+        for cluster_idx in greedy_chain(centroids, start=0):
+            cluster_members = members[bounds[cluster_idx] : bounds[cluster_idx + 1]]
+            if len(cluster_members) == 0:
+                continue
+            start = 0
+            if order:
+                start = int(np.argmax(features[cluster_members] @ features[order[-1]]))
+            chain = greedy_chain(features[cluster_members], start)
+            order.extend(int(cluster_members[idx]) for idx in chain)
+        return [paths[idx] for idx in order]
+
+
+def start_similarity_order(
+    paths: list[ImageStoragePath],
+    on_done: Callable[[list[ImageStoragePath]], None],
+    cache_path: str = DEFAULT_SIMILARITY_CACHE,
+) -> threading.Thread:
+    """Index the images and order them by similarity in a background thread.
+    The callback gets the order from that thread, or the paths as they are
+    if the images couldn't be indexed."""
+
+    def run() -> None:
+        order = list(paths)
+        try:
+            similarity_index = SimilarityIndex(cache_path)
+            similarity_index.update(paths)
+            similarity_index.save()
+            order = similarity_index.similarity_order(paths)
+        except (OSError, ValueError) as err:
+            Logger.error(f"Similarity order failed: {err}")
+        finally:
+            on_done(order)
+
+    thread = threading.Thread(target=run, name="similarity-order", daemon=True)
+    thread.start()
+    return thread
+
+
+def cluster(features: Features, clusters: int) -> tuple[Features, np.ndarray]:
+    """Spherical k-means, returns centroids and cluster label for each row."""
+    rng = np.random.default_rng(0)
+    centroids = features[rng.choice(len(features), clusters, replace=False)]
+    labels = np.zeros(len(features), dtype=np.int64)
+    for _ in range(KMEANS_ITERATIONS):
+        for start in range(0, len(features), ASSIGN_CHUNK):
+            chunk = features[start : start + ASSIGN_CHUNK]
+            labels[start : start + ASSIGN_CHUNK] = np.argmax(chunk @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, features)
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        non_empty = norms[:, 0] > 0
+        centroids[non_empty] = sums[non_empty] / norms[non_empty]
+    return centroids, labels
+
+
+def greedy_chain(features: Features, start: int) -> list[int]:
+    """Visit rows starting from start, always going to the most similar unvisited row."""
+    visited = np.zeros(len(features), dtype=bool)
+    chain = [start]
+    visited[start] = True
+    for _ in range(len(features) - 1):
+        similarity = features @ features[chain[-1]]
+        similarity[visited] = -np.inf
+        following = int(np.argmax(similarity))
+        visited[following] = True
+        chain.append(following)
+    return chain
@@ -0,0 +1,265 @@
+import argparse
+import json
+import os
+import shutil
+from datetime import datetime
+
+from kivy.logger import Logger
+
+from content_store import ContentHash, content_hash
+from databank import DEFAULT_ENCODING
+from file_utils import (DEFAULT_DATABANK_DIR, DEFAULT_OUTPUT, DEFAULT_STORE_DIR,
+                        IMAGE_FILE_FORMATS, OUTPUT_SERVICE_DIRS, filter_files)
+from output_registry import OutputTreeRegistry
+
+DEFAULT_SNAPSHOT_DIR = "snapshots"
+OBJECTS_DIR = "objects"
+NODES_DIR = "nodes"
+MANIFESTS_DIR = "manifests"
+SNAPSHOT_NAME_FORMAT = "%Y%m%dT%H%M%S"
+
+TAKE_ACTION = "take"
+LIST_ACTION = "list"
+RESTORE_ACTION = "restore"
+GC_ACTION = "gc"
+
+
+class ManifestSchema:
+    """Describes the names of json nodes of a snapshot manifest."""
+
+    created = "Created"
+    images = "Images"
+    nodes = "Nodes"
+    path = "Path"
+    content_hash = "Hash"
+    inode = "Inode"
+    size = "Size"
+    modified = "Modified"
+
+
+type StatKey = tuple[int, int, int]
+"""Inode, size and modification time of a file."""
+
+type ManifestEntry = dict
+"""File of the snapshot: path relative to its tree, content hash and the stat
+fields that tell if the file changed since."""
+
+
+class SnapshotStore:
+    """Incremental snapshots of the outputs tree and its databank.
+
+    Image files are kept once per content hash as hard links, so a snapshot
+    costs no disk space for images that are still in outputs. Node json files
+    are small and rewritten in place by the app, so they are copied, also once
+    per content hash. A manifest lists the files of each snapshot. Files whose
+    inode, size and modification time are in the previous manifest are not read
+    again, so images moved between node folders are recognized by the stat alone.
+    """
+
+    def __init__(
+        self, root: str = DEFAULT_SNAPSHOT_DIR, output_folder: str = DEFAULT_OUTPUT
+    ) -> None:
+        self.root = root
+        self.output_folder = output_folder
+
+    @property
+    def db_path(self) -> str:
+        return os.path.join(self.output_folder, DEFAULT_DATABANK_DIR)
+
+    def names(self) -> list[str]:
+        """Names of the snapshots, oldest first."""
+        manifests_path = os.path.join(self.root, MANIFESTS_DIR)
+        if not os.path.isdir(manifests_path):
+            return []
+        manifests = filter_files(os.listdir(manifests_path), "json")
+        return sorted(os.path.splitext(file)[0] for file in manifests)
+
+    def take(self) -> str:
+        """Snapshot the current outputs tree and databank. Returns the snapshot name."""
+        snapshots = self.names()
+        previous = self.__read_manifest(snapshots[-1]) if snapshots else {}
+        known_images = self.__stat_index(previous.get(ManifestSchema.images, []))
+        known_nodes = self.__stat_index(previous.get(ManifestSchema.nodes, []))
+
+        images = self.__snapshot_files(
+            self.output_folder,
+            self.__image_files(),
+            known_images,
+            OBJECTS_DIR,
+            link=True,
+        )
+        nodes = self.__snapshot_files(
+            self.db_path, self.__node_files(), known_nodes, NODES_DIR, link=False
+        )
+
+        name = datetime.now().strftime(SNAPSHOT_NAME_FORMAT)
+        suffix_idx = 0
+        while name in snapshots:
+            suffix_idx += 1
+            name = f"{datetime.now().strftime(SNAPSHOT_NAME_FORMAT)}_{suffix_idx}"
+        manifest = {
+            ManifestSchema.created: datetime.now().isoformat(timespec="seconds"),
+            ManifestSchema.images: images,
+            ManifestSchema.nodes: nodes,
+        }
+        manifest_path = self.__manifest_path(name)
+        os.makedirs(os.path.dirname(manifest_path), exist_ok=True)
+        with open(manifest_path, "w", encoding=DEFAULT_ENCODING) as fstream:
+            json.dump(manifest, fstream)
+        Logger.info(
+            f"Took snapshot {name} of {len(images)} images and {len(nodes)} nodes"
+        )
+        return name
+
+    def restore(self, name: str) -> str:
+        """Rebuild outputs as it was in the snapshot. Current outputs are renamed
+        aside, except for the content store, which is moved into the new tree.
+        Returns the path current outputs were renamed to."""
+        manifest = self.__read_manifest(name)
+        aside_path = f"{os.path.normpath(self.output_folder)}.before-{name}"
+        if os.path.exists(self.output_folder):
+            os.rename(self.output_folder, aside_path)
+        OutputTreeRegistry.forget(self.output_folder)
+
+        for entry in manifest[ManifestSchema.images]:
+            path = os.path.join(self.output_folder, entry[ManifestSchema.path])
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            self.__link(self.__object_path(OBJECTS_DIR, entry), path)
+        for entry in manifest[ManifestSchema.nodes]:
+            path = os.path.join(self.db_path, entry[ManifestSchema.path])
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            shutil.copyfile(self.__object_path(NODES_DIR, entry), path)
+
+        aside_store = os.path.join(aside_path, DEFAULT_STORE_DIR)
+        if os.path.isdir(aside_store):
+            os.rename(aside_store, os.path.join(self.output_folder, DEFAULT_STORE_DIR))
+        Logger.info(f"Restored snapshot {name}, previous outputs are in {aside_path}")
+        return aside_path
+
+    def collect_garbage(self) -> int:
+        """Remove stored files that no snapshot lists, e.g. after manifests
+        were deleted. Returns the amount of removed files."""
+        referenced: set[str] = set()
+        for name in self.names():
+            manifest = self.__read_manifest(name)
+            for key, folder in (
+                (ManifestSchema.images, OBJECTS_DIR),
+                (ManifestSchema.nodes, NODES_DIR),
+            ):
+                referenced.update(
+                    os.path.normpath(self.__object_path(folder, entry))
+                    for entry in manifest[key]
+                )
+
+        removed = 0
+        for folder in (OBJECTS_DIR, NODES_DIR):
+            for root, _, files in os.walk(os.path.join(self.root, folder)):
+                for file in files:
+                    path = os.path.normpath(os.path.join(root, file))
+                    if path not in referenced:
+                        os.remove(path)
+                        removed += 1
+        Logger.info(f"Removed {removed} unreferenced snapshot files")
+        return removed
+
+    def __snapshot_files(
+        self,
+        tree_root: str,
+        paths: list[str],
+        known: dict[StatKey, ContentHash],
+        folder: str,
+        link: bool,
+    ) -> list[ManifestEntry]:
+        """Manifest entries of the files, storing files that are not stored yet."""
+        entries: list[ManifestEntry] = []
+        for path in paths:
+            stat = os.stat(path)
+            file_hash = known.get((stat.st_ino, stat.st_size, stat.st_mtime_ns))
+            entry = {
+                ManifestSchema.path: os.path.relpath(path, tree_root),
+                ManifestSchema.content_hash: file_hash or content_hash(path),
+                ManifestSchema.inode: stat.st_ino,
+                ManifestSchema.size: stat.st_size,
+                ManifestSchema.modified: stat.st_mtime_ns,
+            }
+            object_path = self.__object_path(folder, entry)
+            if file_hash is None and not os.path.isfile(object_path):
+                os.makedirs(os.path.dirname(object_path), exist_ok=True)
+                if link:
+                    self.__link(path, object_path)
+                else:
+                    shutil.copyfile(path, object_path)
+            entries.append(entry)
+        return entries
+
+    def __image_files(self) -> list[str]:
+        """Image files of the category tree, without the databank and the store."""
+        paths: list[str] = []
+        for root, dirs, files in os.walk(self.output_folder):
+            if root == self.output_folder:
+                dirs[:] = [dir for dir in dirs if dir not in OUTPUT_SERVICE_DIRS]
+            images = filter_files(files, IMAGE_FILE_FORMATS)
+            paths.extend(os.path.join(root, file) for file in images)
+        return paths
+
+    def __node_files(self) -> list[str]:
+        return [
+            os.path.join(root, file)
+            for root, _, files in os.walk(self.db_path)
+            for file in filter_files(files, "json")
+        ]
+
+    def __object_path(self, folder: str, entry: ManifestEntry) -> str:
+        file_hash = entry[ManifestSchema.content_hash]
+        extension = os.path.splitext(entry[ManifestSchema.path])[1]
+        return os.path.join(self.root, folder, file_hash[:2], f"{file_hash}{extension}")
+
+    def __manifest_path(self, name: str) -> str:
+        return os.path.join(self.root, MANIFESTS_DIR, f"{name}.json")
+
+    def __read_manifest(self, name: str) -> dict:
+        manifest_path = self.__manifest_path(name)
+        with open(manifest_path, "r", encoding=DEFAULT_ENCODING) as fstream:
+            return json.load(fstream)
+
+    @staticmethod
+    def __stat_index(entries: list[ManifestEntry]) -> dict[StatKey, ContentHash]:
+        return {
+            (
+                entry[ManifestSchema.inode],
+                entry[ManifestSchema.size],
+                entry[ManifestSchema.modified],
+            ): entry[ManifestSchema.content_hash]
+            for entry in entries
+        }
+
+    @staticmethod
+    def __link(path: str, link_path: str) -> None:
+        """Hard link the file, copying it if hard links are not possible."""
+        try:
+            os.link(path, link_path)
+        except OSError:
+            shutil.copy2(path, link_path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Take, list and restore snapshots of outputs and the databank."
+    )
+    parser.add_argument(
+        "action", choices=[TAKE_ACTION, LIST_ACTION, RESTORE_ACTION, GC_ACTION]
+    )
+    parser.add_argument("name", nargs="?", help="snapshot to restore")
+    args = parser.parse_args()
+
+    snapshot_store = SnapshotStore()
+    if args.action == TAKE_ACTION:
+        print(snapshot_store.take())
+    elif args.action == LIST_ACTION:
+        print("\n".join(snapshot_store.names()))
+    elif args.action == RESTORE_ACTION:
+        if args.name is None:
+            parser.error("Snapshot name is required to restore")
+        print(f"Previous outputs moved to {snapshot_store.restore(args.name)}")
+    else:
+        snapshot_store.collect_garbage()
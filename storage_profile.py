@@ -0,0 +1,84 @@
+DEFAULT_PROFILE_KEY = "default"
+"""Key of the profile used for images without a category with its own profile."""
+LOSSLESS_FORMATS = ["png"]
+"""Formats that ignore quality."""
+ALPHA_FORMATS = ["png", "webp"]
+"""Formats that can keep transparency."""
+STORAGE_FORMATS = ["jpeg", "png", "webp"]
+"""Formats images can be stored in, named as Pillow names them in lowercase."""
+FORMAT_ALIASES = {"jpg": "jpeg"}
+"""Usual names of storage formats that Pillow doesn't know."""
+
+
+def normalize_format(file_format: str) -> str:
+    """Storage format name as Pillow knows it. Raises ValueError for formats
+    images can't be stored in."""
+    name = file_format.lower()
+    name = FORMAT_ALIASES.get(name, name)
+    if name not in STORAGE_FORMATS:
+        raise ValueError(
+            f"Storage format must be one of {STORAGE_FORMATS}, not '{file_format}'"
+        )
+    return name
+
+
+class StorageProfile:
+    """How images are encoded when they are stored in the outputs tree."""
+
+    file_format_key = "Format"
+    quality_key = "Quality"
+    max_size_key = "MaxSize"
+    keep_metadata_key = "KeepMetadata"
+
+    def __init__(
+        self, file_format: str, quality: int, max_size: int, keep_metadata: bool = False
+    ) -> None:
+        """Initialize the object with all attributes, the format is validated."""
+        self.file_format = normalize_format(file_format)
+        self.quality = quality
+        self.max_size = max_size
+        self.keep_metadata = keep_metadata
+
+    @classmethod
+    def from_json(cls, profile_json: dict, default: "StorageProfile") -> "StorageProfile":
+        """Read a profile from the schema, missing values are taken from default."""
+        return cls(
+            file_format=profile_json.get(cls.file_format_key, default.file_format),
+            quality=profile_json.get(cls.quality_key, default.quality),
+            max_size=profile_json.get(cls.max_size_key, default.max_size),
+            keep_metadata=profile_json.get(cls.keep_metadata_key, default.keep_metadata),
+        )
+
+    @property
+    def allowed_modes(self) -> list[str]:
+        """Image modes that can be stored in the profile format as they are."""
+        if self.file_format in ALPHA_FORMATS:
+            return ["RGB", "RGBA", "L"]
+        return ["RGB", "L"]
+
+    def save_options(self, image_info: dict) -> dict:
+        """Pillow save keyword arguments for the profile. Image info provides
+        EXIF and color profile data to keep."""
+        options = {}
+        if self.file_format not in LOSSLESS_FORMATS:
+            options["quality"] = self.quality
+        if self.keep_metadata:
+            for key in ("exif", "icc_profile"):
+                if image_info.get(key):
+                    options[key] = image_info[key]
+        return options
+
+
+type StorageProfiles = dict[str, StorageProfile]
+"""Storage profiles by category name, with a profile under the default key."""
+
+
+def profile_for(
+    categories: list[str], profiles: StorageProfiles, default: StorageProfile
+) -> StorageProfile:
+    """Profile of the highest priority category that has one, or the default one.
+    Categories are expected to be sorted as per the schema."""
+    for category in categories:
+        if category in profiles:
+            return profiles[category]
+    return profiles.get(DEFAULT_PROFILE_KEY, default)
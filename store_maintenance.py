@@ -0,0 +1,83 @@
+import argparse
+import os
+
+from kivy.logger import Logger
+
+from content_store import ContentHash, ContentStore
+from databank import JSONDataBank
+from file_utils import DEFAULT_DB_PATH
+from image_nodes import EvaluatedPic, ImageNodesHolder
+
+ADOPT_ACTION = "adopt"
+RELINK_ACTION = "relink"
+GC_ACTION = "gc"
+
+
+def referenced_hashes(nodes_holder: ImageNodesHolder) -> set[ContentHash]:
+    """Hashes of the stored files that the databank images point at."""
+    return {
+        pic.content_hash
+        for pic in nodes_holder.list_images()
+        if pic.content_hash is not None
+    }
+
+
+def adopt_all(nodes_holder: ImageNodesHolder, store: ContentStore) -> int:
+    """Move images that are still plain files into the store.
+    Returns the amount of adopted images."""
+    EvaluatedPic.content_store = store
+    adopted = 0
+    for pic in nodes_holder.list_images():
+        if not pic.content_stored and os.path.isfile(pic.storage_path):
+            pic.store_content()
+            adopted += 1
+    Logger.info(f"Moved {adopted} images into the content store")
+    return adopted
+
+
+def relink(nodes_holder: ImageNodesHolder, store: ContentStore) -> int:
+    """Recreate missing links of the outputs tree from the store, e.g. after
+    the category folders were removed or the outputs folder was moved.
+    Returns the amount of recreated links."""
+    relinked = 0
+    for pic in nodes_holder.list_images():
+        if pic.content_hash is None or os.path.isfile(pic.storage_path):
+            continue
+        file_format = os.path.splitext(pic.storage_path)[1].lstrip(".")
+        if not store.contains(pic.content_hash, file_format):
+            Logger.warning(f"Stored file of {pic.storage_path} is missing")
+            continue
+        if os.path.islink(pic.storage_path):
+            os.remove(pic.storage_path)
+        os.makedirs(os.path.dirname(pic.storage_path), exist_ok=True)
+        store.link(pic.content_hash, pic.storage_path)
+        relinked += 1
+    Logger.info(f"Recreated {relinked} links to stored images")
+    return relinked
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Maintain the content store of the outputs tree."
+    )
+    parser.add_argument(
+        "action",
+        choices=[ADOPT_ACTION, RELINK_ACTION, GC_ACTION],
+        help=(
+            "adopt - move plain image files into the store, "
+            "relink - recreate missing links, "
+            "gc - remove stored files no image references"
+        ),
+    )
+    args = parser.parse_args()
+
+    holder = JSONDataBank.read(DEFAULT_DB_PATH)
+    content_store = ContentStore()
+    if args.action == ADOPT_ACTION:
+        adopt_all(holder, content_store)
+        JSONDataBank.save(holder, append=False)
+    elif args.action == RELINK_ACTION:
+        relink(holder, content_store)
+    else:
+        freed = content_store.collect_garbage(referenced_hashes(holder))
+        print(f"Freed {freed / 2**20:.1f} MiB")
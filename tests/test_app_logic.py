@@ -0,0 +1,108 @@
+""" This module has unit-tests for the sliding window of app_logic module:
+window bounds, images kept or released when the window slides and reordering
+of the session images.
+"""
+import os
+import shutil
+import sys
+import tempfile
+from pathlib import Path
+from unittest import TestCase, main
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+from app_logic import OnScreenImageHandler, window_indices
+from session import SIMILARITY_ORDER
+
+TEST_PIC_PATH = "./tests/test_assets/1.jpg"
+SESSION_SIZE = 20
+
+
+class TestWindowIndices(TestCase):
+    def test_middle(self):
+        self.assertEqual(window_indices(10, 100, 2), {8, 9, 10, 11, 12})
+
+    def test_wraps_around(self):
+        self.assertEqual(window_indices(0, 100, 2), {98, 99, 0, 1, 2})
+        self.assertEqual(window_indices(99, 100, 2), {97, 98, 99, 0, 1})
+
+    def test_small_session(self):
+        self.assertEqual(window_indices(1, 3, 5), {0, 1, 2})
+
+
+class TestSlidingWindow(TestCase):
+    def setUp(self) -> None:
+        self.input_path = tempfile.mkdtemp()
+        for idx in range(SESSION_SIZE):
+            shutil.copy(TEST_PIC_PATH, f"{self.input_path}/{idx:02}.jpg")
+        self.handler = OnScreenImageHandler(self.input_path, deferred=True)
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.input_path)
+
+    def slide_away_and_back(self) -> None:
+        for _ in range(SESSION_SIZE // 2):
+            self.handler.next()
+        self.handler.jump_to(0)
+
+    def test_saved_edits_survive_slide(self):
+        pic = self.handler.current
+        pic.evaluate("eval1", 3)
+        self.handler.save_current(tags="sky")
+        self.slide_away_and_back()
+        self.assertIs(self.handler.current, pic)
+        self.assertEqual(self.handler.current.evals, {"eval1": 3})
+        self.assertEqual(self.handler.current.tags, "sky")
+
+    def test_unsaved_pics_released(self):
+        pic = self.handler.current
+        self.slide_away_and_back()
+        self.assertIsNot(self.handler.current, pic)
+        self.assertEqual(self.handler.current.storage_path, pic.storage_path)
+
+    def test_missing_file_not_saved(self):
+        pic = self.handler.current
+        os.remove(pic.storage_path)
+        self.assertTrue(self.handler.current_missing)
+        pic.evaluate("eval1", 3)
+        self.handler.save_current(tags="")
+        self.assertIsNone(pic.node_ref)
+        self.assertEqual(self.handler.plan_moves().preview(), [])
+
+    def test_jump_to_unevaluated_wraps_around(self):
+        for idx in range(SESSION_SIZE - 5, SESSION_SIZE):
+            self.handler.jump_to(idx)
+            self.handler.current.evaluate("eval1", 1)
+            self.handler.save_current(tags="")
+        self.handler.jump_to(SESSION_SIZE - 5)
+        self.handler.jump_to_unevaluated()
+        self.assertEqual(int(self.handler.cursor), 0)
+
+    def test_similarity_session_order(self):
+        reversed_paths = self.handler.paths[::-1]
+        self.handler.open_similarity_session(reversed_paths)
+        self.assertEqual(self.handler.order, SIMILARITY_ORDER)
+        self.assertEqual(self.handler.paths, reversed_paths)
+
+    def test_apply_order_keeps_current_image(self):
+        pic = self.handler.current
+        pic.evaluate("eval1", 2)
+        reversed_paths = self.handler.paths[::-1]
+        self.handler.apply_order(reversed_paths)
+
+        self.assertEqual(self.handler.paths, reversed_paths)
+        self.assertEqual(self.handler.current.storage_path, reversed_paths[0])
+        self.handler.jump_to(SESSION_SIZE - 1)
+        self.assertIs(self.handler.current, pic)
+        self.assertEqual(self.handler.current.evals, {"eval1": 2})
+
+    def test_partial_order(self):
+        paths = self.handler.paths
+        self.handler.apply_order([paths[5], paths[3]])
+        self.assertEqual(
+            self.handler.paths, [paths[5], paths[3]] + paths[:3] + paths[4:5] + paths[6:]
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+""" This module has unit-tests for comparison_sort module. Judgements are
+simulated with a hidden preference order, so the tests check both the resulting
+ranking and the amount of judgements it took.
+"""
+import math
+import random
+import sys
+from pathlib import Path
+from unittest import TestCase, main
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+from comparison_sort import ComparisonSort, bin_marks
+from image_nodes import EvaluatedPic
+
+
+class TestComparisonSort(TestCase):
+    def setUp(self) -> None:
+        self.pics = [EvaluatedPic(f"inputs/{idx}.jpg") for idx in range(50)]
+        self.preference = {pic: random.random() for pic in self.pics}
+
+    def rank(self, sorter: ComparisonSort) -> None:
+        while not sorter.finished:
+            candidate, ranked = sorter.current_pair
+            sorter.judge(self.preference[candidate] > self.preference[ranked])
+
+    def test_ranking_follows_judgements(self):
+        sorter = ComparisonSort(self.pics)
+        self.rank(sorter)
+        expected = sorted(self.pics, key=self.preference.get, reverse=True)
+        self.assertEqual(sorter.ranking, expected)
+
+    def test_judgements_are_n_log_n(self):
+        sorter = ComparisonSort(self.pics)
+        self.rank(sorter)
+        limit = sum(math.ceil(math.log2(k + 1)) for k in range(1, len(self.pics)))
+        self.assertLessEqual(sorter.judgements, limit)
+
+    def test_empty_and_single(self):
+        self.assertTrue(ComparisonSort([]).finished)
+        sorter = ComparisonSort(self.pics[:1])
+        self.assertTrue(sorter.finished)
+        self.assertIsNone(sorter.current_pair)
+
+    def test_judge_after_finish(self):
+        sorter = ComparisonSort(self.pics[:1])
+        with self.assertRaises(ValueError):
+            sorter.judge(True)
+
+    def test_apply_marks(self):
+        sorter = ComparisonSort(self.pics[:4])
+        self.rank(sorter)
+        ranking = sorter.apply_marks("cat1", 2, ("cat1", "cat2"))
+        self.assertEqual([pic.evals["cat1"] for pic in ranking], [2, 2, 1, 1])
+        self.assertTrue(all(pic.categories == ["cat1"] for pic in ranking))
+
+    def test_apply_marks_eval(self):
+        sorter = ComparisonSort(self.pics[:3])
+        self.rank(sorter)
+        ranking = sorter.apply_marks("eval1", 5, ("cat1",))
+        self.assertEqual([pic.evals["eval1"] for pic in ranking], [5, 4, 2])
+        self.assertTrue(all(pic.categories == [] for pic in ranking))
+
+
+class TestBinMarks(TestCase):
+    def test_bins(self):
+        self.assertEqual(bin_marks(6, 3), [3, 3, 2, 2, 1, 1])
+        self.assertEqual(bin_marks(2, 5), [5, 3])
+        self.assertEqual(bin_marks(0, 5), [])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+""" This module has unit-tests for content_store module, using a real
+temporary folder since links are the whole point of the store.
+"""
+import os
+import shutil
+import sys
+import tempfile
+from pathlib import Path
+from unittest import TestCase, main
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+from content_store import ContentStore, content_hash
+
+TEST_PIC_PATH = "./tests/test_assets/1.jpg"
+
+
+class TestContentStore(TestCase):
+    def setUp(self) -> None:
+        self.root = tempfile.mkdtemp()
+        self.store = ContentStore(os.path.join(self.root, "store"))
+        self.first_path = os.path.join(self.root, "1.jpg")
+        self.second_path = os.path.join(self.root, "2.jpg")
+        shutil.copy(TEST_PIC_PATH, self.first_path)
+        shutil.copy(TEST_PIC_PATH, self.second_path)
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.root)
+
+    def test_same_contents_stored_once(self):
+        first_hash = self.store.adopt(self.first_path)
+        second_hash = self.store.adopt(self.second_path)
+        self.assertEqual(first_hash, second_hash)
+        self.assertEqual(first_hash, content_hash(TEST_PIC_PATH))
+        self.assertEqual(len(os.listdir(os.path.dirname(
+            self.store.blob_path(first_hash, "jpg")
+        ))), 1)
+        self.assertTrue(os.path.isfile(self.first_path))
+        self.assertTrue(os.path.isfile(self.second_path))
+
+    def test_failed_link_keeps_files(self):
+        first_hash = self.store.adopt(self.first_path)
+        blob = self.store.blob_path(first_hash, "jpg")
+
+        def fail_link(*args):
+            raise PermissionError("no links here")
+
+        link, symlink = os.link, os.symlink
+        os.link = os.symlink = fail_link
+        try:
+            with self.assertRaises(OSError):
+                self.store.adopt(self.second_path)
+        finally:
+            os.link, os.symlink = link, symlink
+        self.assertTrue(os.path.isfile(blob))
+        self.assertTrue(os.path.isfile(self.first_path))
+        self.assertEqual(content_hash(self.second_path), first_hash)
+        self.assertFalse(os.path.exists(f"{self.second_path}.tmp"))
+
+    def test_garbage_collected(self):
+        file_hash = self.store.adopt(self.first_path)
+        self.assertEqual(self.store.collect_garbage({file_hash}), 0)
+        self.assertGreater(self.store.collect_garbage(set()), 0)
+        self.assertFalse(self.store.contains(file_hash, "jpg"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+""" This module has unit-tests for eval_schema module: checkboxes showing the
+marks of the current image and marks typed with hotkeys.
+"""
+import json
+import os
+import shutil
+import sys
+import tempfile
+from pathlib import Path
+from unittest import TestCase, main
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+from eval_schema import EvaluationSchema, LabeledCheckBox
+
+SCHEMA = {"Categories": {"cat1": 2}, "Evals": {"eval1": 3}}
+
+
+class TestEvaluationSchema(TestCase):
+    def setUp(self) -> None:
+        self.root = tempfile.mkdtemp()
+        schema_path = os.path.join(self.root, "schema.json")
+        with open(schema_path, "w", encoding="utf-8") as fstream:
+            json.dump(SCHEMA, fstream)
+        self.schema = EvaluationSchema(schema_path)
+        for category, eval_range in self.schema.eval_range_for_categories.items():
+            for mark in range(1, eval_range + 1):
+                check = LabeledCheckBox(group=category, active=False, label=mark)
+                self.schema.assign_checks(category, mark, check)
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.root)
+
+    def active_marks(self, category: str) -> list[int]:
+        checks = self.schema.get_checks(category)
+        return [mark for mark, check in checks.items() if check.active]
+
+    def test_show_mark(self):
+        self.schema.show_mark("eval1", 2)
+        self.assertEqual(self.active_marks("eval1"), [2])
+        self.schema.show_mark("eval1", 3)
+        self.assertEqual(self.active_marks("eval1"), [3])
+        self.schema.show_mark("eval1", None)
+        self.assertEqual(self.active_marks("eval1"), [])
+
+    def test_reload_evaluations(self):
+        self.schema.reload_evaluations({"cat1": 1, "eval1": 3})
+        self.assertEqual(self.active_marks("cat1"), [1])
+        self.assertEqual(self.active_marks("eval1"), [3])
+        self.schema.reset_current_evals()
+        self.assertEqual(self.active_marks("cat1"), [])
+        self.assertEqual(self.active_marks("eval1"), [])
+
+    def test_restore_checks_after_click(self):
+        self.schema.show_mark("eval1", 1)
+        self.schema.get_checks("eval1")[1].active = False
+        self.schema.get_checks("eval1")[3].active = True
+        self.schema.restore_checks("eval1")
+        self.assertEqual(self.active_marks("eval1"), [1])
+
+        self.schema.show_mark("cat1", None)
+        self.schema.get_checks("cat1")[2].active = True
+        self.schema.restore_checks("cat1")
+        self.assertEqual(self.active_marks("cat1"), [])
+
+    def test_hotkeys(self):
+        self.assertEqual(self.schema.category_hotkeys, {"a": "cat1", "b": "eval1"})
+        self.assertEqual(self.schema.next_category("cat1"), "eval1")
+        self.assertEqual(self.schema.next_category("eval1"), "cat1")
+
+    def test_hotkey_mark(self):
+        self.assertEqual(self.schema.hotkey_mark("eval1", 3), 3)
+        self.assertIsNone(self.schema.hotkey_mark("eval1", 0))
+        with self.assertRaises(ValueError):
+            self.schema.hotkey_mark("cat1", 3)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+""" This module has unit-tests for export module: selection of images,
+the exporter and the export destinations.
+"""
+import json
+import os
+import shutil
+import sys
+import tarfile
+import tempfile
+import zipfile
+from pathlib import Path
+from unittest import TestCase, main
+
+from PIL import Image
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+from export import (DatasetExporter, ExportSink, matches, parse_selection,
+                    select_pics)
+from image_nodes import EvaluatedPic, ImageNodesHolder, ImageStorageNode
+
+
+class TestSelection(TestCase):
+    def setUp(self) -> None:
+        self.pics = [
+            EvaluatedPic("a.jpg", ["Anatomy"], {"Anatomy": 4, "Color": 2}),
+            EvaluatedPic("b.jpg", ["Anatomy"], {"Anatomy": 5}),
+            EvaluatedPic("c.jpg", [], {"Color": 5}),
+        ]
+        self.holder = ImageNodesHolder(
+            {
+                ("Anatomy",): [ImageStorageNode(name="4_a", evaluated_pics=self.pics[:1])],
+                ("Anatomy2",): [ImageStorageNode(name="5_a", evaluated_pics=self.pics[1:2])],
+                ("uncategorized",): [ImageStorageNode(name="a", evaluated_pics=self.pics[2:])],
+            }
+        )
+
+    def test_parse(self):
+        self.assertEqual(
+            parse_selection("Anatomy>=4, Color < 3"),
+            [("Anatomy", ">=", 4), ("Color", "<", 3)],
+        )
+        self.assertEqual(parse_selection(""), [])
+
+    def test_parse_error(self):
+        with self.assertRaises(ValueError):
+            parse_selection("Anatomy~4")
+
+    def test_missing_eval_not_matched(self):
+        self.assertFalse(matches(self.pics[1], parse_selection("Color<3")))
+
+    def test_select(self):
+        selected = list(select_pics(self.holder, parse_selection("Anatomy>=4")))
+        self.assertEqual(selected, self.pics[:2])
+        selected = list(select_pics(self.holder, parse_selection("Anatomy=4,Color=2")))
+        self.assertEqual(selected, self.pics[:1])
+
+
+class TestExportSink(TestCase):
+    def setUp(self) -> None:
+        self.root = tempfile.mkdtemp()
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.root)
+
+    def fill(self, output_path: str) -> None:
+        text_path = os.path.join(self.root, "notes.txt")
+        with open(text_path, "wb") as fstream:
+            fstream.write(b"notes")
+        sink = ExportSink(output_path)
+        sink.add("cat1/a.jpeg", b"image")
+        sink.add_file("notes.txt", text_path)
+        sink.close()
+
+    def test_directory(self):
+        output_path = os.path.join(self.root, "export")
+        self.fill(output_path)
+        with open(os.path.join(output_path, "cat1", "a.jpeg"), "rb") as fstream:
+            self.assertEqual(fstream.read(), b"image")
+        self.assertTrue(os.path.isfile(os.path.join(output_path, "notes.txt")))
+
+    def test_zip(self):
+        output_path = os.path.join(self.root, "export.zip")
+        self.fill(output_path)
+        with zipfile.ZipFile(output_path) as archive:
+            self.assertEqual(archive.read("cat1/a.jpeg"), b"image")
+            self.assertEqual(archive.read("notes.txt"), b"notes")
+
+    def test_tar(self):
+        output_path = os.path.join(self.root, "export.tar.gz")
+        self.fill(output_path)
+        with tarfile.open(output_path) as archive:
+            self.assertEqual(archive.extractfile("cat1/a.jpeg").read(), b"image")
+            self.assertEqual(archive.extractfile("notes.txt").read(), b"notes")
+
+
+class TestDatasetExporter(TestCase):
+    def setUp(self) -> None:
+        self.root = tempfile.mkdtemp()
+        self.pics = []
+        for folder in ("first", "second"):
+            os.makedirs(os.path.join(self.root, folder))
+            path = os.path.join(self.root, folder, "a.png")
+            Image.new("RGB", (400, 200), (200, 10, 10)).save(path)
+            self.pics.append(EvaluatedPic(path, ["Anatomy"], {"Anatomy": 4}, "sky"))
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.root)
+
+    def test_export(self):
+        output_path = os.path.join(self.root, "export.zip")
+        exporter = DatasetExporter(100, "jpg", workers=1)
+        self.assertEqual(exporter.export(iter(self.pics), output_path), 2)
+
+        with zipfile.ZipFile(output_path) as archive:
+            names = sorted(archive.namelist())
+            self.assertEqual(names, ["a.jpeg", "a_1.jpeg", "metadata.jsonl"])
+            with archive.open("a.jpeg") as fstream, Image.open(fstream) as img:
+                self.assertEqual(img.format, "JPEG")
+                self.assertEqual(img.size, (100, 50))
+            records = [
+                json.loads(line)
+                for line in archive.read("metadata.jsonl").decode().splitlines()
+            ]
+        self.assertEqual(
+            [(record["File"], record["Path"]) for record in records],
+            [
+                ("a.jpeg", self.pics[0].storage_path),
+                ("a_1.jpeg", self.pics[1].storage_path),
+            ],
+        )
+        self.assertEqual(records[0]["Evals"], {"Anatomy": 4})
+
+    def test_unreadable_image_skipped(self):
+        os.remove(self.pics[0].storage_path)
+        output_path = os.path.join(self.root, "export")
+        exporter = DatasetExporter(100, metadata_format="csv", workers=1)
+        self.assertEqual(exporter.export(iter(self.pics), output_path), 1)
+        self.assertEqual(sorted(os.listdir(output_path)), ["a.jpeg", "metadata.csv"])
+
+    def test_damaged_images_skipped(self):
+        # Truncated header and broken chunk, Pillow doesn't raise OSError for these
+        for pic, offset in zip(self.pics, (11, 35)):
+            with open(pic.storage_path, "r+b") as image_file:
+                image_file.seek(offset)
+                image_file.write(b"\x00")
+        output_path = os.path.join(self.root, "export.zip")
+        exporter = DatasetExporter(100, workers=1)
+        self.assertEqual(exporter.export(iter(self.pics), output_path), 0)
+        with zipfile.ZipFile(output_path) as archive:
+            self.assertEqual(archive.namelist(), ["metadata.jsonl"])
+
+    def test_unknown_format(self):
+        with self.assertRaises(ValueError):
+            DatasetExporter(100, "gif")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+""" This module has unit-tests for image_metadata module: reading headers,
+detecting outdated metadata, re-encode decisions and the databank round trip.
+"""
+import os
+import shutil
+import sys
+import tempfile
+from pathlib import Path
+from unittest import TestCase, main
+
+from PIL import Image
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+from databank import JSONDataBank
+from file_utils import needs_reencode
+from image_metadata import ImageMetadata, read_metadata, refresh_metadata
+from image_nodes import EvaluatedPic
+from output_registry import OutputTreeRegistry
+from storage_profile import StorageProfile
+
+TEST_PIC_PATH = "./tests/test_assets/1.jpg"
+JPEG_PROFILE = StorageProfile("jpeg", 75, 200)
+
+
+class TestImageMetadata(TestCase):
+    def setUp(self) -> None:
+        self.root = tempfile.mkdtemp()
+        self.path = os.path.join(self.root, "1.jpg")
+        shutil.copy(TEST_PIC_PATH, self.path)
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.root)
+
+    def test_read(self):
+        metadata = ImageMetadata.read(self.path)
+        self.assertEqual(metadata.size, (300, 300))
+        self.assertEqual(metadata.file_format, "jpeg")
+        self.assertEqual(metadata.color_mode, "RGB")
+        self.assertEqual(metadata.file_size, os.path.getsize(self.path))
+        self.assertTrue(metadata.matches_file(self.path))
+
+    def test_display_size(self):
+        metadata = ImageMetadata(400, 300, "jpeg", "RGB", orientation=6)
+        self.assertEqual(metadata.display_size, (300, 400))
+        self.assertTrue(metadata.exceeds(350))
+        self.assertFalse(metadata.exceeds(400))
+
+    def test_changed_file(self):
+        metadata = ImageMetadata.read(self.path)
+        Image.new("RGB", (10, 20)).save(self.path, "png")
+        self.assertFalse(metadata.matches_file(self.path))
+        os.remove(self.path)
+        self.assertFalse(metadata.matches_file(self.path))
+
+    def test_read_unreadable(self):
+        text_path = os.path.join(self.root, "notes.jpg")
+        with open(text_path, "w") as file:
+            file.write("not an image")
+        self.assertEqual(read_metadata([text_path]), {text_path: None})
+
+    def test_refresh(self):
+        unchanged_path = os.path.join(self.root, "2.jpg")
+        shutil.copy(TEST_PIC_PATH, unchanged_path)
+        new_path = os.path.join(self.root, "3.jpg")
+        shutil.copy(TEST_PIC_PATH, new_path)
+        known = {
+            self.path: ImageMetadata.read(self.path),
+            unchanged_path: ImageMetadata.read(unchanged_path),
+            new_path: None,
+        }
+        Image.new("RGB", (10, 20)).save(self.path, "png")
+
+        refreshed = refresh_metadata(known)
+        self.assertEqual(set(refreshed), {self.path, new_path})
+        self.assertEqual(refreshed[self.path].size, (10, 20))
+        self.assertEqual(refreshed[self.path].file_format, "png")
+        self.assertEqual(refreshed[new_path].size, (300, 300))
+
+    def test_databank_round_trip(self):
+        metadata = ImageMetadata.read(self.path)
+        saved = JSONDataBank.read_metadata(JSONDataBank.metadata_json(metadata))
+        self.assertEqual(vars(saved), vars(metadata))
+        self.assertTrue(saved.matches_file(self.path))
+        self.assertIsNone(JSONDataBank.read_metadata({}))
+
+
+class TestNeedsReencode(TestCase):
+    def test_same_format(self):
+        metadata = ImageMetadata(100, 100, "jpeg", "RGB")
+        self.assertFalse(needs_reencode(metadata, False, JPEG_PROFILE))
+        self.assertFalse(needs_reencode(metadata, True, JPEG_PROFILE))
+
+    def test_downsize(self):
+        metadata = ImageMetadata(300, 100, "jpeg", "RGB")
+        self.assertTrue(needs_reencode(metadata, True, JPEG_PROFILE))
+        self.assertFalse(needs_reencode(metadata, False, JPEG_PROFILE))
+
+    def test_other_format(self):
+        self.assertTrue(
+            needs_reencode(ImageMetadata(100, 100, "png", "RGB"), False, JPEG_PROFILE)
+        )
+
+    def test_mode_not_supported(self):
+        metadata = ImageMetadata(100, 100, "webp", "RGBA")
+        self.assertTrue(needs_reencode(metadata, False, JPEG_PROFILE))
+        self.assertFalse(
+            needs_reencode(metadata, False, StorageProfile("webp", 75, 200))
+        )
+
+
+class TestTransferMetadata(TestCase):
+    def setUp(self) -> None:
+        self.root = tempfile.mkdtemp()
+        self.output_folder = os.path.join(self.root, "outputs")
+        self.default_output_folder = EvaluatedPic.output_folder
+        EvaluatedPic.output_folder = self.output_folder
+        self.path = os.path.join(self.root, "1.jpeg")
+        shutil.copy(TEST_PIC_PATH, self.path)
+
+    def tearDown(self) -> None:
+        EvaluatedPic.output_folder = self.default_output_folder
+        OutputTreeRegistry.forget(self.output_folder)
+        shutil.rmtree(self.root)
+
+    def test_changed_file_is_reencoded(self):
+        pic = EvaluatedPic(self.path)
+        pic.metadata = ImageMetadata.read(self.path)
+        Image.new("RGBA", (30, 20)).save(self.path, "png")
+
+        pic.transfer(os.path.join(self.output_folder, "1.jpeg"))
+        self.assertEqual(pic.metadata.size, (30, 20))
+        self.assertEqual(pic.metadata.file_format, "jpeg")
+        self.assertTrue(pic.metadata.matches_file(pic.storage_path))
+        with Image.open(pic.storage_path) as img:
+            self.assertEqual(img.format, "JPEG")
+
+
+if __name__ == "__main__":
+    main()
@@ -19,6 +19,7 @@ sys.path.append(str(Path(__file__).resolve().parent.parent))
 
 from file_utils import MAX_SIZE
 from image_nodes import MAX_ITEMS_PER_NODE, EvaluatedPic, ImageStorageNode
+from output_registry import OutputTreeRegistry
 
 TEST_PIC_PATH = "./tests/test_assets/1.jpg"
 
@@ -78,11 +79,29 @@ class TestAddImageNarrow(TestCase):
         self.assertTrue(self.isn.add_image(self.epic))
         self.assertTrue(self.isn3.image_popped)
 
+    def test_deferred_not_processed(self):
+        self.epic.node_ref = self.isn3
+        self.assertTrue(self.isn.add_image(self.epic, defer=True))
+        self.assertFalse(self.epic.physical_processed)
+        self.assertEqual(self.epic.node_ref, self.isn)
+
     def test_node_images_appended(self):
         self.epic.node_ref = self.isn3
         before_adding = len(self.isn.images)
         self.assertTrue(self.isn.add_image(self.epic))
         self.assertEqual(len(self.isn.images), before_adding + 1)
+
+    def test_failed_move_keeps_node(self):
+        def fail_move(*args, **kwargs):
+            raise FileNotFoundError("test/path")
+
+        self.epic.node_ref = self.isn3
+        self.epic.physical_process = fail_move
+        with self.assertRaises(FileNotFoundError):
+            self.isn.add_image(self.epic)
+        self.assertEqual(self.epic.node_ref, self.isn3)
+        self.assertFalse(self.isn3.image_popped)
+        self.assertEqual(self.isn.images, [])
   
 
 class TestAddImageWideReal(TestCase):
@@ -117,6 +136,7 @@ class TestAddImageWideReal(TestCase):
     def tearDown(self) -> None:
         shutil.rmtree(self.test_output) 
         shutil.rmtree(self.test_output2, ignore_errors=True)
+        OutputTreeRegistry.forget(self.test_output)
         return super().tearDown()
 
     def test_same_img_resize(self):
@@ -180,5 +200,25 @@ class TestAddImageWideReal(TestCase):
             os.path.basename(self.epic2.storage_path)
         )
 
+
+class TestEvaluate(TestCase):
+    def setUp(self) -> None:
+        self.epic = EvaluatedPic(TEST_PIC_PATH)
+
+    def test_evaluate(self):
+        self.epic.add_category("cat1", ["cat1"])
+        self.epic.evaluate("cat1", 2)
+        self.epic.evaluate("eval1", 1)
+        self.assertEqual(self.epic.evals, {"cat1": 2, "eval1": 1})
+
+    def test_evaluate_none_removes_mark(self):
+        self.epic.add_category("cat1", ["cat1"])
+        self.epic.evaluate("cat1", 2)
+        self.epic.evaluate("cat1", None)
+        self.assertEqual(self.epic.evals, {})
+        self.assertEqual(self.epic.categories, [])
+        self.epic.evaluate("eval1", None)
+        self.assertEqual(self.epic.evals, {})
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,145 @@
+""" This module has unit-tests for ingest module: images of the inbox registered
+in new uncategorized nodes, images already in the databank skipped and files
+that can't be read left in the inbox. The outputs tree is built in a temporary
+working folder, since databank paths are relative to it.
+"""
+import os
+import shutil
+import sys
+import tempfile
+from pathlib import Path
+from unittest import TestCase, main
+from unittest.mock import patch
+
+from PIL import Image
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+from content_store import ContentStore, content_hash
+from databank import JSONDataBank
+from file_utils import DEFAULT_DB_PATH, DEFAULT_OUTPUT
+from image_nodes import DEFAULT_UNCATEGORIZED_OUTPUT, EvaluatedPic
+from ingest import IngestPipeline
+from output_registry import OutputTreeRegistry
+from storage_profile import DEFAULT_PROFILE_KEY, StorageProfile
+
+INBOX = "inputs"
+UNCATEGORIZED_DB_PATH = os.path.join(DEFAULT_DB_PATH, DEFAULT_UNCATEGORIZED_OUTPUT)
+
+
+class TestIngestPipeline(TestCase):
+    def setUp(self) -> None:
+        self.cwd = os.getcwd()
+        self.root = tempfile.mkdtemp()
+        os.chdir(self.root)
+        os.makedirs(INBOX)
+        self.images = 0
+
+    def tearDown(self) -> None:
+        os.chdir(self.cwd)
+        EvaluatedPic.content_store = None
+        EvaluatedPic.storage_profiles = {}
+        OutputTreeRegistry.forget(DEFAULT_OUTPUT)
+        shutil.rmtree(self.root)
+
+    def new_image(
+        self, color: tuple[int, int, int], file_format: str = "jpeg"
+    ) -> str:
+        self.images += 1
+        path = os.path.join(INBOX, f"new{self.images}.{file_format}")
+        Image.new("RGB", (30, 20), color).save(path)
+        return path
+
+    def ingest(self, paths: list[str]) -> list[EvaluatedPic]:
+        return IngestPipeline(workers=2).process(paths)
+
+    def saved_images(self) -> list[EvaluatedPic]:
+        return JSONDataBank.read(DEFAULT_DB_PATH, DEFAULT_DB_PATH).list_images()
+
+    def test_registers_images(self):
+        paths = [self.new_image((200, 0, 0)), self.new_image((0, 200, 0))]
+        pics = self.ingest(paths)
+
+        self.assertEqual(len(pics), 2)
+        for path, pic in zip(paths, pics):
+            self.assertFalse(os.path.exists(path))
+            self.assertTrue(os.path.isfile(pic.storage_path))
+            self.assertEqual(pic.content_hash, content_hash(pic.storage_path))
+        saved = self.saved_images()
+        self.assertEqual(
+            {pic.storage_path for pic in saved}, {pic.storage_path for pic in pics}
+        )
+        self.assertTrue(all(pic.content_hash is not None for pic in saved))
+
+    def test_existing_nodes_not_rewritten(self):
+        self.ingest([self.new_image((200, 0, 0))])
+        node_files = os.listdir(UNCATEGORIZED_DB_PATH)
+        node_path = os.path.join(UNCATEGORIZED_DB_PATH, node_files[0])
+        with open(node_path, "rb") as node_file:
+            node_data = node_file.read()
+
+        self.ingest([self.new_image((0, 200, 0))])
+        self.assertEqual(len(os.listdir(UNCATEGORIZED_DB_PATH)), 2)
+        with open(node_path, "rb") as node_file:
+            self.assertEqual(node_file.read(), node_data)
+        self.assertEqual(len(self.saved_images()), 2)
+
+    def test_duplicates_skipped(self):
+        path = self.new_image((200, 0, 0))
+        copy_path = os.path.join(INBOX, "copy.jpeg")
+        shutil.copy(path, copy_path)
+        self.assertEqual(len(self.ingest([path, copy_path])), 1)
+
+        # A new pipeline, e.g. after a restart, knows images of the databank
+        again_path = os.path.join(INBOX, "again.jpeg")
+        shutil.copy(self.saved_images()[0].storage_path, again_path)
+        self.assertEqual(self.ingest([again_path]), [])
+        self.assertTrue(os.path.isfile(again_path))
+        self.assertEqual(len(self.saved_images()), 1)
+
+    def test_converted_duplicates_skipped(self):
+        path = self.new_image((0, 0, 200), file_format="png")
+        copy_path = os.path.join(INBOX, "copy.png")
+        shutil.copy(path, copy_path)
+        pics = self.ingest([path])
+        self.assertEqual(len(pics), 1)
+        self.assertNotEqual(os.path.splitext(pics[0].storage_path)[1], ".png")
+
+        self.assertEqual(self.ingest([copy_path]), [])
+        self.assertEqual(len(self.saved_images()), 1)
+
+    def test_converted_once_to_default_profile(self):
+        EvaluatedPic.storage_profiles = {
+            DEFAULT_PROFILE_KEY: StorageProfile("webp", 90, 1600)
+        }
+        path = self.new_image((0, 0, 200), file_format="png")
+        with patch.object(
+            Image.Image, "save", autospec=True, side_effect=Image.Image.save
+        ) as saved:
+            pics = self.ingest([path])
+        self.assertEqual(saved.call_count, 1)
+        self.assertEqual(os.path.splitext(pics[0].storage_path)[1], ".webp")
+        self.assertEqual(pics[0].content_hash, content_hash(pics[0].storage_path))
+
+    def test_duplicates_of_content_store_skipped(self):
+        EvaluatedPic.content_store = ContentStore()
+        path = self.new_image((200, 0, 0))
+        stored_path = os.path.join(self.root, "stored.jpeg")
+        shutil.copy(path, stored_path)
+        EvaluatedPic.content_store.adopt(stored_path)
+
+        self.assertEqual(self.ingest([path]), [])
+        self.assertTrue(os.path.isfile(path))
+
+    def test_unreadable_file_left_in_inbox(self):
+        path = os.path.join(INBOX, "broken.jpeg")
+        with open(path, "wb") as broken_file:
+            broken_file.write(b"not an image")
+        pipeline = IngestPipeline(workers=2)
+        self.assertEqual(pipeline.process([path]), [])
+        self.assertTrue(os.path.isfile(path))
+        self.assertFalse(os.path.isdir(UNCATEGORIZED_DB_PATH))
+
+
+if __name__ == "__main__":
+    main()
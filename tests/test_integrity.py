@@ -0,0 +1,151 @@
+""" This module has unit-tests for integrity module: issues found by the databank
+verifier and their repair.
+"""
+import os
+import shutil
+import sys
+import tempfile
+from pathlib import Path
+from unittest import TestCase, main
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+from image_nodes import EvaluatedPic, ImageNodesHolder
+from integrity import (MISPLACED_FILE, MISSING_FILE, ORPHANED_IMAGE,
+                       RANKS_MISMATCH, DatabankVerifier)
+from output_registry import OutputTreeRegistry
+
+TEST_PIC_PATH = "./tests/test_assets/1.jpg"
+CATEGORIES = ["cat1"]
+
+
+class TestDatabankVerifier(TestCase):
+    def setUp(self) -> None:
+        self.root = tempfile.mkdtemp()
+        self.output_folder = os.path.join(self.root, "outputs")
+        self.default_output_folder = EvaluatedPic.output_folder
+        EvaluatedPic.output_folder = self.output_folder
+        self.holder = ImageNodesHolder()
+
+    def tearDown(self) -> None:
+        EvaluatedPic.output_folder = self.default_output_folder
+        OutputTreeRegistry.forget(self.output_folder)
+        shutil.rmtree(self.root)
+
+    def stored_pic(self, name: str, mark: int = 2) -> EvaluatedPic:
+        path = os.path.join(self.root, f"{name}.jpg")
+        shutil.copy(TEST_PIC_PATH, path)
+        pic = EvaluatedPic(path, resize=False)
+        pic.add_category("cat1", CATEGORIES)
+        pic.evaluate("cat1", mark)
+        self.holder.post_pic(pic)
+        return pic
+
+    def issues(self, excluded: EvaluatedPic | None = None) -> dict[str, str]:
+        verifier = DatabankVerifier(self.holder, self.output_folder, excluded=excluded)
+        plan = verifier.verify()
+        self.plan = plan
+        return {issue.path: issue.kind for issue in plan.issues}
+
+    def test_consistent_databank(self):
+        self.stored_pic("a")
+        self.stored_pic("b", mark=1)
+        self.assertEqual(self.issues(), {})
+
+    def test_missing_file(self):
+        pic = self.stored_pic("a")
+        os.remove(pic.storage_path)
+        self.assertEqual(self.issues(), {pic.storage_path: MISSING_FILE})
+
+        removed, _ = self.plan.apply(self.holder)
+        self.assertEqual(removed, [pic])
+        self.assertEqual(self.holder.list_images(), [])
+
+    def test_orphaned_image(self):
+        pic = self.stored_pic("a")
+        orphan_path = os.path.join(os.path.dirname(pic.storage_path), "orphan.jpeg")
+        shutil.copy(TEST_PIC_PATH, orphan_path)
+        self.assertEqual(self.issues(), {orphan_path: ORPHANED_IMAGE})
+
+        _, added = self.plan.apply(self.holder)
+        self.assertEqual(len(added), 1)
+        self.assertEqual(added[0].categories, [])
+        self.assertTrue(os.path.isfile(added[0].storage_path))
+        self.assertEqual(self.issues(), {})
+
+    def test_orphan_added_meanwhile(self):
+        self.stored_pic("a")
+        orphan_path = os.path.join(self.output_folder, "cat1", "orphan.jpeg")
+        shutil.copy(TEST_PIC_PATH, orphan_path)
+        self.assertEqual(self.issues(), {orphan_path: ORPHANED_IMAGE})
+
+        self.holder.post_pic(EvaluatedPic(orphan_path, resize=False))
+        self.plan.apply(self.holder)
+        self.assertEqual(len(self.holder.list_images()), 2)
+
+    def test_misplaced_file(self):
+        pic = self.stored_pic("a")
+        node_path = pic.storage_path
+        misplaced_path = os.path.join(self.output_folder, "cat1", "a.jpeg")
+        os.rename(node_path, misplaced_path)
+        pic.storage_path = misplaced_path
+        self.assertEqual(self.issues(), {misplaced_path: MISPLACED_FILE})
+
+        self.plan.apply(self.holder)
+        self.assertEqual(os.path.dirname(pic.storage_path), os.path.dirname(node_path))
+        self.assertTrue(os.path.isfile(pic.storage_path))
+        self.assertEqual(self.issues(), {})
+
+    def test_ranks_mismatch(self):
+        pic = self.stored_pic("a")
+        old_node = pic.node_ref
+        pic.evaluate("cat1", 3)
+        self.assertEqual(self.issues(), {pic.storage_path: RANKS_MISMATCH})
+
+        self.plan.apply(self.holder)
+        self.assertIsNot(pic.node_ref, old_node)
+        self.assertEqual(pic.node_ref.ranks, (3,))
+        self.assertEqual(
+            os.path.dirname(pic.storage_path),
+            os.path.join(self.output_folder, "cat1", "3_a"),
+        )
+        self.assertEqual(self.issues(), {})
+
+    def test_ranks_mismatch_fixed_meanwhile(self):
+        pic = self.stored_pic("a")
+        node = pic.node_ref
+        path = pic.storage_path
+        pic.evaluate("cat1", 3)
+        self.issues()
+
+        pic.evaluate("cat1", 2)
+        self.plan.apply(self.holder)
+        self.assertIs(pic.node_ref, node)
+        self.assertEqual(pic.storage_path, path)
+
+    def test_mark_missing_for_category(self):
+        pic = self.stored_pic("a")
+        pic.evaluate("cat1", None)
+        pic.categories.append("cat1")
+        self.assertEqual(self.issues(), {pic.storage_path: RANKS_MISMATCH})
+
+    def test_excluded_image(self):
+        pic = self.stored_pic("a")
+        path = pic.storage_path
+        pic.evaluate("cat1", 3)
+        self.assertEqual(self.issues(excluded=pic), {})
+
+        self.issues()
+        self.plan.apply(self.holder, excluded=pic)
+        self.assertEqual(pic.storage_path, path)
+
+    def test_records_taken_before_edits(self):
+        pic = self.stored_pic("a")
+        verifier = DatabankVerifier(self.holder, self.output_folder)
+        recorded = verifier.record()
+        pic.evaluate("cat1", 3)
+        self.assertEqual(verifier.verify(recorded).issues, [])
+
+
+if __name__ == "__main__":
+    main()
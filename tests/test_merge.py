@@ -0,0 +1,148 @@
+""" This module has unit-tests for merge module: images new to the target,
+duplicates and evaluations resolved by the merge policies. Both outputs trees
+are built in a temporary working folder, since databank paths are relative
+to it.
+"""
+import os
+import shutil
+import sys
+import tempfile
+from pathlib import Path
+from unittest import TestCase, main
+
+from PIL import Image
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+from content_store import ContentStore
+from databank import JSONDataBank
+from file_utils import DEFAULT_DB_PATH, DEFAULT_OUTPUT
+from image_nodes import EvaluatedPic, ImageNodesHolder
+from merge import MANUAL_POLICY, MARKS_POLICY, DatabankMerger
+from output_registry import OutputTreeRegistry
+
+CATEGORIES = ["cat1"]
+SOURCE_FOLDER = "laptop"
+SOURCE_NODE_FOLDER = os.path.join(SOURCE_FOLDER, DEFAULT_OUTPUT, "cat1", "1_a")
+
+
+class TestDatabankMerger(TestCase):
+    def setUp(self) -> None:
+        self.cwd = os.getcwd()
+        self.root = tempfile.mkdtemp()
+        os.chdir(self.root)
+        self.images = 0
+
+    def tearDown(self) -> None:
+        os.chdir(self.cwd)
+        OutputTreeRegistry.forget(DEFAULT_OUTPUT)
+        shutil.rmtree(self.root)
+
+    def new_image(self, color: tuple[int, int, int]) -> str:
+        self.images += 1
+        path = os.path.join(self.root, f"new{self.images}.jpeg")
+        Image.new("RGB", (30, 20), color).save(path)
+        return path
+
+    def build(self, folder: str, images: list[tuple[str, int]]) -> ImageNodesHolder:
+        """Outputs tree with the images evaluated with the marks in the folder."""
+        os.makedirs(folder, exist_ok=True)
+        os.chdir(folder)
+        holder = ImageNodesHolder()
+        for path, mark in images:
+            pic = EvaluatedPic(path, resize=False)
+            pic.add_category("cat1", CATEGORIES)
+            pic.evaluate("cat1", mark)
+            holder.post_pic(pic)
+        JSONDataBank.save(holder, append=False)
+        OutputTreeRegistry.forget(DEFAULT_OUTPUT)
+        os.chdir(self.root)
+        return holder
+
+    def merge(self, target: ImageNodesHolder, policy: str = MANUAL_POLICY):
+        source_output = os.path.join(SOURCE_FOLDER, DEFAULT_OUTPUT)
+        return DatabankMerger(target, source_output, policy).merge()
+
+    def saved_marks(self) -> dict[str, int]:
+        return {
+            os.path.basename(pic.storage_path): pic.evals["cat1"]
+            for pic in JSONDataBank.read(DEFAULT_DB_PATH).list_images()
+        }
+
+    def test_new_image_moved(self):
+        target = self.build(".", [(self.new_image((200, 0, 0)), 2)])
+        self.build(SOURCE_FOLDER, [(self.new_image((0, 200, 0)), 1)])
+        source_file = os.path.join(SOURCE_NODE_FOLDER, "new2.jpeg")
+        self.assertTrue(os.path.isfile(source_file))
+
+        report = self.merge(target)
+        self.assertEqual(report.added, 1)
+        self.assertFalse(os.path.exists(source_file))
+        self.assertTrue(
+            os.path.isfile(os.path.join(DEFAULT_OUTPUT, "cat1", "1_a", "new2.jpeg"))
+        )
+        self.assertEqual(self.saved_marks(), {"new1.jpeg": 2, "new2.jpeg": 1})
+
+    def test_duplicate(self):
+        path = self.new_image((200, 0, 0))
+        copy_path = os.path.join(self.root, "copy.jpeg")
+        shutil.copy(path, copy_path)
+        target = self.build(".", [(path, 2)])
+        self.build(SOURCE_FOLDER, [(copy_path, 2)])
+
+        report = self.merge(target)
+        self.assertEqual((report.added, report.duplicates), (0, 1))
+        self.assertEqual(len(target.list_images()), 1)
+
+    def evaluated_differently(self) -> ImageNodesHolder:
+        path = self.new_image((200, 0, 0))
+        copy_path = os.path.join(self.root, "copy.jpeg")
+        shutil.copy(path, copy_path)
+        target = self.build(".", [(path, 1)])
+        self.build(SOURCE_FOLDER, [(copy_path, 2)])
+        return target
+
+    def test_manual_conflict(self):
+        target = self.evaluated_differently()
+        report = self.merge(target)
+        self.assertEqual(len(report.conflicts), 1)
+        self.assertEqual(target.list_images()[0].evals, {"cat1": 1})
+
+    def test_source_marks_win(self):
+        target = self.evaluated_differently()
+        report = self.merge(target, MARKS_POLICY)
+        self.assertEqual(report.updated, 1)
+        pic = target.list_images()[0]
+        self.assertEqual(pic.evals, {"cat1": 2})
+        self.assertEqual(
+            os.path.dirname(pic.storage_path),
+            os.path.join(DEFAULT_OUTPUT, "cat1", "2_a"),
+        )
+        self.assertTrue(os.path.isfile(pic.storage_path))
+        self.assertEqual(self.saved_marks(), {"new1.jpeg": 2})
+
+    def test_missing_source_file(self):
+        target = self.build(".", [])
+        self.build(SOURCE_FOLDER, [(self.new_image((0, 200, 0)), 1)])
+        os.remove(os.path.join(SOURCE_NODE_FOLDER, "new1.jpeg"))
+        self.assertEqual(self.merge(target).missing, 1)
+
+    def test_linked_stored_file_stays(self):
+        target = self.build(".", [])
+        self.build(SOURCE_FOLDER, [(self.new_image((0, 200, 0)), 1)])
+        source_file = os.path.join(SOURCE_NODE_FOLDER, "new1.jpeg")
+        store = ContentStore(os.path.join(SOURCE_FOLDER, DEFAULT_OUTPUT, "store"))
+        file_hash = store.adopt(source_file)
+        blob = store.blob_path(file_hash, "jpeg")
+        os.remove(source_file)
+        os.symlink(os.path.abspath(blob), source_file)
+
+        self.assertEqual(self.merge(target).added, 1)
+        merged_file = target.list_images()[0].storage_path
+        self.assertFalse(os.path.islink(merged_file))
+        self.assertTrue(os.path.isfile(merged_file))
+        self.assertTrue(os.path.isfile(blob))
+
+
+if __name__ == "__main__":
+    main()
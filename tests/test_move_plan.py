@@ -0,0 +1,128 @@
+""" This module has unit-tests for move_plan module: planned moves of images
+evaluated in deferred mode, committing them and cancelling them.
+"""
+import os
+import shutil
+import sys
+import tempfile
+from pathlib import Path
+from unittest import TestCase, main
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+from databank import JSONDataBank
+from image_nodes import EvaluatedPic, ImageNodesHolder, ImageStorageNode
+from move_plan import MovePlan
+from output_registry import OutputTreeRegistry
+
+TEST_PIC_PATH = "./tests/test_assets/1.jpg"
+CATEGORIES = ["cat1"]
+
+
+class TestMovePlan(TestCase):
+    def setUp(self) -> None:
+        self.root = tempfile.mkdtemp()
+        self.output_folder = os.path.join(self.root, "outputs")
+        self.db_path = os.path.join(self.output_folder, "databank")
+        inputs = os.path.join(self.root, "inputs")
+        os.makedirs(inputs)
+        self.default_output_folder = EvaluatedPic.output_folder
+        EvaluatedPic.output_folder = self.output_folder
+
+        self.holder = ImageNodesHolder(deferred=True)
+        self.pics: list[EvaluatedPic] = []
+        for name in ("a", "b", "c"):
+            path = os.path.join(inputs, f"{name}.jpg")
+            shutil.copy(TEST_PIC_PATH, path)
+            self.pics.append(EvaluatedPic(path))
+
+    def tearDown(self) -> None:
+        EvaluatedPic.output_folder = self.default_output_folder
+        OutputTreeRegistry.forget(self.output_folder)
+        shutil.rmtree(self.root)
+
+    def evaluate(self, pic: EvaluatedPic, mark: int) -> None:
+        pic.add_category("cat1", CATEGORIES)
+        pic.evaluate("cat1", mark)
+        self.holder.post_pic(pic)
+
+    def test_preview_final_destinations(self):
+        for mark in (1, 4, 2):
+            self.evaluate(self.pics[0], mark)
+        self.evaluate(self.pics[1], 3)
+
+        move_plan = MovePlan(self.holder)
+        self.assertEqual(len(move_plan), 2)
+        old_path, new_path = move_plan.preview()[0].split(" -> ")
+        self.assertEqual(old_path, self.pics[0].storage_path)
+        self.assertEqual(
+            new_path, os.path.join(self.output_folder, "cat1", "2_a", "a.jpeg")
+        )
+
+    def test_commit(self):
+        old_paths = [pic.storage_path for pic in self.pics]
+        for pic in self.pics:
+            self.evaluate(pic, 2)
+
+        self.assertEqual(MovePlan(self.holder).commit(), 0)
+        self.assertEqual(self.holder.pending_pics, [])
+        for pic, old_path in zip(self.pics, old_paths):
+            self.assertFalse(os.path.exists(old_path))
+            self.assertTrue(os.path.isfile(pic.storage_path))
+            self.assertEqual(
+                os.path.dirname(pic.storage_path),
+                os.path.join(self.output_folder, "cat1", "2_a"),
+            )
+
+        JSONDataBank.save(self.holder, append=False, root_path=self.db_path)
+        saved = JSONDataBank.read(self.db_path, self.db_path).list_images()
+        saved_paths = {pic.storage_path for pic in saved}
+        self.assertEqual(saved_paths, {pic.storage_path for pic in self.pics})
+
+    def test_partial_failure(self):
+        for pic in self.pics:
+            self.evaluate(pic, 2)
+        missing_path = self.pics[1].storage_path
+        os.remove(missing_path)
+
+        move_plan = MovePlan(self.holder)
+        self.assertEqual(move_plan.commit(), 1)
+        self.assertEqual(len(move_plan), 1)
+        self.assertEqual(self.pics[1].storage_path, missing_path)
+        self.assertTrue(os.path.isfile(self.pics[0].storage_path))
+        self.assertTrue(os.path.isfile(self.pics[2].storage_path))
+
+    def test_cancel_scanned_images(self):
+        old_paths = [pic.storage_path for pic in self.pics]
+        for pic in self.pics:
+            self.evaluate(pic, 2)
+
+        MovePlan(self.holder).cancel()
+        self.assertEqual(self.holder.list_images(), [])
+        self.assertEqual(self.holder.pending_pics, [])
+        for pic, old_path in zip(self.pics, old_paths):
+            self.assertEqual(pic.storage_path, old_path)
+            self.assertTrue(os.path.isfile(old_path))
+
+    def test_cancel_databank_image(self):
+        pic = self.pics[0]
+        pic.add_category("cat1", CATEGORIES)
+        pic.evaluate("cat1", 1)
+        node = ImageStorageNode(name="1_a", evaluated_pics=[pic])
+        self.holder.image_nodes[("cat1",)] = [node]
+
+        self.holder.track(pic)
+        pic.evaluate("cat1", 5)
+        pic.evaluate("eval1", 2)
+        self.holder.post_pic(pic)
+        self.assertIsNot(pic.node_ref, node)
+
+        MovePlan(self.holder).cancel()
+        self.assertIs(pic.node_ref, node)
+        self.assertEqual(pic.evals, {"cat1": 1})
+        self.assertEqual(self.holder.image_nodes[("cat1",)], [node])
+        self.assertEqual(node.images, [pic])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+""" This module has unit-tests for output_registry module. The registry is
+checked against a real temporary tree, which is changed behind its back to make
+sure answers come from memory.
+"""
+import os
+import shutil
+import sys
+import tempfile
+from pathlib import Path
+from unittest import TestCase, main
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+from file_utils import DEFAULT_DATABANK_DIR
+from output_registry import OutputTreeRegistry
+
+
+class TestOutputTreeRegistry(TestCase):
+    def setUp(self) -> None:
+        self.root = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.root, "cat", "A"))
+        os.makedirs(os.path.join(self.root, DEFAULT_DATABANK_DIR))
+        for path in ("cat/A/1.jpeg", "cat/A/1_1.jpeg", f"{DEFAULT_DATABANK_DIR}/x.jpeg"):
+            Path(self.root, path).touch()
+        self.registry = OutputTreeRegistry(self.root)
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.root)
+
+    def test_existing_files_known(self):
+        self.assertTrue(self.registry.is_file(os.path.join(self.root, "cat/A/1.jpeg")))
+        self.assertFalse(self.registry.is_file(os.path.join(self.root, "cat/A/2.jpeg")))
+        self.assertFalse(
+            self.registry.is_file(os.path.join(self.root, DEFAULT_DATABANK_DIR, "x.jpeg"))
+        )
+
+    def test_unique_path_counter(self):
+        path = os.path.join(self.root, "cat/A/1.jpeg")
+        self.assertEqual(
+            self.registry.unique_path(path), os.path.join(self.root, "cat/A/1_2.jpeg")
+        )
+        reserved = {os.path.join(self.root, "cat/A/1_2.jpeg")}
+        self.assertEqual(
+            self.registry.unique_path(path, reserved),
+            os.path.join(self.root, "cat/A/1_3.jpeg"),
+        )
+
+    def test_moves_recorded_without_disk(self):
+        old_path = os.path.join(self.root, "cat/A/1.jpeg")
+        new_folder = os.path.join(self.root, "cat/B")
+        self.registry.ensure_folder(new_folder)
+        self.assertTrue(os.path.isdir(new_folder))
+
+        new_path = os.path.join(new_folder, "1.jpeg")
+        self.registry.record_move(old_path, new_path)
+        self.assertFalse(self.registry.is_file(old_path))
+        self.assertTrue(self.registry.is_file(new_path))
+        self.assertFalse(os.path.isfile(new_path))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+""" This module has unit-tests for preview module: cached reduced copies of
+images, their invalidation and pruning of the previews folder.
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+from unittest import TestCase, main
+
+from PIL import Image
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+from image_metadata import ImageMetadata
+from preview import cached_preview, needs_preview, preview_path, prune_previews
+
+MAX_SIDE = 100
+
+
+class TestPreview(TestCase):
+    def setUp(self) -> None:
+        self.root = tempfile.mkdtemp()
+        self.preview_dir = os.path.join(self.root, "previews")
+        self.path = os.path.join(self.root, "large.jpeg")
+        Image.new("RGB", (400, 200), (200, 10, 10)).save(self.path)
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.root)
+
+    def test_needs_preview(self):
+        self.assertTrue(needs_preview(ImageMetadata(400, 200, "jpeg", "RGB"), 100))
+        self.assertFalse(needs_preview(ImageMetadata(140, 100, "jpeg", "RGB"), 100))
+
+    def test_preview_size(self):
+        path = preview_path(self.path, MAX_SIDE, self.preview_dir)
+        with Image.open(path) as img:
+            self.assertEqual(img.size, (100, 50))
+
+    def test_cache_hit(self):
+        self.assertIsNone(cached_preview(self.path, MAX_SIDE, self.preview_dir))
+        path = preview_path(self.path, MAX_SIDE, self.preview_dir)
+        old_time = time.time() - 3600
+        os.utime(path, (old_time, old_time))
+
+        self.assertEqual(cached_preview(self.path, MAX_SIDE, self.preview_dir), path)
+        self.assertEqual(preview_path(self.path, MAX_SIDE, self.preview_dir), path)
+        self.assertGreater(os.path.getmtime(path), old_time)
+        self.assertEqual(len(os.listdir(self.preview_dir)), 1)
+
+    def test_changed_image_invalidates(self):
+        old_preview = preview_path(self.path, MAX_SIDE, self.preview_dir)
+        Image.new("RGB", (200, 400), (10, 10, 200)).save(self.path)
+        stat = os.stat(self.path)
+        os.utime(self.path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+        self.assertIsNone(cached_preview(self.path, MAX_SIDE, self.preview_dir))
+        new_preview = preview_path(self.path, MAX_SIDE, self.preview_dir)
+        self.assertNotEqual(new_preview, old_preview)
+        with Image.open(new_preview) as img:
+            self.assertEqual(img.size, (50, 100))
+
+    def test_other_side_is_other_preview(self):
+        self.assertNotEqual(
+            preview_path(self.path, MAX_SIDE, self.preview_dir),
+            preview_path(self.path, MAX_SIDE * 2, self.preview_dir),
+        )
+
+
+class TestPrunePreviews(TestCase):
+    def setUp(self) -> None:
+        self.preview_dir = tempfile.mkdtemp()
+        now = time.time()
+        for idx, age in enumerate((10, 20, 30, 1000)):
+            path = os.path.join(self.preview_dir, f"{idx}.jpeg")
+            with open(path, "wb") as fstream:
+                fstream.write(b"x" * 100)
+            os.utime(path, (now - age, now - age))
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.preview_dir)
+
+    def remaining(self) -> list[str]:
+        return sorted(os.listdir(self.preview_dir))
+
+    def test_expired(self):
+        self.assertEqual(prune_previews(self.preview_dir, 10**6, 100), 1)
+        self.assertEqual(self.remaining(), ["0.jpeg", "1.jpeg", "2.jpeg"])
+
+    def test_least_recent_over_size(self):
+        self.assertEqual(prune_previews(self.preview_dir, 250, 10**6), 2)
+        self.assertEqual(self.remaining(), ["0.jpeg", "1.jpeg"])
+
+    def test_missing_folder(self):
+        self.assertEqual(prune_previews(os.path.join(self.preview_dir, "none")), 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+""" This module has unit-tests for the databank mirror of query_service module:
+answers to queries and their invalidation when node files change.
+"""
+import os
+import shutil
+import sys
+import tempfile
+from pathlib import Path
+from unittest import TestCase, main
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+from databank import JSONDataBank
+from image_nodes import EvaluatedPic, ImageNodesHolder, ImageStorageNode
+from query_service import DatabankMirror
+
+
+class TestDatabankMirror(TestCase):
+    def setUp(self) -> None:
+        self.db_path = tempfile.mkdtemp()
+        self.pics = [
+            EvaluatedPic("a.jpg", ["Anatomy"], {"Anatomy": 4, "Color": 2}),
+            EvaluatedPic("b.jpg", ["Anatomy"], {"Anatomy": 5}),
+            EvaluatedPic("c.jpg", [], {"Color": 5}),
+        ]
+        self.save(("Anatomy",), "4_a", self.pics[:2])
+        self.save(("uncategorized",), "a", self.pics[2:])
+        self.mirror = DatabankMirror(self.db_path)
+        self.assertEqual(self.mirror.refresh(), 2)
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.db_path)
+
+    def save(self, nodes_key: tuple[str, ...], name: str, pics: list) -> None:
+        node = ImageStorageNode(name=name, evaluated_pics=pics)
+        JSONDataBank.save(
+            ImageNodesHolder({nodes_key: [node]}), append=False, root_path=self.db_path
+        )
+
+    def test_queries(self):
+        paths = [image["Path"] for image in self.mirror.images("Anatomy>=4")]
+        self.assertEqual(sorted(paths), ["a.jpg", "b.jpg"])
+        self.assertEqual(self.mirror.count("Color>=2"), 2)
+        self.assertEqual(self.mirror.marks("Color"), {2: 1, 5: 1})
+        self.assertEqual(self.mirror.refresh(), 0)
+
+    def test_changed_node_reloaded(self):
+        self.assertEqual(self.mirror.count("Color=5"), 1)
+        recolored = EvaluatedPic("a.jpg", ["Anatomy"], {"Anatomy": 4, "Color": 5})
+        self.save(("Anatomy",), "4_a", [recolored, self.pics[1]])
+        node_path = os.path.join(self.db_path, "Anatomy", "4_a.json")
+        stat = os.stat(node_path)
+        os.utime(node_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+        self.assertEqual(self.mirror.refresh(), 1)
+        self.assertEqual(self.mirror.count("Color=5"), 2)
+
+        os.remove(os.path.join(self.db_path, "uncategorized", "a.json"))
+        self.assertEqual(self.mirror.refresh(), 1)
+        self.assertEqual(self.mirror.count("Color=5"), 1)
+
+
+if __name__ == "__main__":
+    main()
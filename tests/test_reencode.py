@@ -0,0 +1,117 @@
+""" This module has unit-tests for reencode module: re-encoding single files,
+jobs updating the images and selecting images by the profile they use.
+"""
+import json
+import os
+import shutil
+import sys
+import tempfile
+from pathlib import Path
+from unittest import TestCase, main
+
+from PIL import Image
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+from content_store import content_hash
+from eval_schema import EvaluationSchema
+from image_nodes import EvaluatedPic, ImageNodesHolder, ImageStorageNode
+from reencode import ReencodeJob, category_pics, reencode_file
+from storage_profile import StorageProfile
+
+WEBP_PROFILE = StorageProfile("webp", 50, 16)
+SCHEMA = {
+    "Categories": {"cat1": 2, "cat2": 2},
+    "Evals": {},
+    "Storage": {"default": {"Format": "jpeg"}, "cat2": {"Format": "webp"}},
+}
+
+
+class TestReencode(TestCase):
+    def setUp(self) -> None:
+        self.root = tempfile.mkdtemp()
+        self.path = os.path.join(self.root, "image.png")
+        Image.effect_noise((40, 30), 64).convert("RGB").save(self.path)
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.root)
+
+    def test_reencode_file(self):
+        new_path = os.path.join(self.root, "image.webp")
+        old_size = os.path.getsize(self.path)
+        sizes = reencode_file((self.path, new_path, WEBP_PROFILE, True))
+
+        self.assertEqual(sizes, (old_size, os.path.getsize(new_path)))
+        self.assertFalse(os.path.exists(self.path))
+        self.assertEqual(os.listdir(self.root), ["image.webp"])
+        with Image.open(new_path) as img:
+            self.assertEqual(img.format, "WEBP")
+            self.assertEqual(max(img.size), 16)
+
+    def test_reencode_file_keeps_existing_target(self):
+        new_path = os.path.join(self.root, "image.webp")
+        shutil.copy(self.path, new_path)
+        self.assertIsNone(reencode_file((self.path, new_path, WEBP_PROFILE, True)))
+        self.assertTrue(os.path.isfile(self.path))
+
+    def test_reencode_unreadable_file(self):
+        with open(self.path, "wb") as broken_file:
+            broken_file.write(b"not an image")
+        new_path = os.path.join(self.root, "image.webp")
+        self.assertIsNone(reencode_file((self.path, new_path, WEBP_PROFILE, False)))
+        self.assertEqual(os.listdir(self.root), ["image.png"])
+
+    def test_job_updates_images(self):
+        pic = EvaluatedPic(self.path, resize=False)
+        pic.content_hash = content_hash(self.path)
+        old_size = os.path.getsize(self.path)
+
+        saved = ReencodeJob(WEBP_PROFILE, workers=1).run([pic])
+        self.assertEqual(pic.storage_path, os.path.join(self.root, "image.webp"))
+        self.assertEqual(saved, old_size - os.path.getsize(pic.storage_path))
+        self.assertEqual(pic.metadata.file_format, "webp")
+        self.assertTrue(pic.metadata.matches_file(pic.storage_path))
+        self.assertIsNone(pic.content_hash)
+
+
+class TestCategoryPics(TestCase):
+    def setUp(self) -> None:
+        self.root = tempfile.mkdtemp()
+        schema_path = os.path.join(self.root, "schema.json")
+        with open(schema_path, "w", encoding="utf-8") as fstream:
+            json.dump(SCHEMA, fstream)
+        self.schema = EvaluationSchema(schema_path)
+
+        self.pics: dict[str, EvaluatedPic] = {}
+        for name, categories in (
+            ("none", []),
+            ("cat1", ["cat1"]),
+            ("cat2", ["cat2"]),
+            ("both", ["cat1", "cat2"]),
+        ):
+            pic = EvaluatedPic(os.path.join(self.root, f"{name}.jpeg"), resize=False)
+            pic.categories = categories
+            self.pics[name] = pic
+        self.holder = ImageNodesHolder(
+            {(): [ImageStorageNode(name="a", evaluated_pics=list(self.pics.values()))]}
+        )
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.root)
+
+    def selected(self, category: str) -> set[str]:
+        return {
+            name
+            for name, pic in self.pics.items()
+            if pic in category_pics(self.holder, category, self.schema)
+        }
+
+    def test_category_profile(self):
+        self.assertEqual(self.selected("cat2"), {"cat2", "both"})
+
+    def test_default_profile(self):
+        self.assertEqual(self.selected("default"), {"none", "cat1"})
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+""" This module has unit-tests for session module: orderings computed from
+the session index and the saved session state round trip.
+"""
+import shutil
+import sys
+import tempfile
+from pathlib import Path
+from unittest import TestCase, main
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+from image_nodes import EvaluatedPic
+from session import (TAGS_ORDER, UNEVALUATED_ORDER, SessionIndex, SessionState,
+                     session_orders)
+
+
+class TestSessionIndex(TestCase):
+    def setUp(self) -> None:
+        self.index = SessionIndex()
+        self.index.add("a.jpg", {"cat1": 1}, "")
+        self.index.add("b.jpg", {}, "tree")
+        self.index.add("c.jpg", {"cat1": 2}, "Sky")
+        self.index.add("d.jpg", {}, "")
+
+    def test_unevaluated_first(self):
+        self.assertEqual(
+            self.index.order(UNEVALUATED_ORDER), ["b.jpg", "d.jpg", "a.jpg", "c.jpg"]
+        )
+
+    def test_by_tags(self):
+        self.assertEqual(
+            self.index.order(TAGS_ORDER), ["c.jpg", "b.jpg", "a.jpg", "d.jpg"]
+        )
+
+    def test_by_eval(self):
+        by_cat1 = session_orders(["cat1"])[-1]
+        self.assertEqual(self.index.order(by_cat1), ["c.jpg", "a.jpg", "b.jpg", "d.jpg"])
+
+    def test_update_moved_pic(self):
+        pic = EvaluatedPic("outputs/cat1/3_a/b.jpg", ["cat1"], {"cat1": 3})
+        self.index.order(UNEVALUATED_ORDER)
+        self.index.update("b.jpg", pic)
+        self.assertTrue(self.index.evaluated(pic.storage_path))
+        self.assertEqual(self.index.order(UNEVALUATED_ORDER)[0], "d.jpg")
+        self.assertEqual(len(self.index), 4)
+
+
+class TestSessionState(TestCase):
+    def setUp(self) -> None:
+        self.sessions_dir = tempfile.mkdtemp()
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.sessions_dir)
+
+    def test_round_trip(self):
+        self.assertIsNone(SessionState.load("inputs", self.sessions_dir))
+        SessionState("inputs", TAGS_ORDER, ["b.jpg", "a.jpg"], 1).save(self.sessions_dir)
+        state = SessionState.load("inputs", self.sessions_dir)
+        self.assertIsNotNone(state)
+        self.assertEqual(state.order, TAGS_ORDER)
+        self.assertEqual(state.paths, ["b.jpg", "a.jpg"])
+        self.assertEqual(state.cursor, 1)
+
+
+if __name__ == "__main__":
+    main()
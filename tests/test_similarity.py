@@ -0,0 +1,114 @@
+""" This module has unit-tests for similarity module: image features, nearest
+neighbors, ordering and the features cache.
+"""
+import os
+import shutil
+import sys
+import tempfile
+from pathlib import Path
+from unittest import TestCase, main
+
+import numpy as np
+from PIL import Image
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+from similarity import (FEATURE_SIZE, SimilarityIndex, compute_features,
+                        start_similarity_order)
+
+COLORS = [
+    (250, 10, 10),
+    (240, 20, 20),
+    (10, 250, 10),
+    (20, 240, 20),
+    (10, 10, 250),
+    (20, 20, 240),
+]
+
+
+class TestSimilarity(TestCase):
+    def setUp(self) -> None:
+        self.root = tempfile.mkdtemp()
+        self.cache_path = os.path.join(self.root, "similarity.npz")
+        self.paths = []
+        for idx, color in enumerate(COLORS):
+            path = os.path.join(self.root, f"{idx}.png")
+            Image.new("RGB", (40, 30), color).save(path)
+            self.paths.append(path)
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.root)
+
+    def index(self, paths: list[str]) -> SimilarityIndex:
+        similarity_index = SimilarityIndex(self.cache_path)
+        similarity_index.update(paths, workers=1)
+        similarity_index.save()
+        return similarity_index
+
+    def test_compute_features(self):
+        features = compute_features(self.paths[0])
+        self.assertEqual(features.shape, (FEATURE_SIZE,))
+        self.assertAlmostEqual(float(np.linalg.norm(features)), 1.0, places=5)
+        self.assertIsNone(compute_features(os.path.join(self.root, "missing.png")))
+
+    def test_nearest(self):
+        similarity_index = self.index(self.paths)
+        self.assertEqual(similarity_index.nearest(self.paths[0], 1), [self.paths[1]])
+        self.assertEqual(similarity_index.nearest(self.paths[4], 1), [self.paths[5]])
+        self.assertEqual(len(similarity_index.nearest(self.paths[0], 100)), 5)
+
+    def test_order_is_permutation(self):
+        similarity_index = self.index(self.paths)
+        order = similarity_index.similarity_order()
+        self.assertEqual(sorted(order), sorted(self.paths))
+        for pair in ((0, 1), (2, 3), (4, 5)):
+            positions = [order.index(self.paths[idx]) for idx in pair]
+            self.assertEqual(abs(positions[0] - positions[1]), 1)
+
+    def test_order_of_subset(self):
+        similarity_index = self.index(self.paths)
+        subset = self.paths[2:]
+        self.assertEqual(sorted(similarity_index.similarity_order(subset)), subset)
+
+    def test_cache_keeps_other_folders(self):
+        self.index(self.paths[:3])
+        similarity_index = self.index(self.paths[3:])
+        self.assertEqual(sorted(similarity_index.paths), sorted(self.paths))
+        self.assertEqual(sorted(SimilarityIndex(self.cache_path).paths), sorted(self.paths))
+
+    def test_cache_prunes_deleted_files(self):
+        self.index(self.paths[:3])
+        os.remove(self.paths[0])
+        similarity_index = self.index(self.paths[3:])
+        self.assertEqual(sorted(similarity_index.paths), sorted(self.paths[1:]))
+
+    def test_renamed_file_keeps_features(self):
+        similarity_index = self.index(self.paths)
+        features = similarity_index.features[similarity_index.paths.index(self.paths[0])]
+        renamed_path = os.path.join(self.root, "renamed.png")
+        os.rename(self.paths[0], renamed_path)
+
+        similarity_index = self.index([renamed_path])
+        self.assertNotIn(self.paths[0], similarity_index.paths)
+        np.testing.assert_array_equal(similarity_index.features[-1], features)
+
+    def test_broken_cache_read_as_empty(self):
+        with open(self.cache_path, "wb") as cache_file:
+            cache_file.write(b"PK\x03\x04garbage")
+        self.assertEqual(SimilarityIndex(self.cache_path).paths, [])
+
+        self.index(self.paths)
+        self.assertFalse(any(name.endswith(".tmp") for name in os.listdir(self.root)))
+        self.assertEqual(len(SimilarityIndex(self.cache_path).paths), len(self.paths))
+
+    def test_order_done_with_broken_cache(self):
+        with open(self.cache_path, "wb") as cache_file:
+            cache_file.write(b"PK\x03\x04garbage")
+        orders = []
+        start_similarity_order(self.paths, orders.append, self.cache_path).join()
+        self.assertEqual(len(orders), 1)
+        self.assertEqual(sorted(orders[0]), sorted(self.paths))
+
+
+if __name__ == "__main__":
+    main()
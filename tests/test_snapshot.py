@@ -0,0 +1,122 @@
+""" This module has unit-tests for snapshot module: a take, modify and restore
+round trip of outputs with the databank, and garbage collection of stored files.
+"""
+import os
+import shutil
+import sys
+import tempfile
+from pathlib import Path
+from unittest import TestCase, main
+
+from PIL import Image
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+from databank import JSONDataBank
+from file_utils import DEFAULT_DATABANK_DIR
+from image_nodes import EvaluatedPic, ImageNodesHolder
+from output_registry import OutputTreeRegistry
+from snapshot import OBJECTS_DIR, SnapshotStore
+
+CATEGORIES = ["cat1"]
+
+
+class TestSnapshotStore(TestCase):
+    def setUp(self) -> None:
+        self.root = tempfile.mkdtemp()
+        self.output_folder = os.path.join(self.root, "outputs")
+        self.db_path = os.path.join(self.output_folder, DEFAULT_DATABANK_DIR)
+        self.default_output_folder = EvaluatedPic.output_folder
+        EvaluatedPic.output_folder = self.output_folder
+        self.store = SnapshotStore(
+            os.path.join(self.root, "snapshots"), self.output_folder
+        )
+        self.holder = ImageNodesHolder()
+        self.pics = [
+            self.evaluated_pic("a", (200, 0, 0)),
+            self.evaluated_pic("b", (0, 200, 0)),
+        ]
+        self.save_databank()
+
+    def tearDown(self) -> None:
+        EvaluatedPic.output_folder = self.default_output_folder
+        OutputTreeRegistry.forget(self.output_folder)
+        shutil.rmtree(self.root)
+
+    def evaluated_pic(self, name: str, color: tuple[int, int, int]) -> EvaluatedPic:
+        path = os.path.join(self.root, f"{name}.jpeg")
+        Image.new("RGB", (30, 20), color).save(path)
+        pic = EvaluatedPic(path, resize=False)
+        pic.add_category("cat1", CATEGORIES)
+        pic.evaluate("cat1", 1)
+        self.holder.post_pic(pic)
+        return pic
+
+    def save_databank(self) -> None:
+        JSONDataBank.save(self.holder, append=False, root_path=self.db_path)
+
+    def outputs_state(self) -> tuple[dict[str, bytes], dict[str, int]]:
+        """Contents of image files by relative path and marks from the databank."""
+        files: dict[str, bytes] = {}
+        for root, dirs, names in os.walk(self.output_folder):
+            dirs[:] = [dir for dir in dirs if dir != DEFAULT_DATABANK_DIR]
+            for name in names:
+                path = os.path.join(root, name)
+                with open(path, "rb") as fstream:
+                    files[os.path.relpath(path, self.output_folder)] = fstream.read()
+        holder = JSONDataBank.read(self.db_path, self.db_path)
+        marks = {
+            os.path.basename(pic.storage_path): pic.evals["cat1"]
+            for pic in holder.list_images()
+        }
+        return files, marks
+
+    def test_round_trip(self):
+        before = self.outputs_state()
+        name = self.store.take()
+
+        self.pics[0].evaluate("cat1", 2)
+        self.holder.post_pic(self.pics[0])
+        changed_path = self.pics[1].storage_path
+        temp_path = f"{changed_path}.tmp"
+        Image.new("RGB", (30, 20), (0, 0, 200)).save(temp_path, "jpeg")
+        os.replace(temp_path, changed_path)
+        self.evaluated_pic("c", (100, 100, 100))
+        self.save_databank()
+        modified = self.outputs_state()
+        self.assertNotEqual(modified, before)
+
+        aside_path = self.store.restore(name)
+        self.assertEqual(self.outputs_state(), before)
+        self.assertTrue(os.path.isdir(aside_path))
+
+    def test_unchanged_files_not_stored_again(self):
+        self.store.take()
+        self.store.take()
+        self.assertEqual(len(self.store.names()), 2)
+        objects = [
+            file
+            for _, _, files in os.walk(os.path.join(self.store.root, OBJECTS_DIR))
+            for file in files
+        ]
+        self.assertEqual(len(objects), 2)
+
+    def test_garbage_collection_keeps_referenced(self):
+        first = self.store.take()
+        removed_path = self.pics[0].storage_path
+        self.pics[0].node_ref.pop_image(self.pics[0])
+        os.remove(removed_path)
+        self.save_databank()
+        second = self.store.take()
+
+        self.assertEqual(self.store.collect_garbage(), 0)
+        os.remove(os.path.join(self.store.root, "manifests", f"{first}.json"))
+        self.assertGreater(self.store.collect_garbage(), 0)
+
+        expected = self.outputs_state()
+        self.store.restore(second)
+        self.assertEqual(self.outputs_state(), expected)
+
+
+if __name__ == "__main__":
+    main()
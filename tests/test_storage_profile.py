@@ -0,0 +1,127 @@
+""" This module has unit-tests for storage_profile module: reading profiles
+from the schema, choosing the profile of an image and re-encode decisions.
+"""
+import json
+import os
+import sys
+import tempfile
+from pathlib import Path
+from unittest import TestCase, main
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+from eval_schema import EvaluationSchema
+from file_utils import DEFAULT_STORAGE_PROFILE, needs_reencode
+from image_metadata import ImageMetadata
+from storage_profile import (DEFAULT_PROFILE_KEY, StorageProfile,
+                             normalize_format, profile_for)
+
+WEBP_PROFILE = StorageProfile("webp", 80, 1200)
+PNG_PROFILE = StorageProfile("png", 80, 2000)
+
+
+class TestStorageProfile(TestCase):
+    def test_from_json_defaults(self):
+        profile = StorageProfile.from_json({"Quality": 90}, WEBP_PROFILE)
+        self.assertEqual(profile.file_format, "webp")
+        self.assertEqual(profile.quality, 90)
+        self.assertEqual(profile.max_size, 1200)
+        self.assertFalse(profile.keep_metadata)
+
+    def test_format_aliases(self):
+        self.assertEqual(normalize_format("JPG"), "jpeg")
+        self.assertEqual(normalize_format("WebP"), "webp")
+        profile = StorageProfile.from_json({"Format": "jpg"}, WEBP_PROFILE)
+        self.assertEqual(profile.file_format, "jpeg")
+
+    def test_unknown_format(self):
+        with self.assertRaises(ValueError):
+            StorageProfile.from_json({"Format": "gif"}, WEBP_PROFILE)
+        with self.assertRaises(ValueError):
+            normalize_format("")
+
+    def test_allowed_modes(self):
+        self.assertNotIn("RGBA", DEFAULT_STORAGE_PROFILE.allowed_modes)
+        self.assertIn("RGBA", PNG_PROFILE.allowed_modes)
+
+    def test_save_options(self):
+        image_info = {"exif": b"exif", "icc_profile": b""}
+        self.assertEqual(WEBP_PROFILE.save_options(image_info), {"quality": 80})
+        self.assertEqual(PNG_PROFILE.save_options(image_info), {})
+        keeping = StorageProfile("jpeg", 70, 100, keep_metadata=True)
+        self.assertEqual(
+            keeping.save_options(image_info), {"quality": 70, "exif": b"exif"}
+        )
+
+
+class TestProfileFor(TestCase):
+    def setUp(self) -> None:
+        self.profiles = {
+            "cat1": PNG_PROFILE,
+            "cat2": WEBP_PROFILE,
+            DEFAULT_PROFILE_KEY: DEFAULT_STORAGE_PROFILE,
+        }
+
+    def test_highest_priority_category(self):
+        self.assertIs(
+            profile_for(["cat2", "cat1"], self.profiles, PNG_PROFILE), WEBP_PROFILE
+        )
+        self.assertIs(
+            profile_for(["cat3", "cat1"], self.profiles, WEBP_PROFILE), PNG_PROFILE
+        )
+
+    def test_default_profile(self):
+        self.assertIs(
+            profile_for(["cat3"], self.profiles, PNG_PROFILE), DEFAULT_STORAGE_PROFILE
+        )
+        self.assertIs(profile_for([], {}, PNG_PROFILE), PNG_PROFILE)
+
+
+class TestReencodeDecisions(TestCase):
+    def test_profile_format(self):
+        jpeg = ImageMetadata(100, 100, "jpeg", "RGB")
+        self.assertFalse(needs_reencode(jpeg, False, StorageProfile("jpg", 75, 200)))
+        self.assertTrue(needs_reencode(jpeg, False, WEBP_PROFILE))
+
+    def test_transparency(self):
+        rgba = ImageMetadata(100, 100, "png", "RGBA")
+        self.assertFalse(needs_reencode(rgba, True, PNG_PROFILE))
+        self.assertTrue(needs_reencode(rgba, False, DEFAULT_STORAGE_PROFILE))
+
+    def test_profile_max_size(self):
+        large = ImageMetadata(1500, 1000, "webp", "RGB")
+        self.assertTrue(needs_reencode(large, True, WEBP_PROFILE))
+        self.assertFalse(needs_reencode(large, True, StorageProfile("webp", 80, 1600)))
+
+
+class TestSchemaProfiles(TestCase):
+    def setUp(self) -> None:
+        self.root = tempfile.mkdtemp()
+        self.schema_path = os.path.join(self.root, "schema.json")
+
+    def tearDown(self) -> None:
+        os.remove(self.schema_path)
+        os.rmdir(self.root)
+
+    def load(self, storage_json: dict) -> EvaluationSchema:
+        schema_json = {"Categories": {"cat1": 2}, "Evals": {}, "Storage": storage_json}
+        with open(self.schema_path, "w", encoding="utf-8") as fstream:
+            json.dump(schema_json, fstream)
+        return EvaluationSchema(self.schema_path)
+
+    def test_profiles_inherit_default(self):
+        schema = self.load(
+            {"default": {"Format": "jpg", "Quality": 85}, "cat1": {"MaxSize": 800}}
+        )
+        cat1_profile = schema.storage_profiles["cat1"]
+        self.assertEqual(cat1_profile.file_format, "jpeg")
+        self.assertEqual(cat1_profile.quality, 85)
+        self.assertEqual(cat1_profile.max_size, 800)
+
+    def test_unknown_format_rejected_on_load(self):
+        with self.assertRaises(ValueError):
+            self.load({"cat1": {"Format": "bmp"}})
+
+
+if __name__ == "__main__":
+    main()